@@ -0,0 +1,152 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Benchmarks the binary tensor gateway against JSON encoded tensors.
+
+Without a model, only the encoding and decoding of each path is timed:
+
+    python benchmark_gateway.py --shape 1,2048,2048,1
+
+With a model, requests are timed against running servers:
+
+    python benchmark_gateway.py --shape 1,512,512,2 --model model \\
+        --rest-url http://localhost:8501 \\
+        --gateway-url http://localhost:8502
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import time
+import urllib.request
+
+import numpy as np
+
+from sidecars import gateway
+from sidecars import protobuf
+
+
+def get_arg_parser():
+    """argument parser to consume command line arguments"""
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--shape', default='1,2048,2048,1',
+                        help='Comma separated shape of the input image.')
+
+    parser.add_argument('--dtype', default='float32',
+                        help='dtype of the input image.')
+
+    parser.add_argument('--iterations', type=int, default=5,
+                        help='Number of timed iterations of each path.')
+
+    parser.add_argument('--model',
+                        help='Name of the model to benchmark on the servers.')
+
+    parser.add_argument('--input-name', default='image',
+                        help='Name of the model input.')
+
+    parser.add_argument('--rest-url', default='http://localhost:8501',
+                        help='URL of the TensorFlow Serving REST API.')
+
+    parser.add_argument('--gateway-url', default='http://localhost:8502',
+                        help='URL of the binary tensor gateway.')
+
+    return parser
+
+
+def timeit(function, iterations):
+    """Get the mean seconds per call and the result of the last call."""
+    start = time.time()
+    for _ in range(iterations):
+        result = function()
+    return (time.time() - start) / iterations, result
+
+
+def json_codec(image):
+    """Encode the request and decode an equally sized JSON response."""
+    body = json.dumps({'instances': image.tolist()}).encode('utf-8')
+    decoded = np.array(json.loads(body.decode('utf-8'))['instances'],
+                       dtype=image.dtype)
+    return len(body), decoded
+
+
+def binary_codec(image):
+    """Encode the .npy request, convert it to a PredictRequest and decode an
+    equally sized PredictResponse."""
+    body = b''.join(gateway.write_array(image))
+    array = gateway.read_array(body, gateway.NPY_CONTENT_TYPE)
+    protobuf.encode_predict_request(
+        'model', {'image': gateway.to_tensor(array)})
+
+    response = protobuf.encode_predict_response(
+        {'image': gateway.to_tensor(array)})
+    outputs = protobuf.decode_predict_response(response)
+    decoded = gateway.to_array(outputs['image'])
+    return len(body), decoded
+
+
+def post(url, body, content_type):
+    request = urllib.request.Request(
+        url, data=body, headers={'Content-Type': content_type})
+    with urllib.request.urlopen(request) as response:
+        return response.read()
+
+
+def benchmark_servers(args, image):
+    """Time predictions through the REST API and the gateway."""
+    path = '/v1/models/{}:predict'.format(args.model)
+
+    body = json.dumps({'instances': image.tolist()}).encode('utf-8')
+    seconds, _ = timeit(lambda: json.loads(post(
+        args.rest_url + path, body, 'application/json').decode('utf-8')),
+        args.iterations)
+    print('REST API (JSON): {:.1f} ms/request, {} bytes'.format(
+        seconds * 1000, len(body)))
+
+    body = b''.join(gateway.write_array(image))
+    url = args.gateway_url + path
+    seconds, _ = timeit(lambda: post(url, body, gateway.NPY_CONTENT_TYPE),
+                        args.iterations)
+    print('Gateway (npy):   {:.1f} ms/request, {} bytes'.format(
+        seconds * 1000, len(body)))
+
+
+if __name__ == '__main__':
+    ARGS = get_arg_parser().parse_args()
+
+    SHAPE = [int(d) for d in ARGS.shape.split(',')]
+    IMAGE = np.random.random(SHAPE).astype(ARGS.dtype)
+
+    for NAME, CODEC in (('JSON', json_codec), ('Binary', binary_codec)):
+        SECONDS, (SIZE, DECODED) = timeit(lambda: CODEC(IMAGE),
+                                          ARGS.iterations)
+        np.testing.assert_array_equal(DECODED, IMAGE)
+        print('{:<6} encode/decode: {:.1f} ms, {} bytes'.format(
+            NAME, SECONDS * 1000, SIZE))
+
+    if ARGS.model:
+        benchmark_servers(ARGS, IMAGE)
@@ -0,0 +1,17 @@
+#!/bin/bash
+
+# run the caching proxy in front of the gRPC and REST APIs
+python run_sidecar.py \
+    --upstream-host=$TF_SERVING_HOST \
+    --upstream-port=$TF_SERVING_PORT \
+    --upstream-rest-port=$TF_SERVING_REST_API_PORT \
+    --model-config-file=$MODEL_CONFIG_FILE \
+    --max-message-bytes=$GRPC_MAX_MESSAGE_BYTES \
+    cache \
+    --port=$PORT \
+    --rest-api-port=$REST_API_PORT \
+    --cache-bytes=$CACHE_BYTES \
+    --cache-disk-path=$CACHE_DISK_PATH \
+    --cache-disk-bytes=$CACHE_DISK_BYTES \
+    --cache-ttl=$CACHE_TTL_SECONDS \
+    --metrics-path=$CACHE_METRICS_PATH
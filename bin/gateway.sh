@@ -0,0 +1,22 @@
+#!/bin/bash
+
+# run the binary tensor gateway to the gRPC API
+python run_sidecar.py \
+    --upstream-host=$TF_SERVING_HOST \
+    --upstream-port=$TF_SERVING_PORT \
+    --upstream-rest-port=$TF_SERVING_REST_API_PORT \
+    --model-config-file=$MODEL_CONFIG_FILE \
+    --max-message-bytes=$GRPC_MAX_MESSAGE_BYTES \
+    gateway \
+    --port=$GATEWAY_PORT \
+    --input-name=$GATEWAY_INPUT_NAME \
+    --pool-size=$GATEWAY_POOL_SIZE \
+    --timeout=$GATEWAY_TIMEOUT \
+    --compression-level=$GATEWAY_COMPRESSION_LEVEL \
+    --catalog-file=$RESIDENCY_CATALOG_FILE \
+    --memory-budget=$RESIDENCY_MEMORY_BUDGET \
+    --model-sizes-file=$MODEL_SIZES_FILE \
+    --idle-seconds=$RESIDENCY_IDLE_SECONDS \
+    --min-residency-seconds=$RESIDENCY_MIN_SECONDS \
+    --half-life=$RESIDENCY_HALF_LIFE \
+    --monitoring-path=$RESIDENCY_MONITORING_PATH
@@ -0,0 +1,8 @@
+#!/bin/bash
+
+# publish the manifest of the models of each source
+python write_config_file.py publish \
+    --storage-bucket=$STORAGE_BUCKET \
+    --model-prefix=$MODEL_PREFIX \
+    --source=$MODEL_SOURCES \
+    --s3-endpoint-url=$S3_ENDPOINT_URL
@@ -0,0 +1,10 @@
+#!/bin/bash
+
+# serve the readiness of the models in the model config file
+python run_sidecar.py \
+    --upstream-host=$TF_SERVING_HOST \
+    --upstream-rest-port=$TF_SERVING_REST_API_PORT \
+    --model-config-file=$MODEL_CONFIG_FILE \
+    readiness \
+    --port=$READINESS_PORT \
+    --interval=$READINESS_INTERVAL
@@ -1,5 +1,24 @@
 #!/bin/bash
 
+# Load the server flags sized by write_config_file.py, if any.
+if [ -f "${SERVER_FLAGS_FILE}" ] ; then
+  echo "Using server flags file: $SERVER_FLAGS_FILE"
+  set -a
+  source "$SERVER_FLAGS_FILE"
+  set +a
+fi
+
+# Set the gRPC message size limits, if given.
+if [ -n "${GRPC_MAX_MESSAGE_BYTES}" ] ; then
+  GRPC_CHANNEL_ARGS="grpc.max_receive_message_length=$GRPC_MAX_MESSAGE_BYTES,grpc.max_send_message_length=$GRPC_MAX_MESSAGE_BYTES${GRPC_CHANNEL_ARGS:+,$GRPC_CHANNEL_ARGS}"
+fi
+
+# TensorFlow Serving does not accept the intra and inter op parallelism
+# together with a non-zero session parallelism.
+if [ -n "${TF_SESSION_PARALLELISM}" ] && [ "${TF_SESSION_PARALLELISM}" != "0" ] ; then
+  unset TF_INTRA_OP_PARALLELISM TF_INTER_OP_PARALLELISM
+fi
+
 # Add options for tensorflow_model_server based on settings
 export options=(
   "--port=$PORT"
@@ -9,7 +28,29 @@ export options=(
   "--grpc_channel_arguments=$GRPC_CHANNEL_ARGS"
   "--tensorflow_session_parallelism=$TF_SESSION_PARALLELISM"
   "--model_config_file=$MODEL_CONFIG_FILE"
+  "--model_config_file_poll_wait_seconds=$MODEL_CONFIG_POLL_WAIT_SECONDS"
+)
+
+# Add each sized server flag that is set.
+declare -A server_flags=(
+  [NUM_LOAD_THREADS]=num_load_threads
+  [NUM_UNLOAD_THREADS]=num_unload_threads
+  [TF_INTRA_OP_PARALLELISM]=tensorflow_intra_op_parallelism
+  [TF_INTER_OP_PARALLELISM]=tensorflow_inter_op_parallelism
+  [FILE_SYSTEM_POLL_WAIT_SECONDS]=file_system_poll_wait_seconds
+  [PER_PROCESS_GPU_MEMORY_FRACTION]=per_process_gpu_memory_fraction
 )
+for name in "${!server_flags[@]}" ; do
+  if [ -n "${!name}" ] ; then
+    options+=("--${server_flags[$name]}=${!name}") ;
+  fi
+done
+
+# Version labels in the config at startup name versions that are not loaded
+# yet, which TensorFlow Serving refuses unless allowed.
+if [ -n "${ALLOW_UNAVAILABLE_VERSION_LABELS}" ] ; then
+  options+=("--allow_version_labels_for_unavailable_models=$ALLOW_UNAVAILABLE_VERSION_LABELS") ;
+fi
 
 # If PROMETHEUS_MONITORING_ENABLED, provide the monitoring config file.
 if [ "${PROMETHEUS_MONITORING_ENABLED}" == "true" ] ; then
@@ -4,7 +4,17 @@
 python write_config_file.py \
     --storage-bucket=$STORAGE_BUCKET \
     --model-prefix=$MODEL_PREFIX \
+    --source=$MODEL_SOURCES \
+    --collision=$MODEL_COLLISION \
+    --s3-endpoint-url=$S3_ENDPOINT_URL \
+    --model-listing=$MODEL_LISTING \
+    --max-manifest-age=$MAX_MANIFEST_AGE \
+    --manifest-cache-dir=$MANIFEST_CACHE_DIR \
     --file-path=$MODEL_CONFIG_FILE \
+    --version-labels-file=$VERSION_LABELS_FILE \
+    --model-versions-file=$MODEL_VERSIONS_FILE \
+    --optimize=$OPTIMIZE_MODELS \
+    --optimization-samples=$OPTIMIZATION_SAMPLES \
     --monitoring-enabled=$PROMETHEUS_MONITORING_ENABLED \
     --monitoring-path=$PROMETHEUS_MONITORING_PATH \
     --monitoring-file-path=$MONITORING_CONFIG_FILE \
@@ -12,4 +22,9 @@ python write_config_file.py \
     --max-batch-size=$MAX_BATCH_SIZE \
     --batch-timeout=$BATCH_TIMEOUT_MICROS \
     --max-enqueued-batches=$MAX_ENQUEUED_BATCHES \
-    --batch-file-path=$BATCHING_CONFIG_FILE
+    --batch-file-path=$BATCHING_CONFIG_FILE \
+    --server-flags-file-path=$SERVER_FLAGS_FILE \
+    --model-sizes-file-path=$MODEL_SIZES_FILE \
+    --cpu-limit=$SERVER_CPU_LIMIT \
+    --memory-limit=$SERVER_MEMORY_LIMIT \
+    --gpu-memory=$GPU_MEMORY_BYTES
@@ -0,0 +1,264 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Runs the sidecar servers alongside TensorFlow Serving.
+
+Each sidecar is a subcommand, e.g. ``python run_sidecar.py cache``.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+
+from decouple import config
+
+import sidecars
+import writers
+
+from write_config_file import initialize_logger
+
+
+def get_arg_parser():
+    """argument parser to consume command line arguments"""
+    root_dir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='sidecar')
+    subparsers.required = True
+
+    # Shared args
+    parser.add_argument('--upstream-host', default='localhost',
+                        help='Host of TensorFlow Serving.')
+
+    parser.add_argument('--upstream-port', type=int, default=8510,
+                        help='gRPC port of TensorFlow Serving.')
+
+    parser.add_argument('--upstream-rest-port', type=int, default=8511,
+                        help='REST API port of TensorFlow Serving.')
+
+    parser.add_argument('--model-config-file',
+                        default=os.path.join(root_dir, 'models.conf'),
+                        help='Full filepath of the model configuration file')
+
+    parser.add_argument('--max-message-bytes', type=int, default=-1,
+                        help='Maximum size of gRPC messages, -1 for no limit')
+
+    # Cache Args
+    cache = subparsers.add_parser('cache', help='Caching proxy of the '
+                                                'gRPC and REST APIs.')
+
+    cache.add_argument('--port', type=int, default=8500,
+                       help='Port of the caching gRPC proxy.')
+
+    cache.add_argument('--rest-api-port', type=int, default=8501,
+                       help='Port of the caching REST proxy.')
+
+    cache.add_argument('--cache-bytes', type=int, default=256 * 1024 ** 2,
+                       help='Maximum size of the in-memory cache in bytes.')
+
+    cache.add_argument('--cache-disk-path', default='',
+                       help='Directory of the on-disk cache tier.')
+
+    cache.add_argument('--cache-disk-bytes', type=int, default=0,
+                       help='Maximum size of the on-disk cache in bytes.')
+
+    cache.add_argument('--cache-ttl', type=float, default=0,
+                       help='Seconds before cached responses expire. '
+                            'Never if 0.')
+
+    cache.add_argument('--metrics-path', default='/cache/metrics',
+                       help='REST endpoint of the cache metrics.')
+
+    # Gateway Args
+    gateway = subparsers.add_parser('gateway', help='Binary tensor REST '
+                                                    'gateway to the gRPC API.')
+
+    gateway.add_argument('--port', type=int, default=8502,
+                         help='Port of the gateway.')
+
+    gateway.add_argument('--input-name', default='image',
+                         help='Default name of the model input.')
+
+    gateway.add_argument('--pool-size', type=int, default=4,
+                         help='Number of gRPC channels to TensorFlow Serving.')
+
+    gateway.add_argument('--timeout', type=float, default=30,
+                         help='Timeout in seconds of each request.')
+
+    gateway.add_argument('--compression-level', type=int, default=0,
+                         help='Gzip level of the responses to clients '
+                              'accepting gzip. Not compressed if 0.')
+
+    gateway.add_argument('--catalog-file', default='',
+                         help='Model config file of all models. If set, the '
+                              'model config file is rewritten with the '
+                              'resident models only.')
+
+    gateway.add_argument('--memory-budget', type=int, default=0,
+                         help='Bytes of the resident models.')
+
+    gateway.add_argument('--model-sizes-file', default='',
+                         help='JSON file of the size of each model.')
+
+    gateway.add_argument('--idle-seconds', type=float, default=600,
+                         help='Seconds without requests before a model is '
+                              'unloaded.')
+
+    gateway.add_argument('--min-residency-seconds', type=float, default=60,
+                         help='Seconds a loaded model is kept resident.')
+
+    gateway.add_argument('--half-life', type=float, default=300,
+                         help='Seconds for request counts to decay by half.')
+
+    gateway.add_argument('--monitoring-path', default='',
+                         help='Prometheus endpoint of TensorFlow Serving to '
+                              'scrape request counts. Requests to the gateway '
+                              'are counted if empty.')
+
+    # Readiness Args
+    readiness = subparsers.add_parser('readiness', help='Readiness endpoint '
+                                                        'of the model load '
+                                                        'state.')
+
+    readiness.add_argument('--port', type=int, default=8503,
+                           help='Port of the readiness endpoint.')
+
+    readiness.add_argument('--interval', type=float, default=5,
+                           help='Seconds between polls of the model status.')
+
+    readiness.add_argument('--ready-path', default='/readyz',
+                           help='REST endpoint of the readiness probe.')
+
+    readiness.add_argument('--report-path', default='/models',
+                           help='REST endpoint of the model load report.')
+
+    return parser
+
+
+def run_cache(args):
+    cache = sidecars.ResponseCache(
+        max_bytes=args.cache_bytes,
+        disk_path=args.cache_disk_path,
+        max_disk_bytes=args.cache_disk_bytes,
+        ttl=args.cache_ttl)
+
+    sidecars.ModelConfigWatcher(
+        args.model_config_file, cache,
+        status_client=writers.ModelStatusClient(
+            host=args.upstream_host, port=args.upstream_rest_port)).start()
+
+    grpc_proxy = sidecars.GrpcCacheProxy(
+        cache=cache,
+        target='{}:{}'.format(args.upstream_host, args.upstream_port),
+        port=args.port,
+        max_message_bytes=args.max_message_bytes)
+    grpc_proxy.start()
+
+    rest_proxy = sidecars.RestCacheProxy(
+        cache=cache,
+        upstream_host=args.upstream_host,
+        upstream_port=args.upstream_rest_port,
+        port=args.rest_api_port,
+        metrics_path=args.metrics_path)
+    rest_proxy.serve_forever()
+
+
+def get_residency_manager(args):
+    model_sizes = {}
+    if args.model_sizes_file:
+        with open(args.model_sizes_file) as f:
+            model_sizes = json.load(f)
+
+    counter = None
+    if args.monitoring_path:
+        counter = sidecars.PrometheusRequestCounter(
+            host=args.upstream_host,
+            port=args.upstream_rest_port,
+            path=args.monitoring_path)
+
+    return sidecars.ResidencyManager(
+        writer=sidecars.ResidentConfigWriter(args.catalog_file),
+        path=args.model_config_file,
+        status_client=writers.ModelStatusClient(
+            host=args.upstream_host, port=args.upstream_rest_port),
+        memory_budget=args.memory_budget,
+        model_sizes=model_sizes,
+        counter=counter,
+        idle_seconds=args.idle_seconds,
+        min_residency_seconds=args.min_residency_seconds,
+        half_life=args.half_life)
+
+
+def run_gateway(args):
+    residency = None
+    if args.catalog_file:
+        residency = get_residency_manager(args)
+        residency.start()
+
+    gateway = sidecars.BinaryTensorGateway(
+        target='{}:{}'.format(args.upstream_host, args.upstream_port),
+        port=args.port,
+        input_name=args.input_name,
+        pool_size=args.pool_size,
+        max_message_bytes=args.max_message_bytes,
+        timeout=args.timeout,
+        residency=residency,
+        compression_level=args.compression_level)
+    gateway.serve_forever()
+
+
+def run_readiness(args):
+    monitor = sidecars.ReadinessMonitor(
+        path=args.model_config_file,
+        status_client=writers.ModelStatusClient(
+            host=args.upstream_host, port=args.upstream_rest_port),
+        interval=args.interval)
+    monitor.start()
+
+    server = sidecars.ReadinessServer(
+        monitor=monitor,
+        port=args.port,
+        ready_path=args.ready_path,
+        report_path=args.report_path)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    initialize_logger(config('LOG_LEVEL', default='DEBUG'))
+
+    # Get command line arguments
+    ARGS = get_arg_parser().parse_args()
+
+    if ARGS.sidecar == 'cache':
+        run_cache(ARGS)
+
+    elif ARGS.sidecar == 'gateway':
+        run_gateway(ARGS)
+
+    elif ARGS.sidecar == 'readiness':
+        run_readiness(ARGS)
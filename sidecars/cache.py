@@ -0,0 +1,575 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Content-addressed response cache in front of TensorFlow Serving"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler
+
+try:
+    import grpc
+except ImportError:  # grpcio is only required by the gRPC proxy
+    grpc = None
+
+import writers
+
+from sidecars import protobuf
+from sidecars.utils import HTTPConnectionPool
+from sidecars.utils import ThreadingHTTPServer
+
+
+class ResponseCache(object):  # pylint: disable=useless-object-inheritance
+    """Size bounded LRU cache of responses that spills to disk.
+
+    Entries evicted from memory are written to `disk_path` as "<key>.entry"
+    files while the disk tier has room, and are moved back into memory when
+    they are hit again. Entries larger than `max_bytes` are written and kept
+    on disk. Other files in `disk_path` are left alone.
+    Every entry is tagged with its model so it can be invalidated when the
+    served versions of the model change.
+
+    Args:
+        max_bytes: int, maximum size in bytes of the cached responses
+            held in memory
+        disk_path: str, directory of the disk tier, disabled if empty
+        max_disk_bytes: int, maximum size in bytes of the disk tier
+        ttl: float, seconds before an entry expires, never if 0
+    """
+
+    entry_suffix = '.entry'
+
+    def __init__(self, max_bytes, disk_path=None, max_disk_bytes=0, ttl=0):
+        self.max_bytes = int(max_bytes)
+        self.disk_path = disk_path
+        self.max_disk_bytes = int(max_disk_bytes) if disk_path else 0
+        self.ttl = float(ttl)
+
+        if self.max_bytes < 0 or self.max_disk_bytes < 0:
+            raise ValueError('`max_bytes` and `max_disk_bytes` must be '
+                             'non-negative integers. Got {} and {}.'.format(
+                                 self.max_bytes, self.max_disk_bytes))
+
+        # key: (model, value or size, created)
+        self._memory = collections.OrderedDict()
+        self._disk = collections.OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+
+        # entries left on disk by a previous process can not be validated
+        if self.max_disk_bytes:
+            os.makedirs(self.disk_path, exist_ok=True)
+            self._clear_disk()
+
+        self.logger = logging.getLogger(str(self.__class__.__name__))
+
+    @staticmethod
+    def get_key(*parts):
+        """Hash the parts of a request into a cache key."""
+        digest = hashlib.sha256()
+        for part in parts:
+            if not isinstance(part, (bytes, bytearray, memoryview)):
+                part = str(part).encode('utf-8')
+            digest.update(str(len(part)).encode('utf-8') + b':')
+            digest.update(part)
+        return digest.hexdigest()
+
+    def _clear_disk(self):
+        """Remove the entries of the disk tier, leaving other files."""
+        for name in os.listdir(self.disk_path):
+            if name.endswith(self.entry_suffix) or \
+                    name.endswith(self.entry_suffix + '.tmp'):
+                try:
+                    os.remove(os.path.join(self.disk_path, name))
+                except OSError:
+                    pass
+
+    def _disk_file(self, key):
+        return os.path.join(self.disk_path, key + self.entry_suffix)
+
+    def _expired(self, created):
+        return self.ttl and time.time() - created > self.ttl
+
+    def _remove_from_disk(self, key):
+        _, size, _ = self._disk.pop(key)
+        self._disk_bytes -= size
+        try:
+            os.remove(self._disk_file(key))
+        except OSError:
+            pass
+
+    def _spill(self, key, model, value, created):
+        """Write an entry evicted from memory to the disk tier."""
+        if len(value) > self.max_disk_bytes:
+            self._counters['evictions'] += 1
+            return
+
+        while self._disk_bytes + len(value) > self.max_disk_bytes:
+            self._remove_from_disk(next(iter(self._disk)))
+            self._counters['evictions'] += 1
+
+        tmp_path = '{}.tmp'.format(self._disk_file(key))
+        with open(tmp_path, 'wb') as f:
+            f.write(value)
+        os.rename(tmp_path, self._disk_file(key))
+        self._disk[key] = (model, len(value), created)
+        self._disk_bytes += len(value)
+
+    def _insert(self, key, model, value, created):
+        if len(value) > self.max_bytes:
+            # too large for memory, but may fit in the disk tier
+            if self.max_disk_bytes:
+                self._spill(key, model, value, created)
+            return
+
+        self._memory[key] = (model, value, created)
+        self._memory_bytes += len(value)
+        while self._memory_bytes > self.max_bytes:
+            k, (m, v, c) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(v)
+            if self.max_disk_bytes:
+                self._spill(k, m, v, c)
+            else:
+                self._counters['evictions'] += 1
+
+    def get(self, key):
+        """Get a cached response.
+
+        Returns:
+            bytes: the cached response, or None if not cached.
+        """
+        with self._lock:
+            if key in self._memory:
+                model, value, created = self._memory[key]
+                if not self._expired(created):
+                    self._memory.move_to_end(key)
+                    self._counters['hits_memory'] += 1
+                    return value
+                del self._memory[key]
+                self._memory_bytes -= len(value)
+
+            if key in self._disk:
+                model, size, created = self._disk[key]
+                if not self._expired(created):
+                    with open(self._disk_file(key), 'rb') as f:
+                        value = f.read()
+                    if size > self.max_bytes:
+                        self._disk.move_to_end(key)
+                    else:
+                        self._remove_from_disk(key)
+                        self._insert(key, model, value, created)
+                    self._counters['hits_disk'] += 1
+                    return value
+                self._remove_from_disk(key)
+
+            self._counters['misses'] += 1
+            return None
+
+    def put(self, key, model, value):
+        """Cache the response of a model."""
+        value = bytes(value)
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= len(self._memory.pop(key)[1])
+            if key in self._disk:
+                self._remove_from_disk(key)
+            self._insert(key, model, value, time.time())
+
+    def invalidate(self, model):
+        """Remove all cached responses of a model."""
+        with self._lock:
+            for key in [k for k, e in self._memory.items() if e[0] == model]:
+                self._memory_bytes -= len(self._memory.pop(key)[1])
+                self._counters['invalidations'] += 1
+            for key in [k for k, e in self._disk.items() if e[0] == model]:
+                self._remove_from_disk(key)
+                self._counters['invalidations'] += 1
+        self.logger.info('Invalidated cached responses of model "%s".', model)
+
+    def get_metrics(self):
+        """Get the cache metrics.
+
+        Returns:
+            dict: the counters, hit rate and size of each tier.
+        """
+        with self._lock:
+            metrics = {
+                'hits_memory': self._counters['hits_memory'],
+                'hits_disk': self._counters['hits_disk'],
+                'misses': self._counters['misses'],
+                'evictions': self._counters['evictions'],
+                'invalidations': self._counters['invalidations'],
+                'entries_memory': len(self._memory),
+                'entries_disk': len(self._disk),
+                'bytes_memory': self._memory_bytes,
+                'bytes_disk': self._disk_bytes,
+            }
+        hits = metrics['hits_memory'] + metrics['hits_disk']
+        total = hits + metrics['misses']
+        metrics['hit_rate'] = hits / total if total else 0.
+        return metrics
+
+    def format_metrics(self):
+        """Format the cache metrics for Prometheus scraping."""
+        metrics = self.get_metrics()
+        lines = []
+
+        def add(name, kind, samples):
+            name = 'tf_serving_cache_{}'.format(name)
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for labels, value in samples:
+                lines.append('{}{} {}'.format(name, labels, value))
+
+        add('hits_total', 'counter', [
+            ('{tier="memory"}', metrics['hits_memory']),
+            ('{tier="disk"}', metrics['hits_disk'])])
+        add('misses_total', 'counter', [('', metrics['misses'])])
+        add('evictions_total', 'counter', [('', metrics['evictions'])])
+        add('invalidations_total', 'counter',
+            [('', metrics['invalidations'])])
+        add('hit_rate', 'gauge', [('', metrics['hit_rate'])])
+        add('entries', 'gauge', [
+            ('{tier="memory"}', metrics['entries_memory']),
+            ('{tier="disk"}', metrics['entries_disk'])])
+        add('bytes', 'gauge', [
+            ('{tier="memory"}', metrics['bytes_memory']),
+            ('{tier="disk"}', metrics['bytes_disk'])])
+        return '\n'.join(lines) + '\n'
+
+
+class ModelConfigWatcher(object):  # pylint: disable=useless-object-inheritance
+    """Invalidate cached responses when the served versions change.
+
+    Changes of the model config file are detected from the file. Models
+    serving all versions also load new versions without a config change,
+    so the AVAILABLE versions of these models are polled with
+    `status_client`. Responses of a previous version may be served for
+    up to `interval` seconds after a new version is loaded.
+
+    Args:
+        path: str, the filepath of the model config file.
+        cache: ResponseCache, the cache to invalidate.
+        interval: float, seconds between checks of the config file.
+        status_client: writers.ModelStatusClient, client of the REST
+            status API of TensorFlow Serving. Cached responses of models
+            serving all versions are only invalidated by config changes
+            if not given.
+    """
+
+    def __init__(self, path, cache, interval=10, status_client=None):
+        self.path = path
+        self.cache = cache
+        self.interval = float(interval)
+        self.status_client = status_client
+        self._mtime = None
+        self._fingerprints = {}
+        self._available = {}
+        self.logger = logging.getLogger(str(self.__class__.__name__))
+
+    def check(self):
+        """Invalidate the models whose served versions have changed."""
+        self._check_config()
+        if self.status_client is not None:
+            self._check_available()
+
+    def _check_config(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+
+        fingerprints = {}
+        for model in writers.read_model_config(self.path):
+            fingerprints[model['name']] = (
+                model['base_path'],
+                model['versions'],
+                sorted(model['version_labels'].items()))
+
+        if self._mtime is not None:
+            for name in set(self._fingerprints) | set(fingerprints):
+                if self._fingerprints.get(name) != fingerprints.get(name):
+                    self.cache.invalidate(name)
+
+        self._mtime = mtime
+        self._fingerprints = fingerprints
+
+    def _check_available(self):
+        """Invalidate the models serving all versions that loaded a new
+        version."""
+        models = [name for name, (_, versions, _) in
+                  self._fingerprints.items() if versions is None]
+        for name in set(self._available) - set(models):
+            del self._available[name]
+
+        for name in models:
+            try:
+                statuses = self.status_client.get_model_status(name)
+            except (RuntimeError, OSError) as err:
+                self.logger.debug('Failed to get status of `%s`: %s',
+                                  name, err)
+                continue
+
+            available = sorted(s['version'] for s in statuses
+                               if s['state'] == 'AVAILABLE')
+            if name in self._available and \
+                    self._available[name] != available:
+                self.cache.invalidate(name)
+            self._available[name] = available
+
+    def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception as err:  # pylint: disable=broad-except
+                self.logger.error('Failed to read %s: %s', self.path, err)
+            time.sleep(self.interval)
+
+    def start(self):
+        """Check the config file in a daemon thread."""
+        self.check()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+class RestCacheHandler(BaseHTTPRequestHandler):
+    """Serve inference requests from the cache of the server's proxy."""
+
+    protocol_version = 'HTTP/1.1'
+
+    route = re.compile(r'^/v1/models/([^/:]+)'
+                       r'(?:/versions/\d+|/labels/[^/:]+)?'
+                       r':(?:predict|classify|regress)$')
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        self.server.proxy.logger.debug(format, *args)
+
+    def _send(self, status, headers, body, cache_status=None):
+        self.send_response(status)
+        for name, value in headers:
+            if name.lower() in ('content-type',):
+                self.send_header(name, value)
+        if cache_status:
+            self.send_header('X-Cache', cache_status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _forward(self, body=None):
+        headers = {}
+        if self.headers.get('Content-Type'):
+            headers['Content-Type'] = self.headers['Content-Type']
+        return self.server.proxy.upstream.request(
+            self.command, self.path, body=body, headers=headers)
+
+    def do_GET(self):
+        proxy = self.server.proxy
+        if self.path == proxy.metrics_path:
+            body = proxy.cache.format_metrics().encode('utf-8')
+            self._send(200, [('Content-Type', 'text/plain')], body)
+            return
+        self._send(*self._forward())
+
+    def do_POST(self):
+        proxy = self.server.proxy
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+
+        match = self.route.match(self.path)
+        if not match:
+            self._send(*self._forward(body))
+            return
+
+        key = proxy.cache.get_key('rest', self.path, body)
+        cached = proxy.cache.get(key)
+        if cached is not None:
+            self._send(200, [('Content-Type', 'application/json')],
+                       cached, 'HIT')
+            return
+
+        status, headers, response = self._forward(body)
+        if status == 200:
+            proxy.cache.put(key, match.group(1), response)
+        self._send(status, headers, response, 'MISS')
+
+
+class RestCacheProxy(object):  # pylint: disable=useless-object-inheritance
+    """Cache the responses of the TensorFlow Serving REST API.
+
+    Args:
+        cache: ResponseCache, the cache of responses.
+        upstream_host: str, hostname of the TensorFlow Serving REST API
+        upstream_port: int, port of the TensorFlow Serving REST API
+        host: str, host to listen on
+        port: int, port to listen on
+        metrics_path: str, path of the Prometheus metrics of the cache
+        timeout: float, timeout in seconds of upstream requests
+    """
+
+    def __init__(self,
+                 cache,
+                 upstream_host,
+                 upstream_port,
+                 host='0.0.0.0',
+                 port=8501,
+                 metrics_path='/cache/metrics',
+                 timeout=60):
+        self.cache = cache
+        self.upstream = HTTPConnectionPool(upstream_host, upstream_port,
+                                           timeout=timeout)
+        self.metrics_path = str(metrics_path)
+        self.server = ThreadingHTTPServer((host, int(port)), RestCacheHandler)
+        self.server.proxy = self
+        self.logger = logging.getLogger(str(self.__class__.__name__))
+
+    def serve_forever(self):
+        self.logger.info('Caching REST API of %s:%s on port %s.',
+                         self.upstream.host, self.upstream.port,
+                         self.server.server_address[1])
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class GrpcCacheProxy(object):  # pylint: disable=useless-object-inheritance
+    """Cache the responses of the TensorFlow Serving gRPC API.
+
+    Requests are proxied as raw bytes, so no protos are required.
+
+    Args:
+        cache: ResponseCache, the cache of responses.
+        target: str, address of the TensorFlow Serving gRPC API
+        host: str, host to listen on
+        port: int, port to listen on
+        max_message_bytes: int, maximum size of requests and responses
+        max_workers: int, number of threads handling requests
+    """
+
+    services = {
+        'tensorflow.serving.PredictionService': (
+            'Classify', 'Regress', 'Predict', 'MultiInference',
+            'GetModelMetadata'),
+        'tensorflow.serving.ModelService': (
+            'GetModelStatus', 'HandleReloadConfigRequest'),
+    }
+
+    cached_methods = (
+        '/tensorflow.serving.PredictionService/Classify',
+        '/tensorflow.serving.PredictionService/Regress',
+        '/tensorflow.serving.PredictionService/Predict',
+    )
+
+    max_timeout = 24 * 60 * 60
+
+    def __init__(self,
+                 cache,
+                 target,
+                 host='0.0.0.0',
+                 port=8500,
+                 max_message_bytes=-1,
+                 max_workers=16):
+        if grpc is None:
+            raise ImportError('grpcio is required to proxy the gRPC API.')
+
+        options = [
+            ('grpc.max_send_message_length', int(max_message_bytes)),
+            ('grpc.max_receive_message_length', int(max_message_bytes)),
+        ]
+        self.cache = cache
+        self.target = str(target)
+        self.channel = grpc.insecure_channel(self.target, options=options)
+        self.server = grpc.server(
+            futures.ThreadPoolExecutor(max_workers=int(max_workers)),
+            options=options)
+
+        for service, methods in self.services.items():
+            handlers = {}
+            for method in methods:
+                name = '/{}/{}'.format(service, method)
+                handlers[method] = grpc.unary_unary_rpc_method_handler(
+                    self._get_handler(name))
+            self.server.add_generic_rpc_handlers((
+                grpc.method_handlers_generic_handler(service, handlers),))
+
+        self.port = self.server.add_insecure_port('{}:{}'.format(host, port))
+        self.logger = logging.getLogger(str(self.__class__.__name__))
+
+    def _get_handler(self, method):
+        forward = self.channel.unary_unary(method)
+        cached = method in self.cached_methods
+
+        def handler(request, context):
+            key = None
+            if cached:
+                key = self.cache.get_key('grpc', method, request)
+                response = self.cache.get(key)
+                if response is not None:
+                    return response
+
+            # time_remaining is effectively infinite without a deadline
+            timeout = context.time_remaining()
+            if timeout is not None and timeout > self.max_timeout:
+                timeout = None
+
+            try:
+                response = forward(request, timeout=timeout)
+            except grpc.RpcError as err:
+                context.abort(err.code(), err.details())
+
+            if key is not None:
+                try:
+                    model = protobuf.get_model_spec(request)['name']
+                except ValueError:
+                    model = None
+                self.cache.put(key, model, response)
+            return response
+
+        return handler
+
+    def start(self):
+        self.server.start()
+        self.logger.info('Caching gRPC API of %s on port %s.',
+                         self.target, self.port)
+
+    def shutdown(self):
+        self.server.stop(None)
+        self.channel.close()
@@ -0,0 +1,401 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for the response cache and caching proxies"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import http.client
+import os
+import time
+
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+import sidecars
+
+from sidecars.utils import ThreadingHTTPServer
+from sidecars.utils import start_server
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    """Stand-in for TensorFlow Serving that echoes each request."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *_):
+        pass
+
+    def _echo(self, body):
+        self.server.requests += 1
+        status = 400 if b'error' in body else 200
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._echo(self.path.encode('utf-8'))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self._echo(body)
+
+
+@pytest.fixture
+def echo_server():
+    server = ThreadingHTTPServer(('localhost', 0), EchoHandler)
+    server.requests = 0
+    start_server(server)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def write_config(path, versions):
+    with open(path, 'w') as f:
+        f.write('model_config_list: {\n')
+        for name, version in versions.items():
+            policy = 'all: {}' if version is None else \
+                'specific: { versions: %s }' % version
+            f.write('config: { name: "%s" base_path: "/models/%s" '
+                    'model_version_policy: { %s } }\n'
+                    % (name, name, policy))
+        f.write('}\n')
+
+
+class TestResponseCache(object):
+
+    def test_bad_inputs(self):
+        with pytest.raises(ValueError):
+            sidecars.ResponseCache(max_bytes=-1)
+
+    def test_get_key(self):
+        key = sidecars.ResponseCache.get_key('rest', '/v1/models/a', b'x')
+        assert key == sidecars.ResponseCache.get_key(
+            'rest', '/v1/models/a', memoryview(b'x'))
+        assert key != sidecars.ResponseCache.get_key(
+            'rest', '/v1/models/a', b'y')
+        # parts are length prefixed so they can not be shifted
+        assert sidecars.ResponseCache.get_key('ab', 'c') != \
+            sidecars.ResponseCache.get_key('a', 'bc')
+
+    def test_lru(self):
+        cache = sidecars.ResponseCache(max_bytes=10)
+        assert cache.get('a') is None
+
+        cache.put('a', 'm', b'aaaa')
+        cache.put('b', 'm', b'bbbb')
+        assert cache.get('a') == b'aaaa'
+
+        # "b" is least recently used
+        cache.put('c', 'm', b'cccc')
+        assert cache.get('b') is None
+        assert cache.get('a') == b'aaaa'
+        assert cache.get('c') == b'cccc'
+
+        # too large to cache
+        cache.put('d', 'm', b'd' * 11)
+        assert cache.get('d') is None
+
+        metrics = cache.get_metrics()
+        assert metrics['hits_memory'] == 3
+        assert metrics['misses'] == 3
+        assert metrics['evictions'] == 1
+        assert metrics['entries_memory'] == 2
+        assert metrics['bytes_memory'] == 8
+        assert metrics['hit_rate'] == 0.5
+
+    def test_disk_tier(self, tmpdir):
+        path = os.path.join(str(tmpdir), 'cache')
+        cache = sidecars.ResponseCache(max_bytes=4, disk_path=path,
+                                       max_disk_bytes=8)
+
+        cache.put('a', 'm', b'aaaa')
+        cache.put('b', 'm', b'bbbb')
+        cache.put('c', 'm', b'cccc')
+        assert sorted(os.listdir(path)) == ['a.entry', 'b.entry']
+
+        # hits on disk are moved back into memory
+        assert cache.get('a') == b'aaaa'
+        assert sorted(os.listdir(path)) == ['b.entry', 'c.entry']
+
+        # the disk tier is bounded
+        cache.put('d', 'm', b'dddd')
+        assert sorted(os.listdir(path)) == ['a.entry', 'c.entry']
+        assert cache.get('b') is None
+
+        metrics = cache.get_metrics()
+        assert metrics['hits_disk'] == 1
+        assert metrics['entries_disk'] == 2
+        assert metrics['bytes_disk'] == 8
+
+        # stale entries are removed on startup, other files are kept
+        with open(os.path.join(path, 'other'), 'w') as f:
+            f.write('other')
+        cache = sidecars.ResponseCache(max_bytes=4, disk_path=path,
+                                       max_disk_bytes=8)
+        assert os.listdir(path) == ['other']
+
+    def test_disk_tier_large(self, tmpdir):
+        path = os.path.join(str(tmpdir), 'cache')
+        cache = sidecars.ResponseCache(max_bytes=4, disk_path=path,
+                                       max_disk_bytes=16)
+
+        # entries too large for memory are written to disk
+        cache.put('a', 'm', b'a' * 8)
+        assert os.listdir(path) == ['a.entry']
+        assert cache.get_metrics()['bytes_memory'] == 0
+
+        # and stay on disk when hit
+        assert cache.get('a') == b'a' * 8
+        assert cache.get('a') == b'a' * 8
+        assert os.listdir(path) == ['a.entry']
+
+        # hits are the most recently used entries on disk
+        cache.put('b', 'm', b'b' * 8)
+        assert cache.get('a') == b'a' * 8
+        cache.put('c', 'm', b'c' * 8)
+        assert sorted(os.listdir(path)) == ['a.entry', 'c.entry']
+
+        # entries too large for the disk tier are not cached
+        cache.put('d', 'm', b'd' * 17)
+        assert cache.get('d') is None
+
+        metrics = cache.get_metrics()
+        assert metrics['hits_disk'] == 3
+        assert metrics['bytes_disk'] == 16
+
+    def test_ttl(self):
+        cache = sidecars.ResponseCache(max_bytes=10, ttl=0.01)
+        cache.put('a', 'm', b'aaaa')
+        assert cache.get('a') == b'aaaa'
+        time.sleep(0.02)
+        assert cache.get('a') is None
+        assert cache.get_metrics()['bytes_memory'] == 0
+
+    def test_invalidate(self, tmpdir):
+        path = os.path.join(str(tmpdir), 'cache')
+        cache = sidecars.ResponseCache(max_bytes=4, disk_path=path,
+                                       max_disk_bytes=8)
+        cache.put('a', 'm1', b'aaaa')
+        cache.put('b', 'm2', b'bbbb')
+        cache.put('c', 'm1', b'cccc')
+
+        cache.invalidate('m1')
+        assert cache.get('a') is None
+        assert cache.get('c') is None
+        assert cache.get('b') == b'bbbb'
+        assert cache.get_metrics()['invalidations'] == 2
+
+    def test_format_metrics(self):
+        cache = sidecars.ResponseCache(max_bytes=10)
+        cache.put('a', 'm', b'aaaa')
+        cache.get('a')
+        cache.get('b')
+        text = cache.format_metrics()
+        assert 'tf_serving_cache_hits_total{tier="memory"} 1\n' in text
+        assert 'tf_serving_cache_misses_total 1\n' in text
+        assert 'tf_serving_cache_hit_rate 0.5\n' in text
+
+
+class TestModelConfigWatcher(object):
+
+    def test_check(self, tmpdir, mocker):
+        path = os.path.join(str(tmpdir), 'models.conf')
+        cache = sidecars.ResponseCache(max_bytes=10)
+        spy = mocker.spy(cache, 'invalidate')
+        watcher = sidecars.ModelConfigWatcher(path, cache, interval=0.01)
+
+        # no config file yet
+        watcher.check()
+
+        write_config(path, {'a': 1, 'b': 1})
+        watcher.start()
+        assert not spy.called
+
+        write_config(path, {'a': 2, 'b': 1, 'c': 1})
+        os.utime(path, (time.time() + 1, time.time() + 1))
+        watcher.check()
+        invalidated = sorted(c[0][0] for c in spy.call_args_list)
+        assert invalidated == ['a', 'c']
+
+        # unchanged file
+        watcher.check()
+        assert spy.call_count == 2
+
+    def test_check_available(self, tmpdir, mocker):
+
+        class DummyStatusClient(object):
+            versions = {'a': [1], 'b': [1]}
+
+            def get_model_status(self, model, version=None, label=None):
+                if model not in self.versions:
+                    raise RuntimeError('unavailable')
+                return [{'version': v, 'state': 'AVAILABLE'}
+                        for v in self.versions[model]]
+
+        path = os.path.join(str(tmpdir), 'models.conf')
+        cache = sidecars.ResponseCache(max_bytes=10)
+        spy = mocker.spy(cache, 'invalidate')
+        client = DummyStatusClient()
+        watcher = sidecars.ModelConfigWatcher(path, cache,
+                                              status_client=client)
+
+        # "a" serves all versions, "b" a specific version
+        write_config(path, {'a': None, 'b': 1, 'c': None})
+        watcher.check()
+        assert not spy.called
+
+        # a new version of "a" is loaded from the bucket
+        client.versions = {'a': [1, 2], 'b': [1, 2]}
+        watcher.check()
+        assert [c[0][0] for c in spy.call_args_list] == ['a']
+
+        watcher.check()
+        assert spy.call_count == 1
+
+
+class TestRestCacheProxy(object):
+
+    def test_proxy(self, echo_server):
+        cache = sidecars.ResponseCache(max_bytes=1024)
+        proxy = sidecars.RestCacheProxy(
+            cache, 'localhost', echo_server.server_address[1],
+            host='localhost', port=0)
+        start_server(proxy.server)
+
+        connection = http.client.HTTPConnection(
+            'localhost', proxy.server.server_address[1])
+
+        def post(path, body):
+            connection.request('POST', path, body=body)
+            response = connection.getresponse()
+            return (response.status, response.getheader('X-Cache'),
+                    response.read())
+
+        path = '/v1/models/a/versions/1:predict'
+        assert post(path, b'{"instances": [1]}') == \
+            (200, 'MISS', b'{"instances": [1]}')
+        assert post(path, b'{"instances": [1]}') == \
+            (200, 'HIT', b'{"instances": [1]}')
+        assert echo_server.requests == 1
+
+        # different tensors, versions or models are not hits
+        assert post(path, b'{"instances": [2]}')[1] == 'MISS'
+        assert post('/v1/models/a:predict', b'{"instances": [1]}')[1] == \
+            'MISS'
+        assert post('/v1/models/b:predict', b'{"instances": [1]}')[1] == \
+            'MISS'
+        assert echo_server.requests == 4
+
+        # errors are not cached
+        assert post(path, b'error')[:2] == (400, 'MISS')
+        assert post(path, b'error')[:2] == (400, 'MISS')
+
+        # other requests are forwarded
+        assert post('/v1/models/a:reload', b'x') == (200, None, b'x')
+        connection.request('GET', '/v1/models/a')
+        assert connection.getresponse().read() == b'/v1/models/a'
+
+        # invalidated models are fetched again
+        cache.invalidate('a')
+        assert post(path, b'{"instances": [1]}')[1] == 'MISS'
+
+        connection.request('GET', '/cache/metrics')
+        metrics = connection.getresponse().read().decode('utf-8')
+        assert 'tf_serving_cache_hits_total{tier="memory"} 1' in metrics
+
+        connection.close()
+        proxy.shutdown()
+
+
+class TestGrpcCacheProxy(object):
+
+    def test_proxy(self):
+        grpc = pytest.importorskip('grpc')
+        requests = []
+
+        def echo(request, context):
+            requests.append(request)
+            if request.endswith(b'error'):
+                context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'bad input')
+            return b'response:' + request
+
+        handlers = {m: grpc.unary_unary_rpc_method_handler(echo)
+                    for m in ('Predict', 'GetModelMetadata')}
+        upstream = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+        upstream.add_generic_rpc_handlers((
+            grpc.method_handlers_generic_handler(
+                'tensorflow.serving.PredictionService', handlers),))
+        upstream_port = upstream.add_insecure_port('localhost:0')
+        upstream.start()
+
+        cache = sidecars.ResponseCache(max_bytes=1024)
+        proxy = sidecars.GrpcCacheProxy(
+            cache, 'localhost:{}'.format(upstream_port),
+            host='localhost', port=0)
+        proxy.start()
+
+        channel = grpc.insecure_channel('localhost:{}'.format(proxy.port))
+        predict = channel.unary_unary(
+            '/tensorflow.serving.PredictionService/Predict')
+        metadata = channel.unary_unary(
+            '/tensorflow.serving.PredictionService/GetModelMetadata')
+
+        # ModelSpec { name: "a" } and an input
+        request = b'\x0a\x03\x0a\x01a' + b'\x12\x01x'
+        assert predict(request) == b'response:' + request
+        assert predict(request) == b'response:' + request
+        assert len(requests) == 1
+
+        other = request + b'\x12\x01y'
+        assert predict(other) == b'response:' + other
+        assert len(requests) == 2
+
+        # only inference methods are cached
+        assert metadata(request) == b'response:' + request
+        assert metadata(request) == b'response:' + request
+        assert len(requests) == 4
+
+        # errors are forwarded and not cached
+        for _ in range(2):
+            with pytest.raises(grpc.RpcError) as err:
+                predict(request + b'\x12\x05error')
+            assert err.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+        assert len(requests) == 6
+
+        # entries are tagged with the model name
+        cache.invalidate('a')
+        predict(request)
+        assert len(requests) == 7
+
+        channel.close()
+        proxy.shutdown()
+        upstream.stop(None)
@@ -0,0 +1,405 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Binary tensor REST gateway to the TensorFlow Serving gRPC API.
+
+Large images are sent as raw bytes instead of JSON encoded tensors, and
+forwarded as a PredictRequest with the bytes in `tensor_content`.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import gzip
+import io
+import itertools
+import json
+import logging
+import re
+import threading
+import zlib
+
+from http.server import BaseHTTPRequestHandler
+
+try:
+    import grpc
+    import numpy as np
+except ImportError:  # grpcio and numpy are only required by the gateway
+    grpc = None
+
+from sidecars import protobuf
+from sidecars.utils import ThreadingHTTPServer
+
+
+PREDICT_METHOD = '/tensorflow.serving.PredictionService/Predict'
+
+NPY_CONTENT_TYPE = 'application/x-npy'
+NPZ_CONTENT_TYPE = 'application/x-npz'
+RAW_CONTENT_TYPE = 'application/octet-stream'
+
+
+class ChannelPool(object):  # pylint: disable=useless-object-inheritance
+    """Round-robin pool of gRPC channels to a single target.
+
+    Each channel is a single HTTP/2 connection, so a pool spreads large
+    concurrent requests over several connections.
+
+    Args:
+        target: str, address of the gRPC server
+        size: int, number of channels
+        max_message_bytes: int, maximum size of requests and responses
+    """
+
+    def __init__(self, target, size=4, max_message_bytes=-1):
+        if grpc is None:
+            raise ImportError('grpcio is required by the ChannelPool.')
+
+        if int(size) <= 0:
+            raise ValueError('`size` must be a positive integer. '
+                             'Got {}.'.format(size))
+
+        options = [
+            ('grpc.max_send_message_length', int(max_message_bytes)),
+            ('grpc.max_receive_message_length', int(max_message_bytes)),
+            # do not share a connection between the channels of the pool
+            ('grpc.use_local_subchannel_pool', 1),
+        ]
+        self.target = str(target)
+        self.channels = [grpc.insecure_channel(self.target, options=options)
+                         for _ in range(int(size))]
+        self._callables = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def unary_unary(self, method):
+        """Get a callable of `method` on the next channel of the pool."""
+        with self._lock:
+            i = next(self._counter) % len(self.channels)
+            key = (i, method)
+            if key not in self._callables:
+                self._callables[key] = self.channels[i].unary_unary(method)
+            return self._callables[key]
+
+    def close(self):
+        for channel in self.channels:
+            channel.close()
+
+
+def read_array(body, content_type, shape=None, dtype=None):
+    """Read an array from a request body without copying the data.
+
+    Args:
+        body: bytes, the request body.
+        content_type: str, one of "application/x-npy" or
+            "application/octet-stream".
+        shape: str, comma separated dimensions of a raw array.
+        dtype: str, numpy dtype of a raw array.
+
+    Returns:
+        numpy.array: a little-endian C-contiguous view of the body.
+    """
+    if content_type == NPY_CONTENT_TYPE:
+        stream = io.BytesIO(body)
+        version = np.lib.format.read_magic(stream)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(stream)
+        else:
+            header = np.lib.format.read_array_header_2_0(stream)
+        shape, fortran_order, dtype = header
+        array = np.frombuffer(body, dtype=dtype, offset=stream.tell())
+        if fortran_order:
+            array = array.reshape(shape[::-1]).T
+        else:
+            array = array.reshape(shape)
+
+    elif content_type == RAW_CONTENT_TYPE:
+        if not shape or not dtype:
+            raise ValueError('X-Tensor-Shape and X-Tensor-Dtype headers are '
+                             'required with {}.'.format(RAW_CONTENT_TYPE))
+        shape = [int(d) for d in str(shape).split(',') if d.strip()]
+        array = np.frombuffer(body, dtype=np.dtype(dtype)).reshape(shape)
+
+    else:
+        raise ValueError('Unsupported Content-Type "{}".'.format(
+            content_type))
+
+    if array.dtype.byteorder == '>':
+        array = array.astype(array.dtype.newbyteorder('<'))
+    return np.ascontiguousarray(array)
+
+
+def write_array(array):
+    """Get the chunks of an array in npy format without copying the data."""
+    array = np.ascontiguousarray(array)
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        header, np.lib.format.header_data_from_array_1_0(array))
+    return [header.getvalue(), memoryview(array).cast('B')]
+
+
+def to_tensor(array):
+    """Get the (dtype, shape, content) of an array for a PredictRequest."""
+    try:
+        dtype = protobuf.DTYPES[array.dtype.name]
+    except KeyError:
+        raise ValueError('Unsupported dtype "{}".'.format(array.dtype))
+    return dtype, array.shape, memoryview(array).cast('B')
+
+
+def to_array(tensor):
+    """Get the array of a decoded TensorProto, sharing its buffer."""
+    dtypes = {v: k for k, v in protobuf.DTYPES.items()}
+    try:
+        dtype = np.dtype(dtypes[tensor['dtype']])
+    except KeyError:
+        raise ValueError('Unsupported DataType {}.'.format(tensor['dtype']))
+
+    shape = tensor['shape']
+    if tensor['content'] is not None:
+        return np.frombuffer(tensor['content'], dtype=dtype).reshape(shape)
+
+    values = protobuf.get_tensor_values(tensor)
+    if dtype == np.float16:
+        values = np.array(values, dtype='uint16').view(dtype)
+    values = np.array(values, dtype=dtype)
+
+    # a single value is repeated to fill the tensor
+    size = int(np.prod(shape))
+    if values.size == 1 and size != 1:
+        values = np.full(size, values[0], dtype=dtype)
+    elif not values.size:
+        values = np.zeros(size, dtype=dtype)
+    return values.reshape(shape)
+
+
+class GatewayHandler(BaseHTTPRequestHandler):
+    """Forward binary tensors to the gRPC API of TensorFlow Serving."""
+
+    protocol_version = 'HTTP/1.1'
+
+    route = re.compile(r'^/v1/models/([^/:]+)'
+                       r'(?:/versions/(\d+)|/labels/([^/:]+))?:predict$')
+
+    # HTTP status of each gRPC status code name
+    status_codes = {
+        'INVALID_ARGUMENT': 400,
+        'FAILED_PRECONDITION': 400,
+        'OUT_OF_RANGE': 400,
+        'UNAUTHENTICATED': 401,
+        'PERMISSION_DENIED': 403,
+        'NOT_FOUND': 404,
+        'RESOURCE_EXHAUSTED': 429,
+        'UNIMPLEMENTED': 501,
+        'UNAVAILABLE': 503,
+        'DEADLINE_EXCEEDED': 504,
+    }
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        self.server.gateway.logger.debug(format, *args)
+
+    def _send(self, status, chunks, content_type, headers=None):
+        level = self.server.gateway.compression_level
+        if level and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            chunks = [gzip.compress(b''.join(chunks), compresslevel=level)]
+            headers = dict(headers or {}, **{'Content-Encoding': 'gzip'})
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        length = sum(len(memoryview(c).cast('B')) for c in chunks)
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(chunk)
+
+    def _send_error(self, status, message):
+        body = json.dumps({'error': str(message)}).encode('utf-8')
+        self._send(status, [body], 'application/json')
+
+    def _read_body(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        encoding = self.headers.get('Content-Encoding', 'identity').lower()
+        if encoding == 'gzip':
+            return gzip.decompress(body)
+        if encoding == 'deflate':
+            return zlib.decompress(body)
+        if encoding != 'identity':
+            raise ValueError('Unsupported Content-Encoding "{}".'.format(
+                encoding))
+        return body
+
+    def _read_inputs(self, body):
+        content_type = self.headers.get('Content-Type', NPY_CONTENT_TYPE)
+        content_type = content_type.split(';')[0].strip().lower()
+
+        if content_type == NPZ_CONTENT_TYPE:
+            with np.load(io.BytesIO(body)) as arrays:
+                return {k: np.ascontiguousarray(arrays[k]) for k in arrays}
+
+        array = read_array(body, content_type,
+                           shape=self.headers.get('X-Tensor-Shape'),
+                           dtype=self.headers.get('X-Tensor-Dtype'))
+        name = self.headers.get('X-Input-Name',
+                                self.server.gateway.input_name)
+        return {name: array}
+
+    def do_POST(self):
+        gateway = self.server.gateway
+        match = self.route.match(self.path)
+        if not match:
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self._send_error(404, 'Unknown path "{}".'.format(self.path))
+            return
+
+        model, version, label = match.groups()
+        output_filter = [o.strip() for o in self.headers.get(
+            'X-Output-Filter', '').split(',') if o.strip()]
+
+        try:
+            inputs = self._read_inputs(self._read_body())
+            outputs = gateway.predict(
+                model, inputs,
+                version=version,
+                version_label=label,
+                signature_name=self.headers.get('X-Signature-Name'),
+                output_filter=output_filter)
+        except TimeoutError as err:
+            self._send_error(503, err)
+            return
+        except (ValueError, OSError, zlib.error) as err:
+            self._send_error(400, err)
+            return
+        except grpc.RpcError as err:
+            status = self.status_codes.get(err.code().name, 500)
+            self._send_error(status, err.details())
+            return
+
+        if len(outputs) == 1:
+            name, array = next(iter(outputs.items()))
+            self._send(200, write_array(array), NPY_CONTENT_TYPE,
+                       {'X-Output-Name': name})
+            return
+
+        stream = io.BytesIO()
+        np.savez(stream, **outputs)
+        self._send(200, [stream.getvalue()], NPZ_CONTENT_TYPE)
+
+
+class BinaryTensorGateway(object):
+    """HTTP gateway accepting binary tensors for the gRPC Predict API.
+
+    Requests are POSTed to the TensorFlow Serving REST paths,
+    e.g. ``/v1/models/<model>[/versions/<version>]:predict``, with a body of:
+
+    - an .npy file (Content-Type: application/x-npy),
+    - an .npz file of each input (Content-Type: application/x-npz),
+    - raw bytes (Content-Type: application/octet-stream) with the
+      X-Tensor-Shape (e.g. "1,512,512,1") and X-Tensor-Dtype headers.
+
+    The body may be compressed (Content-Encoding: gzip or deflate). A single
+    output is returned as .npy, multiple outputs as .npz. Responses are only
+    compressed if `compression_level` is set, as float tensors barely
+    compress and gzip would add latency to every request.
+
+    Args:
+        target: str, address of the TensorFlow Serving gRPC API
+        host: str, host to listen on
+        port: int, port to listen on
+        input_name: str, name of the input of .npy and raw requests,
+            unless given in the X-Input-Name header
+        pool_size: int, number of gRPC channels to the target
+        max_message_bytes: int, maximum size of gRPC messages
+        timeout: float, timeout in seconds of each request
+        residency: ResidencyManager, loads cold models before they are
+            requested. Requests wait up to `timeout` for the model to load.
+        compression_level: int, gzip level of the responses to clients
+            accepting gzip, from 1 to 9. Responses are not compressed if 0.
+    """
+
+    def __init__(self,
+                 target,
+                 host='0.0.0.0',
+                 port=8502,
+                 input_name='image',
+                 pool_size=4,
+                 max_message_bytes=-1,
+                 timeout=30,
+                 residency=None,
+                 compression_level=0):
+        self.compression_level = int(compression_level)
+        if not 0 <= self.compression_level <= 9:
+            raise ValueError('`compression_level` must be from 0 to 9. '
+                             'Got {}.'.format(self.compression_level))
+        self.pool = ChannelPool(target, size=pool_size,
+                                max_message_bytes=max_message_bytes)
+        self.input_name = str(input_name)
+        self.timeout = float(timeout)
+        self.residency = residency
+        self.server = ThreadingHTTPServer((host, int(port)), GatewayHandler)
+        self.server.gateway = self
+        self.logger = logging.getLogger(str(self.__class__.__name__))
+
+    def predict(self, model, inputs, version=None, version_label=None,
+                signature_name=None, output_filter=None):
+        """Send a PredictRequest over the pooled channels.
+
+        Args:
+            model: str, the name of the model.
+            inputs: dict, the array of each input.
+            version: int, the version of the model.
+            version_label: str, the version label of the model.
+            signature_name: str, the name of the signature.
+            output_filter: list, the names of the outputs to return.
+
+        Returns:
+            dict: the array of each output.
+        """
+        if self.residency is not None:
+            self.residency.acquire(model, timeout=self.timeout)
+
+        request = protobuf.encode_predict_request(
+            model,
+            {k: to_tensor(v) for k, v in inputs.items()},
+            version=version,
+            version_label=version_label,
+            signature_name=signature_name,
+            output_filter=output_filter)
+
+        predict = self.pool.unary_unary(PREDICT_METHOD)
+        response = predict(request, timeout=self.timeout)
+
+        outputs = protobuf.decode_predict_response(response)
+        return {k: to_array(v) for k, v in outputs.items()}
+
+    def serve_forever(self):
+        self.logger.info('Forwarding binary tensors to %s on port %s.',
+                         self.pool.target, self.server.server_address[1])
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.pool.close()
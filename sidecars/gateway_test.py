@@ -0,0 +1,318 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for the binary tensor gateway"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import gzip
+import http.client
+import io
+import json
+import zlib
+
+from concurrent import futures
+
+import pytest
+
+from sidecars import gateway
+from sidecars import protobuf
+from sidecars.utils import start_server
+
+np = pytest.importorskip('numpy')
+grpc = pytest.importorskip('grpc')
+
+
+def predict(request, context):
+    """Stand-in for the Predict method of TensorFlow Serving."""
+    spec = protobuf.get_model_spec(request)
+    if spec['name'] != 'model':
+        context.abort(grpc.StatusCode.NOT_FOUND, 'Model not found')
+
+    inputs = {}
+    for number, _, value in protobuf.iter_fields(request):
+        if number == 2:
+            fields = {n: v for n, _, v in protobuf.iter_fields(value)}
+            name = fields[1].tobytes().decode('utf-8')
+            tensor = protobuf.decode_tensor(fields[2])
+            inputs[name] = gateway.to_array(tensor)
+
+    outputs = {'{}_doubled'.format(k): v * 2 for k, v in inputs.items()}
+    if spec['signature_name'] == 'metadata':
+        outputs['version'] = np.array([spec['version'] or 0])
+        outputs['label'] = np.array([len(spec['version_label'] or '')])
+    return protobuf.encode_predict_response(
+        {k: gateway.to_tensor(v) for k, v in outputs.items()})
+
+
+@pytest.fixture
+def upstream():
+    handler = grpc.method_handlers_generic_handler(
+        'tensorflow.serving.PredictionService',
+        {'Predict': grpc.unary_unary_rpc_method_handler(predict)})
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    server.add_generic_rpc_handlers((handler,))
+    port = server.add_insecure_port('localhost:0')
+    server.start()
+    yield 'localhost:{}'.format(port)
+    server.stop(None)
+
+
+@pytest.fixture
+def client(upstream):
+    server = gateway.BinaryTensorGateway(upstream, host='localhost', port=0,
+                                         pool_size=2)
+    start_server(server.server)
+    connection = http.client.HTTPConnection(
+        'localhost', server.server.server_address[1])
+    yield connection
+    connection.close()
+    server.shutdown()
+
+
+def npy(array):
+    stream = io.BytesIO()
+    np.save(stream, array)
+    return stream.getvalue()
+
+
+def post(client, body, path='/v1/models/model:predict', **headers):
+    headers = {k.replace('_', '-'): v for k, v in headers.items()}
+    client.request('POST', path, body=body, headers=headers)
+    response = client.getresponse()
+    return response, response.read()
+
+
+class TestChannelPool(object):
+
+    def test_unary_unary(self, upstream):
+        with pytest.raises(ValueError):
+            gateway.ChannelPool(upstream, size=0)
+
+        pool = gateway.ChannelPool(upstream, size=2)
+        first = pool.unary_unary(gateway.PREDICT_METHOD)
+        second = pool.unary_unary(gateway.PREDICT_METHOD)
+        assert first is not second
+        assert pool.unary_unary(gateway.PREDICT_METHOD) is first
+        pool.close()
+
+
+class TestArrays(object):
+
+    def test_read_array(self):
+        image = np.arange(24, dtype='float32').reshape((2, 3, 4))
+
+        array = gateway.read_array(npy(image), gateway.NPY_CONTENT_TYPE)
+        np.testing.assert_array_equal(array, image)
+
+        # npy arrays are not copied
+        body = npy(image)
+        array = gateway.read_array(body, gateway.NPY_CONTENT_TYPE)
+        assert not array.flags.owndata
+
+        # fortran order and big endian arrays are converted
+        for other in (np.asfortranarray(image), image.astype('>f4')):
+            array = gateway.read_array(npy(other), gateway.NPY_CONTENT_TYPE)
+            np.testing.assert_array_equal(array, image)
+            assert array.flags.c_contiguous
+            assert array.dtype == np.dtype('<f4')
+
+        array = gateway.read_array(image.tobytes(), gateway.RAW_CONTENT_TYPE,
+                                   shape='2,3,4', dtype='float32')
+        np.testing.assert_array_equal(array, image)
+
+        with pytest.raises(ValueError):
+            gateway.read_array(image.tobytes(), gateway.RAW_CONTENT_TYPE)
+
+        with pytest.raises(ValueError):
+            gateway.read_array(image.tobytes(), 'application/json')
+
+    def test_tensors(self):
+        for dtype in ('float32', 'float16', 'float64', 'uint8', 'int64',
+                      'bool'):
+            image = (np.arange(6) % 3).reshape((2, 3)).astype(dtype)
+            dt, shape, content = gateway.to_tensor(image)
+            tensor = protobuf.decode_tensor(
+                b''.join(protobuf.encode_tensor(dt, shape, content)))
+            np.testing.assert_array_equal(gateway.to_array(tensor), image)
+
+        with pytest.raises(ValueError):
+            gateway.to_tensor(np.array(['a']))
+
+        with pytest.raises(ValueError):
+            gateway.to_array({'dtype': 7, 'shape': [1], 'content': b''})
+
+    def test_to_array_values(self):
+        def tensor(dtype, shape, field, values):
+            buf = b''.join(protobuf.encode_field(1, dtype))
+            for d in shape:
+                dim = protobuf.encode_message(2, protobuf.encode_field(1, d))
+                buf += b''.join(protobuf.encode_message(2, dim))
+            buf += b''.join(protobuf.encode_field(field, values))
+            return protobuf.decode_tensor(buf)
+
+        floats = np.array([1.5, -2.5], dtype='<f4').tobytes()
+        array = gateway.to_array(tensor(1, [2], 5, floats))
+        np.testing.assert_array_equal(array, [1.5, -2.5])
+
+        # negative int_val are 10 byte varints
+        ints = protobuf.encode_varint(5) + protobuf.encode_varint(2 ** 64 - 3)
+        array = gateway.to_array(tensor(3, [2], 7, ints))
+        np.testing.assert_array_equal(array, [5, -3])
+
+        # half_val are the bits of each float16
+        bits = np.array([1.5], dtype='float16').view('uint16')
+        halfs = protobuf.encode_varint(int(bits[0]))
+        array = gateway.to_array(tensor(19, [2, 2], 13, halfs))
+        np.testing.assert_array_equal(array, np.full((2, 2), 1.5))
+
+        array = gateway.to_array(tensor(1, [3], 5, b''))
+        np.testing.assert_array_equal(array, np.zeros(3))
+
+
+class TestBinaryTensorGateway(object):
+
+    def test_predict(self, client):
+        image = np.random.random((1, 32, 32, 1)).astype('float32')
+
+        response, body = post(client, npy(image),
+                              Content_Type=gateway.NPY_CONTENT_TYPE)
+        assert response.status == 200
+        assert response.getheader('X-Output-Name') == 'image_doubled'
+        assert response.getheader('Content-Type') == gateway.NPY_CONTENT_TYPE
+        np.testing.assert_array_equal(np.load(io.BytesIO(body)), image * 2)
+
+        # raw bytes with a custom input name
+        response, body = post(client, image.tobytes(),
+                              Content_Type=gateway.RAW_CONTENT_TYPE,
+                              X_Tensor_Shape='1,32,32,1',
+                              X_Tensor_Dtype='float32',
+                              X_Input_Name='other')
+        assert response.getheader('X-Output-Name') == 'other_doubled'
+        np.testing.assert_array_equal(np.load(io.BytesIO(body)), image * 2)
+
+        # compressed requests, responses are not compressed by default
+        for encoding, compress in (('gzip', gzip.compress),
+                                   ('deflate', zlib.compress)):
+            response, body = post(client, compress(npy(image)),
+                                  Content_Encoding=encoding,
+                                  Accept_Encoding='gzip')
+            assert response.status == 200
+            assert response.getheader('Content-Encoding') is None
+            np.testing.assert_array_equal(np.load(io.BytesIO(body)),
+                                          image * 2)
+
+    def test_predict_multiple(self, client):
+        stream = io.BytesIO()
+        np.savez(stream, a=np.ones(3, 'int32'), b=np.zeros(2, 'uint8'))
+        response, body = post(
+            client, stream.getvalue(), Content_Type=gateway.NPZ_CONTENT_TYPE,
+            X_Signature_Name='metadata',
+            path='/v1/models/model/labels/stable:predict')
+        assert response.status == 200
+        assert response.getheader('Content-Type') == gateway.NPZ_CONTENT_TYPE
+        outputs = np.load(io.BytesIO(body))
+        np.testing.assert_array_equal(outputs['a_doubled'], [2, 2, 2])
+        np.testing.assert_array_equal(outputs['b_doubled'], [0, 0])
+        np.testing.assert_array_equal(outputs['label'], [len('stable')])
+
+        response, body = post(
+            client, npy(np.ones(1)), X_Signature_Name='metadata',
+            path='/v1/models/model/versions/3:predict')
+        assert np.load(io.BytesIO(body))['version'] == [3]
+
+    def test_errors(self, client):
+        image = npy(np.ones(3, 'float32'))
+
+        response, body = post(client, image, path='/v1/models/model:other')
+        assert response.status == 404
+
+        response, body = post(client, image, path='/v1/models/none:predict')
+        assert response.status == 404
+        assert json.loads(body.decode('utf-8'))['error'] == 'Model not found'
+
+        response, body = post(client, b'not npy')
+        assert response.status == 400
+
+        response, body = post(client, image, Content_Encoding='br')
+        assert response.status == 400
+
+        response, body = post(client, npy(np.array(['a'])))
+        assert response.status == 400
+
+    def test_compression(self, upstream):
+        with pytest.raises(ValueError):
+            gateway.BinaryTensorGateway(upstream, compression_level=10)
+
+        server = gateway.BinaryTensorGateway(
+            upstream, host='localhost', port=0, compression_level=1)
+        start_server(server.server)
+        client = http.client.HTTPConnection(
+            'localhost', server.server.server_address[1])
+        try:
+            image = np.zeros((1, 32, 32, 1), 'float32')
+            response, body = post(client, npy(image), Accept_Encoding='gzip')
+            assert response.status == 200
+            assert response.getheader('Content-Encoding') == 'gzip'
+            body = gzip.decompress(body)
+            np.testing.assert_array_equal(np.load(io.BytesIO(body)), image)
+
+            # only clients accepting gzip get compressed responses
+            response, body = post(client, npy(image))
+            assert response.getheader('Content-Encoding') is None
+            np.testing.assert_array_equal(np.load(io.BytesIO(body)), image)
+        finally:
+            client.close()
+            server.shutdown()
+
+    def test_residency(self, upstream):
+
+        class DummyResidency(object):
+
+            acquired = []
+
+            def acquire(self, model, timeout=None):
+                self.acquired.append(model)
+                if model != 'model':
+                    raise TimeoutError('{} is cold'.format(model))
+
+        server = gateway.BinaryTensorGateway(
+            upstream, host='localhost', port=0, residency=DummyResidency())
+        start_server(server.server)
+        client = http.client.HTTPConnection(
+            'localhost', server.server.server_address[1])
+        try:
+            image = npy(np.ones(3, 'float32'))
+            response, _ = post(client, image)
+            assert response.status == 200
+
+            # requests for models that do not load in time are unavailable
+            response, _ = post(client, image, path='/v1/models/cold:predict')
+            assert response.status == 503
+            assert DummyResidency.acquired == ['model', 'cold']
+        finally:
+            client.close()
+            server.shutdown()
@@ -0,0 +1,363 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Minimal protobuf wire format support for TensorFlow Serving requests.
+
+The sidecars proxy serialized requests without depending on tensorflow or
+the tensorflow-serving-api protos, so only the fields they need are read
+and written.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import struct
+
+
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+# tensorflow.DataType of each numpy dtype
+DTYPES = {
+    'float32': 1,
+    'float64': 2,
+    'int32': 3,
+    'uint8': 4,
+    'int16': 5,
+    'int8': 6,
+    'int64': 9,
+    'bool': 10,
+    'uint16': 17,
+    'float16': 19,
+    'uint32': 22,
+    'uint64': 23,
+}
+
+# TensorProto fields of the typed values of each tensorflow.DataType
+TENSOR_VALUE_FIELDS = {
+    1: 5,  # float_val
+    2: 6,  # double_val
+    3: 7,  # int_val
+    4: 7,
+    5: 7,
+    6: 7,
+    9: 10,  # int64_val
+    10: 11,  # bool_val
+    17: 7,
+    19: 13,  # half_val
+    22: 16,  # uint32_val
+    23: 17,  # uint64_val
+}
+
+
+def decode_varint(buf, pos=0):
+    """Decode a varint from `buf` at `pos`.
+
+    Returns:
+        tuple: the decoded integer and the position after it.
+    """
+    result, shift = 0, 0
+    while True:
+        if pos >= len(buf):
+            raise ValueError('Truncated varint.')
+        b = buf[pos]
+        result |= (b & 0x7f) << shift
+        pos += 1
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode_varint(value):
+    """Encode a non-negative integer as a varint."""
+    out = bytearray()
+    while True:
+        b = value & 0x7f
+        value >>= 7
+        if not value:
+            out.append(b)
+            return bytes(out)
+        out.append(b | 0x80)
+
+
+def encode_field(number, value):
+    """Encode a field of a message.
+
+    Integers are encoded as varints, and buffers as length delimited
+    fields. Buffers are not copied, the chunks may be joined once the
+    whole message is encoded.
+
+    Returns:
+        list: the chunks of the encoded field.
+    """
+    if isinstance(value, int):
+        return [encode_varint(number << 3 | VARINT), encode_varint(value)]
+
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    length = value.nbytes if isinstance(value, memoryview) else len(value)
+    header = encode_varint(number << 3 | LENGTH_DELIMITED)
+    return [header, encode_varint(length), value]
+
+
+def encode_message(number, chunks):
+    """Encode the chunks of a message as a field of another message."""
+    length = sum(c.nbytes if isinstance(c, memoryview) else len(c)
+                 for c in chunks)
+    header = encode_varint(number << 3 | LENGTH_DELIMITED)
+    return [header, encode_varint(length)] + chunks
+
+
+def encode_tensor(dtype, shape, content):
+    """Encode a TensorProto with its values in `tensor_content`.
+
+    Args:
+        dtype: int, the tensorflow.DataType of the tensor.
+        shape: list, the size of each dimension.
+        content: bytes-like, the little-endian values of the tensor.
+
+    Returns:
+        list: the chunks of the encoded TensorProto.
+    """
+    dims = []
+    for size in shape:
+        dims.extend(encode_message(2, encode_field(1, int(size))))
+    return (encode_field(1, int(dtype)) +
+            encode_message(2, dims) +
+            encode_field(4, content))
+
+
+def encode_predict_request(model,
+                           inputs,
+                           version=None,
+                           version_label=None,
+                           signature_name=None,
+                           output_filter=None):
+    """Encode a PredictRequest.
+
+    Args:
+        model: str, the name of the model.
+        inputs: dict, the (dtype, shape, content) of each input tensor,
+            see `encode_tensor`.
+        version: int, the version of the model.
+        version_label: str, the version label of the model.
+        signature_name: str, the name of the signature.
+        output_filter: list, the names of the outputs to return.
+
+    Returns:
+        bytes: the serialized PredictRequest.
+    """
+    spec = encode_field(1, model)
+    if version is not None:
+        spec.extend(encode_message(2, encode_field(1, int(version))))
+    if signature_name:
+        spec.extend(encode_field(3, signature_name))
+    if version_label:
+        spec.extend(encode_field(4, version_label))
+
+    chunks = encode_message(1, spec) + _encode_tensor_map(2, inputs)
+    for name in output_filter or []:
+        chunks.extend(encode_field(3, name))
+
+    return b''.join(chunks)
+
+
+def encode_predict_response(outputs):
+    """Encode a PredictResponse.
+
+    Args:
+        outputs: dict, the (dtype, shape, content) of each output tensor,
+            see `encode_tensor`.
+
+    Returns:
+        bytes: the serialized PredictResponse.
+    """
+    return b''.join(_encode_tensor_map(1, outputs))
+
+
+def _encode_tensor_map(number, tensors):
+    """Encode a map<string, TensorProto> field."""
+    chunks = []
+    for name, (dtype, shape, content) in tensors.items():
+        entry = encode_field(1, name) + encode_message(
+            2, encode_tensor(dtype, shape, content))
+        chunks.extend(encode_message(number, entry))
+    return chunks
+
+
+def iter_fields(buf):
+    """Iterate over the fields of a serialized message.
+
+    Length delimited values are returned as memoryviews of `buf`.
+
+    Yields:
+        tuple: the field number, wire type and value of each field.
+    """
+    buf = memoryview(buf)
+    pos = 0
+    while pos < len(buf):
+        tag, pos = decode_varint(buf, pos)
+        number, wire_type = tag >> 3, tag & 0x7
+        if wire_type == VARINT:
+            value, pos = decode_varint(buf, pos)
+            end = pos
+        elif wire_type == FIXED64:
+            end = pos + 8
+        elif wire_type == LENGTH_DELIMITED:
+            length, pos = decode_varint(buf, pos)
+            end = pos + length
+        elif wire_type == FIXED32:
+            end = pos + 4
+        else:
+            raise ValueError('Unsupported wire type {}.'.format(wire_type))
+
+        if end > len(buf):
+            raise ValueError('Truncated field {}.'.format(number))
+
+        if wire_type == FIXED64:
+            value = struct.unpack_from('<Q', buf, pos)[0]
+        elif wire_type == LENGTH_DELIMITED:
+            value = buf[pos:end]
+        elif wire_type == FIXED32:
+            value = struct.unpack_from('<I', buf, pos)[0]
+        pos = end
+        yield number, wire_type, value
+
+
+def get_model_spec(request):
+    """Read the ModelSpec of a serialized Predict, Classify, Regress,
+    GetModelMetadata or GetModelStatus request (always field 1).
+
+    Returns:
+        dict: the "name", "version", "version_label" and "signature_name"
+            of the ModelSpec. Missing fields are None.
+    """
+    spec = {
+        'name': None,
+        'version': None,
+        'version_label': None,
+        'signature_name': None,
+    }
+    for number, wire_type, value in iter_fields(request):
+        if number != 1 or wire_type != LENGTH_DELIMITED:
+            continue
+        for n, _, v in iter_fields(value):
+            if n == 1:
+                spec['name'] = v.tobytes().decode('utf-8')
+            elif n == 2:  # google.protobuf.Int64Value
+                spec['version'] = 0
+                for _, _, version in iter_fields(v):
+                    spec['version'] = version
+            elif n == 3:
+                spec['signature_name'] = v.tobytes().decode('utf-8')
+            elif n == 4:
+                spec['version_label'] = v.tobytes().decode('utf-8')
+    return spec
+
+
+def iter_packed_varints(buf):
+    """Iterate over the values of a packed repeated varint field."""
+    pos = 0
+    while pos < len(buf):
+        value, pos = decode_varint(buf, pos)
+        yield value
+
+
+def decode_tensor(buf):
+    """Decode a serialized TensorProto.
+
+    Returns:
+        dict: the "dtype", "shape" and either the "content" buffer or the
+            typed "values" of the tensor, see `get_tensor_values`.
+    """
+    tensor = {'dtype': 0, 'shape': [], 'content': None, 'values': []}
+    for number, wire_type, value in iter_fields(buf):
+        if number == 1:
+            tensor['dtype'] = value
+        elif number == 2:
+            for n, _, dim in iter_fields(value):
+                if n == 2:
+                    size = 0
+                    for m, _, v in iter_fields(dim):
+                        if m == 1:
+                            size = v
+                    tensor['shape'].append(size)
+        elif number == 4:
+            tensor['content'] = value
+        elif number == TENSOR_VALUE_FIELDS.get(tensor['dtype']):
+            tensor['values'].append((wire_type, value))
+    return tensor
+
+
+def get_tensor_values(tensor):
+    """Get the typed values of a decoded tensor.
+
+    half_val values are returned as the bits of each float16.
+
+    Returns:
+        list: the numbers in the typed values field of the tensor.
+    """
+    fixed = {1: ('<I', '<f'), 2: ('<Q', '<d')}.get(tensor['dtype'])
+    signed = tensor['dtype'] in (3, 5, 6, 9)
+    values = []
+    for wire_type, value in tensor['values']:
+        if fixed is None:
+            if wire_type == LENGTH_DELIMITED:
+                ints = list(iter_packed_varints(value))
+            else:
+                ints = [value]
+            if signed:  # negative varints are 64 bit two's complement
+                ints = [v - (1 << 64) if v >> 63 else v for v in ints]
+            values.extend(ints)
+        elif wire_type == LENGTH_DELIMITED:
+            size = struct.calcsize(fixed[1])
+            values.extend(struct.unpack('<{}{}'.format(
+                len(value) // size, fixed[1][1]), value))
+        else:
+            values.append(struct.unpack(
+                fixed[1], struct.pack(fixed[0], value))[0])
+    return values
+
+
+def decode_predict_response(buf):
+    """Decode the outputs of a serialized PredictResponse.
+
+    Returns:
+        dict: the decoded tensor of each output, see `decode_tensor`.
+    """
+    outputs = {}
+    for number, wire_type, value in iter_fields(buf):
+        if number != 1 or wire_type != LENGTH_DELIMITED:
+            continue
+        name, tensor = None, None
+        for n, _, v in iter_fields(value):
+            if n == 1:
+                name = v.tobytes().decode('utf-8')
+            elif n == 2:
+                tensor = decode_tensor(v)
+        outputs[name] = tensor or decode_tensor(b'')
+    return outputs
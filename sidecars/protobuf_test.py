@@ -0,0 +1,163 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for the protobuf wire format helpers"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import pytest
+
+from sidecars import protobuf
+
+
+def varint(value):
+    out = bytearray()
+    while True:
+        b = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def field(number, value):
+    if isinstance(value, int):
+        return varint(number << 3) + varint(value)
+    return varint(number << 3 | 2) + varint(len(value)) + value
+
+
+def test_decode_varint():
+    for value in (0, 1, 127, 128, 300, 2 ** 40):
+        assert protobuf.decode_varint(varint(value)) == \
+            (value, len(varint(value)))
+
+    with pytest.raises(ValueError):
+        protobuf.decode_varint(b'\x80')
+
+
+def test_iter_fields():
+    buf = field(1, b'abc') + field(2, 150) + \
+        b'\x1d\x01\x00\x00\x00' + b'\x21' + b'\x02' + b'\x00' * 7
+    fields = list(protobuf.iter_fields(buf))
+    assert fields[0][:2] == (1, protobuf.LENGTH_DELIMITED)
+    assert fields[0][2].tobytes() == b'abc'
+    assert fields[1] == (2, protobuf.VARINT, 150)
+    assert fields[2] == (3, protobuf.FIXED32, 1)
+    assert fields[3] == (4, protobuf.FIXED64, 2)
+
+    with pytest.raises(ValueError):
+        list(protobuf.iter_fields(field(1, b'abc')[:-1]))
+
+    with pytest.raises(ValueError):
+        list(protobuf.iter_fields(b'\x21\x00'))  # truncated fixed64
+
+    with pytest.raises(ValueError):
+        list(protobuf.iter_fields(b'\x0b'))  # start group
+
+
+def test_get_model_spec():
+    spec = field(1, b'model') + field(2, field(1, 3)) + \
+        field(3, b'serving_default') + field(4, b'stable')
+    request = field(1, spec) + field(2, b'inputs')
+
+    assert protobuf.get_model_spec(request) == {
+        'name': 'model',
+        'version': 3,
+        'version_label': 'stable',
+        'signature_name': 'serving_default',
+    }
+
+    assert protobuf.get_model_spec(field(1, field(1, b'm'))) == {
+        'name': 'm',
+        'version': None,
+        'version_label': None,
+        'signature_name': None,
+    }
+
+
+def test_encode_varint():
+    for value in (0, 1, 127, 128, 300, 2 ** 40):
+        assert protobuf.encode_varint(value) == varint(value)
+
+
+def test_encode_field():
+    assert b''.join(protobuf.encode_field(2, 150)) == field(2, 150)
+    assert b''.join(protobuf.encode_field(1, 'abc')) == field(1, b'abc')
+    view = memoryview(b'abcd')[1:]
+    assert b''.join(protobuf.encode_field(1, view)) == field(1, b'bcd')
+    assert b''.join(protobuf.encode_message(3, [b'ab', view])) == \
+        field(3, b'abbcd')
+
+
+def test_encode_predict_request():
+    content = b'\x00' * 24
+    request = protobuf.encode_predict_request(
+        'model', {'image': (1, [2, 3], content)}, version=2,
+        version_label='stable', signature_name='serving_default',
+        output_filter=['a', 'b'])
+
+    assert protobuf.get_model_spec(request) == {
+        'name': 'model',
+        'version': 2,
+        'version_label': 'stable',
+        'signature_name': 'serving_default',
+    }
+
+    fields = list(protobuf.iter_fields(request))
+    assert [f[2].tobytes() for f in fields if f[0] == 3] == [b'a', b'b']
+
+    entry = dict((n, v) for n, _, v in
+                 protobuf.iter_fields([f for f in fields if f[0] == 2][0][2]))
+    assert entry[1].tobytes() == b'image'
+    tensor = protobuf.decode_tensor(entry[2])
+    assert tensor['dtype'] == 1
+    assert tensor['shape'] == [2, 3]
+    assert tensor['content'].tobytes() == content
+
+
+def test_decode_predict_response():
+    response = protobuf.encode_predict_response({
+        'a': (1, [1], b'\x00\x00\xc0\x3f'),
+        'b': (9, [], b'\x01' + b'\x00' * 7),
+    })
+    outputs = protobuf.decode_predict_response(response)
+    assert sorted(outputs) == ['a', 'b']
+    assert outputs['a']['shape'] == [1]
+    assert outputs['b']['shape'] == []
+    assert outputs['b']['dtype'] == 9
+
+    # typed values
+    tensor = protobuf.decode_tensor(
+        field(1, 1) + field(5, b'\x00\x00\xc0\x3f') +
+        b'\x2d\x00\x00\x20\x40')
+    assert protobuf.get_tensor_values(tensor) == [1.5, 2.5]
+
+    tensor = protobuf.decode_tensor(
+        field(1, 3) + field(7, varint(1) + varint(2 ** 64 - 1)) +
+        field(7, 4))
+    assert protobuf.get_tensor_values(tensor) == [1, -1, 4]
@@ -0,0 +1,261 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Readiness of TensorFlow Serving based on the load state of its models"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import logging
+import os
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler
+
+import writers
+
+from sidecars.utils import ThreadingHTTPServer
+
+
+class ReadinessMonitor(object):  # pylint: disable=useless-object-inheritance
+    """Poll the status of every model in the model config file.
+
+    A model is ready once all of its configured versions are AVAILABLE,
+    or every version TensorFlow Serving reports that has not ended if all
+    versions are served. A ready model stays ready
+    while any of its versions is AVAILABLE, so loading a new version
+    during a rollout does not take the server out of service.
+
+    Models added to the config after the server is first ready, such as
+    the models loaded on demand by a ``ResidencyManager``, are reported
+    but do not take the server out of service while they load.
+
+    Args:
+        path: str, the filepath of the model config file.
+        status_client: writers.ModelStatusClient, client of the REST
+            status API of TensorFlow Serving.
+        interval: float, seconds between polls of the model status.
+    """
+
+    def __init__(self, path, status_client, interval=5):
+        self.path = path
+        self.status_client = status_client
+        self.interval = float(interval)
+        self._mtime = None
+        self._models = []
+        self._start_times = {}
+        self._load_seconds = {}
+        self._gating = set()
+        self._ready_once = False
+        self._report = {'ready': False, 'models': {}}
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(str(self.__class__.__name__))
+
+    def _read_config(self):
+        """Re-read the model config file if it has changed."""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            self._mtime, self._models = None, []
+            return
+        if mtime == self._mtime:
+            return
+
+        self._models = writers.read_model_config(self.path)
+        self._mtime = mtime
+
+        now = time.time()
+        names = set(m['name'] for m in self._models)
+        for name in names - set(self._start_times):
+            self._start_times[name] = now
+            if not self._ready_once:
+                self._gating.add(name)
+        for name in set(self._start_times) - names:
+            del self._start_times[name]
+            self._load_seconds.pop(name, None)
+            self._gating.discard(name)
+
+    def _get_versions(self, name):
+        """Get the state of each version of a model, by version."""
+        try:
+            statuses = self.status_client.get_model_status(name)
+        except (RuntimeError, OSError) as err:
+            self.logger.debug('Failed to get status of `%s`: %s', name, err)
+            statuses = []
+        return {s['version']: s['state'] for s in statuses}
+
+    def check(self):
+        """Poll the status of each configured model.
+
+        Returns:
+            dict: the readiness report, see `get_report`.
+        """
+        self._read_config()
+
+        models = {}
+        for model in self._models:
+            name = model['name']
+            versions = self._get_versions(name)
+            available = set(v for v, s in versions.items()
+                            if s == 'AVAILABLE')
+
+            if model['versions'] is None:
+                loaded = bool(available) and all(
+                    s == 'AVAILABLE' for s in versions.values()
+                    if s != 'END')
+            else:
+                loaded = bool(model['versions']) and \
+                    set(model['versions']).issubset(available)
+
+            if loaded and name not in self._load_seconds:
+                self._load_seconds[name] = time.time() - \
+                    self._start_times[name]
+                self.logger.info('Model `%s` loaded in %.1fs.', name,
+                                 self._load_seconds[name])
+
+            models[name] = {
+                'ready': bool(available) and name in self._load_seconds,
+                'versions': {str(v): s for v, s in sorted(versions.items())},
+                'load_seconds': self._load_seconds.get(name),
+            }
+
+        ready = self._mtime is not None and \
+            all(models[n]['ready'] for n in self._gating if n in models)
+        self._ready_once = self._ready_once or ready
+        report = {'ready': ready, 'models': models}
+        with self._lock:
+            self._report = report
+        return report
+
+    def get_report(self):
+        """Get the result of the last check.
+
+        Returns:
+            dict: whether all models are "ready" and, for each model in
+                "models", whether it is "ready", the state of its
+                "versions" and the "load_seconds" until it was first ready.
+        """
+        with self._lock:
+            return self._report
+
+    def is_ready(self):
+        return self.get_report()['ready']
+
+    def wait(self, timeout=None):
+        """Block until all configured models are ready.
+
+        Returns:
+            bool: whether the models are ready before the timeout.
+        """
+        start = time.time()
+        while not self.check()['ready']:
+            if timeout is not None and time.time() - start >= timeout:
+                return False
+            time.sleep(self.interval)
+        return True
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as err:  # pylint: disable=broad-except
+                self.logger.error('Failed to check readiness: %s', err)
+
+    def start(self):
+        """Poll the model status in a daemon thread."""
+        self.check()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+class ReadinessHandler(BaseHTTPRequestHandler):
+    """Serve the readiness of the server's monitor."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        self.server.readiness.logger.debug(format, *args)
+
+    def _send(self, status, body):
+        data = json.dumps(body, sort_keys=True).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server.readiness
+        report = server.monitor.get_report()
+        if self.path == server.ready_path:
+            self._send(200 if report['ready'] else 503,
+                       {'ready': report['ready']})
+        elif self.path == server.report_path:
+            self._send(200, report)
+        else:
+            self._send(404, {'error': 'not found'})
+
+
+class ReadinessServer(object):  # pylint: disable=useless-object-inheritance
+    """Expose the readiness of TensorFlow Serving to Kubernetes probes.
+
+    The ready path responds 200 once every configured model is ready and
+    503 otherwise. The report path returns the state and load time of
+    each model.
+
+    Args:
+        monitor: ReadinessMonitor, the monitor of the model status.
+        host: str, host to listen on
+        port: int, port to listen on
+        ready_path: str, path of the readiness endpoint
+        report_path: str, path of the model load report
+    """
+
+    def __init__(self,
+                 monitor,
+                 host='0.0.0.0',
+                 port=8503,
+                 ready_path='/readyz',
+                 report_path='/models'):
+        self.monitor = monitor
+        self.ready_path = str(ready_path)
+        self.report_path = str(report_path)
+        self.server = ThreadingHTTPServer((host, int(port)), ReadinessHandler)
+        self.server.readiness = self
+        self.logger = logging.getLogger(str(self.__class__.__name__))
+
+    def serve_forever(self):
+        self.logger.info('Serving readiness of %s on port %s.',
+                         self.monitor.path, self.server.server_address[1])
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,232 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for the readiness monitor and endpoint"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import http.client
+import itertools
+import json
+import os
+
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+import sidecars
+import writers
+
+from sidecars.utils import ThreadingHTTPServer
+from sidecars.utils import start_server
+
+
+MTIMES = itertools.count(1)
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    """Stand-in for the TensorFlow Serving model status API."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *_):
+        pass
+
+    def do_GET(self):
+        name = self.path[len('/v1/models/'):]
+        if name == 'error':
+            code, body = 500, {'error': 'internal'}
+        elif name in self.server.statuses:
+            code = 200
+            body = {'model_version_status': [
+                {'version': str(v), 'state': s}
+                for v, s in sorted(self.server.statuses[name].items())]}
+        else:
+            code, body = 404, {'error': 'not found'}
+
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def status_server():
+    server = ThreadingHTTPServer(('localhost', 0), StatusHandler)
+    server.statuses = {}
+    start_server(server)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def write_config(tmpdir, models):
+    path = os.path.join(str(tmpdir), 'models.conf')
+    with open(path, 'w') as f:
+        f.write('model_config_list: {\n')
+        for name, versions in models.items():
+            f.write('  config: {{ name: "{}", base_path: "gs://b/{}", '
+                    'model_platform: "tensorflow", '.format(name, name))
+            if versions:
+                f.write('model_version_policy: { specific: { ')
+                f.write(' '.join('versions: {}'.format(v) for v in versions))
+                f.write(' } } ')
+            f.write('}\n')
+        f.write('}\n')
+    # force a new mtime on each write
+    mtime = os.path.getmtime(path) + next(MTIMES)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def get_monitor(status_server, path):
+    client = writers.ModelStatusClient(
+        'localhost', status_server.server_address[1])
+    return sidecars.ReadinessMonitor(path, client, interval=0.01)
+
+
+class TestReadinessMonitor(object):
+
+    def test_check(self, tmpdir, status_server):
+        path = write_config(tmpdir, {'a': None, 'b': [1, 2]})
+        monitor = get_monitor(status_server, path)
+
+        # the server is not up yet
+        report = monitor.check()
+        assert not report['ready']
+        assert report['models']['a'] == {
+            'ready': False, 'versions': {}, 'load_seconds': None}
+
+        status_server.statuses = {
+            'a': {1: 'LOADING'},
+            'b': {1: 'AVAILABLE', 2: 'LOADING'},
+        }
+        report = monitor.check()
+        assert not report['ready']
+        assert report['models']['b']['versions'] == {
+            '1': 'AVAILABLE', '2': 'LOADING'}
+        assert not report['models']['b']['ready']
+
+        # every version of an all policy must be available
+        status_server.statuses['a'] = {1: 'AVAILABLE', 2: 'LOADING'}
+        report = monitor.check()
+        assert not report['models']['a']['ready']
+
+        # except the versions that ended
+        status_server.statuses['a'] = {1: 'END', 2: 'AVAILABLE'}
+        report = monitor.check()
+        assert report['models']['a']['ready']
+
+        # all versions of a specific policy must be available
+        status_server.statuses['a'] = {1: 'AVAILABLE'}
+        report = monitor.check()
+        assert not report['ready']
+        assert report['models']['a']['ready']
+        assert report['models']['a']['load_seconds'] >= 0
+
+        status_server.statuses['b'][2] = 'AVAILABLE'
+        report = monitor.check()
+        assert report['ready']
+        assert monitor.is_ready()
+        assert monitor.get_report() == report
+
+        # loading a new version keeps the model ready
+        status_server.statuses['b'][3] = 'LOADING'
+        write_config(tmpdir, {'a': None, 'b': [2, 3]})
+        assert monitor.check()['ready']
+
+        # a model added once the server is ready does not unset readiness
+        write_config(tmpdir, {'a': None, 'b': [2, 3], 'c': None})
+        report = monitor.check()
+        assert report['ready']
+        assert not report['models']['c']['ready']
+        assert report['models']['c']['load_seconds'] is None
+
+        status_server.statuses['c'] = {1: 'AVAILABLE'}
+        report = monitor.check()
+        assert report['models']['c']['ready']
+        assert report['models']['c']['load_seconds'] >= 0
+
+        # removed models are not reported
+        write_config(tmpdir, {'b': [2, 3]})
+        report = monitor.check()
+        assert report['ready']
+        assert list(report['models']) == ['b']
+
+    def test_errors(self, tmpdir, status_server):
+        # no config file
+        path = os.path.join(str(tmpdir), 'models.conf')
+        monitor = get_monitor(status_server, path)
+        assert not monitor.check()['ready']
+
+        # errors of the status API
+        path = write_config(tmpdir, {'error': None})
+        assert not monitor.check()['ready']
+
+    def test_wait(self, tmpdir, status_server):
+        path = write_config(tmpdir, {'a': [1]})
+        monitor = get_monitor(status_server, path)
+        assert not monitor.wait(timeout=0.05)
+
+        status_server.statuses = {'a': {1: 'AVAILABLE'}}
+        assert monitor.wait(timeout=1)
+
+
+class TestReadinessServer(object):
+
+    def test_endpoints(self, tmpdir, status_server):
+        path = write_config(tmpdir, {'a': [1]})
+        monitor = get_monitor(status_server, path)
+        server = sidecars.ReadinessServer(monitor, host='localhost', port=0)
+        start_server(server.server)
+
+        def get(path):
+            connection = http.client.HTTPConnection(
+                'localhost', server.server.server_address[1])
+            connection.request('GET', path)
+            response = connection.getresponse()
+            body = json.loads(response.read().decode('utf-8'))
+            connection.close()
+            return response.status, body
+
+        try:
+            monitor.check()
+            assert get('/readyz') == (503, {'ready': False})
+
+            status_server.statuses = {'a': {1: 'AVAILABLE'}}
+            monitor.check()
+            assert get('/readyz') == (200, {'ready': True})
+
+            status, report = get('/models')
+            assert status == 200
+            assert report['models']['a']['versions'] == {'1': 'AVAILABLE'}
+            assert report['models']['a']['load_seconds'] >= 0
+
+            assert get('/other')[0] == 404
+        finally:
+            server.shutdown()
@@ -0,0 +1,401 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Keep the most requested models resident within a memory budget"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import logging
+import os
+import re
+import threading
+import time
+
+import writers
+
+from writers.writers import ModelConfigWriter
+
+from sidecars.utils import HTTPConnectionPool
+
+
+REQUEST_COUNT_METRIC = ':tensorflow:serving:request_count'
+
+_MODEL_NAME_PATTERN = re.compile(r'model_name="([^"]*)"')
+
+
+def parse_request_counts(text, metric=REQUEST_COUNT_METRIC):
+    """Sum the request counts of each model in Prometheus metrics.
+
+    Args:
+        text: str, the Prometheus text exposition of TensorFlow Serving.
+        metric: str, the name of the request counter.
+
+    Returns:
+        dict: the total number of requests of each model.
+    """
+    counts = collections.defaultdict(float)
+    prefix = '{}{{'.format(metric)
+    for line in text.splitlines():
+        if not line.startswith(prefix):
+            continue
+        labels, _, value = line[len(prefix):].rpartition('}')
+        match = _MODEL_NAME_PATTERN.search(labels)
+        if match and value.split():
+            counts[match.group(1)] += float(value.split()[0])
+    return dict(counts)
+
+
+class PrometheusRequestCounter(object):
+    """Scrape the new requests of each model from TensorFlow Serving.
+
+    Args:
+        host: str, hostname of the TensorFlow Serving REST API
+        port: int, port of the TensorFlow Serving REST API
+        path: str, the Prometheus endpoint of the monitoring config
+        timeout: float, timeout in seconds of each scrape
+    """
+
+    def __init__(self, host, port,
+                 path='/monitoring/prometheus/metrics',
+                 timeout=10):
+        self.pool = HTTPConnectionPool(host, port, timeout=timeout)
+        self.path = str(path)
+        self._totals = None
+        self.logger = logging.getLogger(str(self.__class__.__name__))
+
+    def scrape(self):
+        """Get the number of requests of each model since the last scrape.
+
+        Returns:
+            dict: the number of new requests of each model.
+        """
+        status, _, body = self.pool.request('GET', self.path)
+        if status != 200:
+            raise RuntimeError('Failed to scrape {}: {}'.format(
+                self.path, status))
+
+        totals = parse_request_counts(body.decode('utf-8'))
+        previous, self._totals = self._totals, totals
+        if previous is None:
+            return {}
+
+        counts = {}
+        for model, total in totals.items():
+            # counters restart with the server
+            count = total - previous.get(model, 0)
+            count = total if count < 0 else count
+            if count:
+                counts[model] = count
+        return counts
+
+
+class ResidentConfigWriter(ModelConfigWriter):
+    """Write the resident models of a catalog of models.
+
+    The catalog is a model config file of all servable models, e.g. as
+    written by `write_config_file.py`.
+
+    Args:
+        catalog_path: str, the filepath of the catalog model config file.
+    """
+
+    def __init__(self, catalog_path):
+        self.catalog_path = catalog_path
+        self.resident = set()
+        self._models = collections.OrderedDict()
+        self._mtime = None
+        super(ResidentConfigWriter, self).__init__('', '')
+
+    def read(self):
+        """Re-read the catalog if it has changed.
+
+        Returns:
+            list: the names of all models in the catalog.
+        """
+        mtime = os.path.getmtime(self.catalog_path)
+        if mtime != self._mtime:
+            self._models = collections.OrderedDict(
+                (m['name'], m) for m in
+                writers.read_model_config(self.catalog_path))
+            self.model_versions = {
+                n: m['versions'] for n, m in self._models.items()
+                if m['versions']}
+            self.version_labels = {
+                n: m['version_labels'] for n, m in self._models.items()
+                if m['version_labels']}
+            self._mtime = mtime
+        return list(self._models)
+
+    def get_model_url(self, model):
+        return self._models[model]['base_path']
+
+    def _get_models_from_bucket(self):
+        for model in self._models:
+            if model in self.resident:
+                yield model
+
+    def write(self, path):
+        """Write the resident models to the config file at `path`.
+
+        Args:
+            path: str, the filepath of the config file to write.
+        """
+        if any(m in self.resident for m in self._models):
+            super(ResidentConfigWriter, self).write(path)
+            return
+
+        with open(path, 'w+') as config_file:
+            config_file.write('model_config_list: {\n}\n')
+
+
+class ResidencyManager(object):  # pylint: disable=useless-object-inheritance
+    """Load and unload models on demand within a memory budget.
+
+    Each model is scored by its request rate, decayed with `half_life`
+    (LFU), and ties are broken by the time of its last request (LRU).
+    Requested models are always loaded. When the resident models exceed
+    `memory_budget`, the lowest scored models are unloaded, except those
+    loaded in the last `min_residency_seconds`. Models without requests
+    for `idle_seconds` are unloaded. The gap between both durations keeps
+    models from being loaded and unloaded in turn.
+
+    Request counts are scraped from Prometheus with `counter`, or counted
+    by `acquire` if no counter is given.
+
+    Only callers of `acquire` wait for a model to load, so requests for a
+    model that is not resident must go through the gateway.
+
+    Args:
+        writer: ResidentConfigWriter, writes the resident models.
+        path: str, the filepath of the model config file of the server.
+        status_client: writers.ModelStatusClient, client of the REST
+            status API of TensorFlow Serving.
+        memory_budget: int, bytes of the models that may be resident.
+        model_sizes: dict, the size in bytes of each model.
+        default_model_bytes: int, the size of models not in `model_sizes`.
+        counter: PrometheusRequestCounter, scrapes the request counts.
+        idle_seconds: float, seconds without requests before unloading.
+        min_residency_seconds: float, seconds a model is kept loaded.
+        half_life: float, seconds for request counts to decay by half.
+        interval: float, seconds between updates of the resident models.
+        poll_interval: float, seconds between status polls of cold models.
+    """
+
+    def __init__(self,
+                 writer,
+                 path,
+                 status_client,
+                 memory_budget,
+                 model_sizes=None,
+                 default_model_bytes=0,
+                 counter=None,
+                 idle_seconds=600,
+                 min_residency_seconds=60,
+                 half_life=300,
+                 interval=5,
+                 poll_interval=0.5):
+        self.writer = writer
+        self.path = path
+        self.status_client = status_client
+        self.memory_budget = int(memory_budget)
+        self.model_sizes = dict(model_sizes or {})
+        self.default_model_bytes = int(default_model_bytes)
+        self.counter = counter
+        self.idle_seconds = float(idle_seconds)
+        self.min_residency_seconds = float(min_residency_seconds)
+        self.half_life = float(half_life)
+        self.interval = float(interval)
+        self.poll_interval = float(poll_interval)
+
+        self._frequencies = {}  # model: (decayed count, time of decay)
+        self._last_used = {}
+        self._loaded_at = {}
+        self._demanded = set()
+        self._available = set()
+        self._start_time = time.time()
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self.logger = logging.getLogger(str(self.__class__.__name__))
+
+    def get_size(self, model):
+        return self.model_sizes.get(model, self.default_model_bytes)
+
+    def get_score(self, model, now=None):
+        """Get the decayed request count and the time of the last request.
+
+        Returns:
+            tuple: the score of the model, higher scores are kept.
+        """
+        now = time.time() if now is None else now
+        count, updated = self._frequencies.get(model, (0, now))
+        count *= 0.5 ** ((now - updated) / self.half_life)
+        return count, self._last_used.get(model, self._start_time)
+
+    def record(self, model, count=1):
+        """Count `count` new requests of `model`."""
+        with self._lock:
+            now = time.time()
+            self._frequencies[model] = (self.get_score(model, now)[0] + count,
+                                        now)
+            self._last_used[model] = now
+
+    def get_resident(self):
+        return set(self.writer.resident)
+
+    def _write(self, resident):
+        """Atomically write the config so the server never reads a partial
+        file while polling."""
+        now = time.time()
+        for model in resident - self.writer.resident:
+            self._loaded_at[model] = now
+        for model in self.writer.resident - resident:
+            self._loaded_at.pop(model, None)
+            self._available.discard(model)
+
+        self.logger.info('Resident models: %s', ', '.join(sorted(resident)))
+        self.writer.resident = set(resident)
+        tmp_path = '{}.tmp'.format(self.path)
+        self.writer.write(tmp_path)
+        os.rename(tmp_path, self.path)
+
+    def fill(self):
+        """Load the models of the catalog that fit in the budget."""
+        with self._lock:
+            resident, total = set(), 0
+            for model in self.writer.read():
+                if total + self.get_size(model) <= self.memory_budget:
+                    resident.add(model)
+                    total += self.get_size(model)
+            self._write(resident)
+
+    def update(self):
+        """Load the requested models and unload idle or cold models.
+
+        Returns:
+            set: the names of the resident models.
+        """
+        if self.counter is not None:
+            for model, count in self.counter.scrape().items():
+                self.record(model, count)
+
+        with self._lock:
+            now = time.time()
+            catalog = set(self.writer.read())
+            self._demanded &= catalog
+
+            resident = self.writer.resident & catalog
+            for model in list(resident - self._demanded):
+                idle = now - self._last_used.get(model, self._start_time)
+                if idle >= self.idle_seconds:
+                    resident.discard(model)
+
+            resident |= self._demanded
+
+            evictable = sorted(
+                (m for m in resident - self._demanded
+                 if now - self._loaded_at.get(m, 0) >=
+                 self.min_residency_seconds),
+                key=lambda m: self.get_score(m, now))
+            total = sum(self.get_size(m) for m in resident)
+            while total > self.memory_budget and evictable:
+                model = evictable.pop(0)
+                resident.discard(model)
+                total -= self.get_size(model)
+
+            if total > self.memory_budget:
+                self.logger.warning('Resident models use %s bytes, over the '
+                                    'budget of %s bytes.', total,
+                                    self.memory_budget)
+
+            if resident != self.writer.resident:
+                self._write(resident)
+            return set(resident)
+
+    def acquire(self, model, timeout=None):
+        """Wait until `model` is AVAILABLE, loading it if it is not resident.
+
+        Models that are not in the catalog are not waited for.
+
+        Args:
+            model: str, the name of the requested model.
+            timeout: float, seconds to wait for the model to load.
+
+        Raises:
+            TimeoutError: the model is not AVAILABLE before the timeout.
+        """
+        with self._lock:
+            if self.counter is None:
+                self.record(model)
+            else:
+                self._last_used[model] = time.time()
+
+            if model in self._available:
+                return
+            if model not in self.writer.read():
+                return
+            if model not in self.writer.resident:
+                self._demanded.add(model)
+                self._wake.set()
+
+        start = time.time()
+        while True:
+            try:
+                available = self.status_client.is_available(model)
+            except (RuntimeError, OSError) as err:
+                self.logger.debug('Failed to get status of `%s`: %s',
+                                  model, err)
+                available = False
+
+            if available:
+                with self._lock:
+                    self._available.add(model)
+                    self._demanded.discard(model)
+                return
+
+            if timeout is not None and time.time() - start >= timeout:
+                with self._lock:
+                    self._demanded.discard(model)
+                raise TimeoutError('Model "{}" is not AVAILABLE after {}s.'
+                                   .format(model, timeout))
+            time.sleep(self.poll_interval)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.update()
+            except Exception as err:  # pylint: disable=broad-except
+                self.logger.error('Failed to update resident models: %s', err)
+
+    def start(self):
+        """Load the initial models and update them in a daemon thread."""
+        self.fill()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+        return thread
@@ -0,0 +1,282 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for the model residency manager"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+import sidecars
+import writers
+
+from sidecars import residency
+from sidecars.utils import ThreadingHTTPServer
+from sidecars.utils import start_server
+
+
+METRICS = '\n'.join([
+    '# TYPE :tensorflow:serving:request_count counter',
+    ':tensorflow:serving:request_count{{entrypoint="GRPC",model_name="a",'
+    'status="OK"}} {a}',
+    ':tensorflow:serving:request_count{{entrypoint="REST",model_name="a",'
+    'status="OK"}} 1',
+    ':tensorflow:serving:request_count{{entrypoint="GRPC",model_name="b",'
+    'status="OK"}} {b}',
+    ':tensorflow:serving:request_latency_count{{model_name="a"}} 100',
+])
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Stand-in for the Prometheus endpoint of TensorFlow Serving."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *_):
+        pass
+
+    def do_GET(self):
+        code = 200 if self.path == '/metrics' else 404
+        data = METRICS.format(**self.server.counts).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def metrics_server():
+    server = ThreadingHTTPServer(('localhost', 0), MetricsHandler)
+    server.counts = {'a': 0, 'b': 0}
+    start_server(server)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class DummyStatusClient(object):
+    """Models are AVAILABLE once they are in the model config file."""
+
+    def __init__(self, path, load=True):
+        self.path = path
+        self.load = load
+
+    def is_available(self, model, version=None, label=None):
+        if not os.path.exists(self.path):
+            return False
+        return self.load and model in get_models(self.path)
+
+
+def get_models(path):
+    return [m['name'] for m in writers.read_model_config(path)]
+
+
+def write_catalog(tmpdir, names):
+    path = os.path.join(str(tmpdir), 'catalog.conf')
+    with open(path, 'w') as f:
+        f.write('model_config_list: {\n')
+        for name in names:
+            f.write('  config: {{ name: "{}", base_path: "gs://b/{}", '
+                    'model_platform: "tensorflow" }}\n'.format(name, name))
+        f.write('  config: { name: "v", base_path: "gs://b/v", '
+                'model_platform: "tensorflow", model_version_policy: '
+                '{ specific: { versions: 2 } } '
+                'version_labels: { key: "stable" value: 2 } }\n')
+        f.write('}\n')
+    return path
+
+
+def get_manager(tmpdir, names=('a', 'b', 'c'), load=True, **kwargs):
+    path = os.path.join(str(tmpdir), 'models.conf')
+    writer = sidecars.ResidentConfigWriter(write_catalog(tmpdir, names))
+    kwargs.setdefault('model_sizes', {'a': 4, 'b': 4, 'c': 4, 'v': 4})
+    kwargs.setdefault('memory_budget', 8)
+    kwargs.setdefault('min_residency_seconds', 0)
+    return sidecars.ResidencyManager(
+        writer, path, DummyStatusClient(path, load=load),
+        poll_interval=0.01, **kwargs)
+
+
+def test_parse_request_counts():
+    counts = residency.parse_request_counts(METRICS.format(a=2, b=3))
+    assert counts == {'a': 3, 'b': 3}
+    assert residency.parse_request_counts('') == {}
+
+
+class TestPrometheusRequestCounter(object):
+
+    def test_scrape(self, metrics_server):
+        counter = sidecars.PrometheusRequestCounter(
+            'localhost', metrics_server.server_address[1], path='/metrics')
+
+        # the first scrape is the baseline
+        metrics_server.counts = {'a': 5, 'b': 1}
+        assert counter.scrape() == {}
+
+        metrics_server.counts = {'a': 7, 'b': 1}
+        assert counter.scrape() == {'a': 2}
+
+        # the counters restart with the server
+        metrics_server.counts = {'a': 1, 'b': 1}
+        assert counter.scrape() == {'a': 2}
+
+        counter.path = '/other'
+        with pytest.raises(RuntimeError):
+            counter.scrape()
+
+
+class TestResidentConfigWriter(object):
+
+    def test_write(self, tmpdir):
+        writer = sidecars.ResidentConfigWriter(
+            write_catalog(tmpdir, ['a', 'b']))
+        assert writer.read() == ['a', 'b', 'v']
+
+        path = os.path.join(str(tmpdir), 'models.conf')
+        writer.write(path)
+        assert writers.read_model_config(path) == []
+
+        writer.resident = {'b', 'v', 'other'}
+        writer.write(path)
+        models = writers.read_model_config(path)
+        assert [m['name'] for m in models] == ['b', 'v']
+        assert models[0]['base_path'] == 'gs://b/b'
+        assert models[1]['versions'] == [2]
+        assert models[1]['version_labels'] == {'stable': 2}
+
+
+class TestResidencyManager(object):
+
+    def test_fill(self, tmpdir):
+        manager = get_manager(tmpdir)
+        manager.fill()
+        assert manager.get_resident() == {'a', 'b'}
+        assert get_models(manager.path) == ['a', 'b']
+
+    def test_acquire(self, tmpdir):
+        manager = get_manager(tmpdir)
+        manager.fill()
+
+        # resident models do not wait
+        manager.acquire('a', timeout=0)
+        manager.acquire('a', timeout=0)
+
+        # unknown models are left to the server
+        manager.acquire('unknown', timeout=0)
+
+        # cold models are queued until they are loaded
+        thread = threading.Thread(target=manager.acquire, args=('c', 5))
+        thread.start()
+        time.sleep(0.05)
+        assert thread.is_alive()
+
+        manager.update()
+        thread.join(5)
+        assert not thread.is_alive()
+
+        # the least requested model is unloaded to fit in the budget
+        assert manager.get_resident() == {'a', 'c'}
+        assert get_models(manager.path) == ['a', 'c']
+
+    def test_acquire_timeout(self, tmpdir):
+        manager = get_manager(tmpdir, load=False)
+        manager.fill()
+        with pytest.raises(TimeoutError):
+            manager.acquire('c', timeout=0.05)
+
+        # the model is no longer demanded
+        manager.update()
+        assert 'c' not in manager.get_resident()
+
+    def test_update(self, tmpdir):
+        manager = get_manager(tmpdir)
+        manager.fill()
+
+        manager.record('a', 10)
+        manager.record('b', 1)
+        manager.record('v', 5)
+        manager._demanded.add('v')
+        assert manager.update() == {'a', 'v'}
+
+        # demanded models replace the least requested model
+        manager._demanded.clear()
+        manager._demanded.add('b')
+        assert manager.update() == {'a', 'b'}
+
+    def test_hysteresis(self, tmpdir):
+        manager = get_manager(tmpdir, min_residency_seconds=60)
+        manager.fill()
+
+        # recently loaded models are not unloaded over the budget
+        manager._demanded.add('c')
+        assert manager.update() == {'a', 'b', 'c'}
+
+        # until they were resident long enough
+        manager._demanded.clear()
+        manager.record('a')
+        manager.record('c')
+        manager.min_residency_seconds = 0
+        assert manager.update() == {'a', 'c'}
+
+    def test_idle(self, tmpdir):
+        manager = get_manager(tmpdir, idle_seconds=0.05)
+        manager.fill()
+        manager.record('a')
+        assert manager.update() == {'a', 'b'}
+
+        time.sleep(0.05)
+        manager.record('b')
+        assert manager.update() == {'b'}
+
+    def test_counter(self, tmpdir, metrics_server):
+        counter = sidecars.PrometheusRequestCounter(
+            'localhost', metrics_server.server_address[1], path='/metrics')
+        manager = get_manager(tmpdir, counter=counter)
+        manager.fill()
+        manager.update()
+
+        # requests are counted by Prometheus, not by acquire
+        manager.acquire('a', timeout=0)
+        assert manager.get_score('a')[0] == 0
+
+        metrics_server.counts = {'a': 0, 'b': 3}
+        manager.update()
+        assert manager.get_score('b')[0] == pytest.approx(3, rel=1e-3)
+
+    def test_start(self, tmpdir):
+        manager = get_manager(tmpdir, interval=0.01)
+        manager.start()
+        assert manager.get_resident() == {'a', 'b'}
+
+        manager.acquire('c', timeout=5)
+        assert 'c' in manager.get_resident()
@@ -0,0 +1,93 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Shared helpers for the sidecar servers"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import http.client
+import socketserver
+import threading
+
+from http.server import HTTPServer
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """HTTPServer handling each request in a thread."""
+
+    daemon_threads = True
+
+
+class HTTPConnectionPool(object):  # pylint: disable=useless-object-inheritance
+    """Keep-alive HTTP connections to a single upstream, one per thread.
+
+    Args:
+        host: str, hostname of the upstream server
+        port: int, port of the upstream server
+        timeout: float, timeout in seconds of each request
+    """
+
+    def __init__(self, host, port, timeout=60):
+        self.host = str(host)
+        self.port = int(port)
+        self.timeout = float(timeout)
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request, retrying once on a stale connection.
+
+        Returns:
+            tuple: the status code, the list of headers and the body.
+        """
+        for attempt in range(2):
+            connection = getattr(self._local, 'connection', None)
+            if connection is None:
+                connection = http.client.HTTPConnection(
+                    self.host, self.port, timeout=self.timeout)
+                self._local.connection = connection
+            try:
+                connection.request(method, path, body=body,
+                                   headers=headers or {})
+                response = connection.getresponse()
+                return response.status, response.getheaders(), response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+        raise AssertionError('unreachable')
+
+
+def start_server(server):
+    """Serve requests from `server` in a daemon thread.
+
+    Returns:
+        threading.Thread: the thread running the server.
+    """
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return thread
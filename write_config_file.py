@@ -36,6 +36,7 @@ import os
 import sys
 import argparse
 import logging
+import json
 
 from decouple import config
 
@@ -71,6 +72,11 @@ def get_arg_parser():
 
     parser = argparse.ArgumentParser()
 
+    parser.add_argument('command', nargs='?', default='write',
+                        choices=['write', 'publish'],
+                        help='Write the config files, or publish the '
+                             'manifest of each source.')
+
     # Model Config args
     parser.add_argument('-c', '--cloud-provider',
                         choices=['aws', 'gke'],
@@ -85,10 +91,86 @@ def get_arg_parser():
                         default=os.path.join(root_dir, 'models.conf'),
                         help='Full filepath of configuration file')
 
-    parser.add_argument('-b', '--storage-bucket', required=True,
+    parser.add_argument('-b', '--storage-bucket',
                         help='Cloud Storage Bucket '
                              '(e.g. gs://deepcell-models)')
 
+    parser.add_argument('-s', '--source', action='append', default=[],
+                        help='Additional model sources as comma separated '
+                             '"[namespace=]protocol://bucket/prefix" '
+                             '(e.g. exp=s3://bucket/models). The '
+                             '--storage-bucket has the highest precedence.')
+
+    parser.add_argument('--collision', default='precedence',
+                        choices=['precedence', 'namespace', 'error'],
+                        help='How to resolve models with the same name '
+                             'in several sources.')
+
+    parser.add_argument('--s3-endpoint-url', default='',
+                        help='Endpoint of an S3-compatible store.')
+
+    parser.add_argument('--model-listing', default='list',
+                        choices=['list', 'manifest'],
+                        help='Find the models by listing each source, or '
+                             'from its published manifest.')
+
+    parser.add_argument('--max-manifest-age', type=float, default=0,
+                        help='Seconds after which a manifest is stale and '
+                             'the source is listed. Never if 0.')
+
+    parser.add_argument('--manifest-cache-dir', default='',
+                        help='Directory of the last downloaded manifests.')
+
+    parser.add_argument('--version-labels-file',
+                        help='JSON file mapping each model to its version '
+                             'labels (e.g. {"model": {"stable": 1}})')
+
+    parser.add_argument('--version-label', action='append', default=[],
+                        help='Version labels of a model as '
+                             '"model:label=version[,label=version]". '
+                             'Overrides --version-labels-file.')
+
+    parser.add_argument('--model-versions-file',
+                        help='JSON file mapping each model to the versions '
+                             'pinned by rollouts (e.g. {"model": [2]}). '
+                             'Other models serve all versions.')
+
+    # Optimization Args
+    parser.add_argument('--optimize', default='none',
+                        choices=['none', 'constant_folding', 'float16',
+                                 'int8'],
+                        help='Publish an optimized version of each model '
+                             'before writing the config. '
+                             'Requires tensorflow.')
+
+    parser.add_argument('--optimization-samples',
+                        help='.npz file of sample inputs keyed by input name '
+                             'used to measure the accuracy delta.')
+
+    parser.add_argument('--max-accuracy-delta', type=float, default=1e-2,
+                        help='Maximum mean absolute output difference of an '
+                             'optimized version.')
+
+    parser.add_argument('--optimized-label', default='optimized',
+                        help='Version label of the optimized versions.')
+
+    # Rollout Args
+    parser.add_argument('--rollout', action='append', default=[],
+                        help='Roll out a new model version as '
+                             '"model:version" against a running server.')
+
+    parser.add_argument('--rest-api-host', default='localhost',
+                        help='Host of the TensorFlow Serving REST API.')
+
+    parser.add_argument('--rest-api-port', type=int, default=8501,
+                        help='Port of the TensorFlow Serving REST API.')
+
+    parser.add_argument('--canary-seconds', type=float, default=0,
+                        help='Seconds to serve a canary before promotion.')
+
+    parser.add_argument('--rollout-timeout', type=float, default=600,
+                        help='Seconds to wait for each rollout stage.')
+
     # Batch Config Args
     parser.add_argument('--enable-batching', type=bool, default=True,
                         help='Boolean switch for batching configuration.')
@@ -106,6 +188,26 @@ def get_arg_parser():
                         default=os.path.join(root_dir, 'batch.conf'),
                         help='Full filepath of batch configuration file')
 
+    # Server Flags Args
+    parser.add_argument('--server-flags-file-path',
+                        default=os.path.join(root_dir, 'server_flags.env'),
+                        help='Full filepath of the server flags env file.')
+
+    parser.add_argument('--model-sizes-file-path', default='',
+                        help='Full filepath of a JSON file of the size in '
+                             'bytes of each model.')
+
+    parser.add_argument('--cpu-limit', default='',
+                        help='CPUs of the server. The server flags file '
+                             'is not written if empty.')
+
+    parser.add_argument('--memory-limit', default='',
+                        help='Memory of the server in bytes. The server '
+                             'flags file is not written if empty.')
+
+    parser.add_argument('--gpu-memory', default='',
+                        help='Memory of the server GPU in bytes.')
+
     # Monitoring Config Args
     parser.add_argument('--monitoring-enabled', type=bool, default=True,
                         help='Whether to enable prometheus monitoring.')
@@ -121,24 +223,194 @@ def get_arg_parser():
     return parser
 
 
-def write_model_config_file(args):
+def get_version_labels(args):
+    labels = {}
+    if args.version_labels_file and os.path.exists(args.version_labels_file):
+        labels = writers.load_version_labels(args.version_labels_file)
+
+    for model, model_labels in writers.parse_version_labels(
+            args.version_label).items():
+        labels.setdefault(model, {}).update(model_labels)
+    return labels
+
+
+def get_model_versions(args):
+    if args.model_versions_file and os.path.exists(args.model_versions_file):
+        return writers.load_model_versions(args.model_versions_file)
+    return {}
+
+
+def get_rollout_targets(args):
+    targets = {}
+    for target in args.rollout:
+        try:
+            model, version = str(target).rsplit(':', 1)
+            targets[model] = int(version)
+        except ValueError:
+            raise ValueError('Invalid rollout "{}". Expected '
+                             '"model:version".'.format(target))
+    return targets
+
+
+def optimize_models(args, writer):
+    # tensorflow is slow to import and only required to optimize models
+    from writers.optimizers import ModelOptimizer
+
+    # Publish optimized versions and label them to be served
+    published = False
+    for model in writer._get_models_from_bucket():
+        # tensorflow has no s3:// filesystem without tensorflow-io
+        if writer.get_model_url(model).startswith('s3://'):
+            logging.getLogger('optimize_models').warning(
+                'Not optimizing model `%s`: only models in GCS buckets '
+                'can be optimized.', model)
+            continue
+
+        # a model that fails to optimize is served as is
+        try:
+            optimizer = ModelOptimizer(
+                base_path=writer.get_model_url(model),
+                method=args.optimize,
+                sample_path=args.optimization_samples,
+                max_accuracy_delta=args.max_accuracy_delta)
+
+            optimizer.optimize()
+
+            version = optimizer.get_optimized_version()
+        except Exception as err:  # pylint: disable=broad-except
+            logging.getLogger('optimize_models').error(
+                'Failed to optimize model `%s`: %s', model, err)
+            continue
+
+        if version is not None:
+            writer.label_version(model, args.optimized_label, version)
+            published = True
+
+    # List the published versions again to size the models
+    if published:
+        writer.clear_catalog()
+
+
+def get_sources(args):
+    """Get the (namespace, bucket, prefix) of each model source."""
+    sources = []
+    if args.storage_bucket:
+        sources.append((None, args.storage_bucket, args.model_prefix))
+
+    for source in ','.join(args.source).split(','):
+        source = source.strip()
+        if not source:
+            continue
+
+        namespace = None
+        if '=' in source:
+            namespace, source = source.split('=', 1)
+
+        protocol, path = source.split('://', 1) if '://' in source \
+            else ('', source)
+        bucket, _, prefix = path.partition('/')
+        sources.append((namespace, '{}://{}'.format(protocol, bucket),
+                        prefix or '/'))
+
+    if not sources:
+        raise ValueError('--storage-bucket or --source is required.')
+    return sources
+
+
+def get_model_config_writer(args, bucket, model_prefix, **kwargs):
     # Create the ConfigWriter based on the cloud provider
-    writer_cls = writers.get_model_config_writer(args.storage_bucket)
+    writer_cls = writers.get_model_config_writer(bucket)
 
     writerkwargs = {
-        'bucket': str(args.storage_bucket).split('://')[-1],
-        'model_prefix': args.model_prefix,
+        'bucket': str(bucket).split('://')[-1],
+        'model_prefix': model_prefix,
     }
 
     # additional AWS required credentials
-    if isinstance(writer_cls, writers.S3ConfigWriter):
+    if issubclass(writer_cls, writers.S3ConfigWriter):
         writerkwargs['aws_access_key_id'] = config('AWS_ACCESS_KEY_ID')
         writerkwargs['aws_secret_access_key'] = config('AWS_SECRET_ACCESS_KEY')
+        writerkwargs['endpoint_url'] = args.s3_endpoint_url
+
+    if args.model_listing == 'manifest':
+        writerkwargs['use_manifest'] = True
+        writerkwargs['max_manifest_age'] = args.max_manifest_age
+        writerkwargs['manifest_cache_dir'] = args.manifest_cache_dir or None
+
+    writerkwargs.update(kwargs)
+    return writer_cls(**writerkwargs)
 
-    writer = writer_cls(**writerkwargs)
 
-    # Write the config file
-    writer.write(args.file_path)
+def publish_manifests(args):
+    for _, bucket, model_prefix in get_sources(args):
+        writer = get_model_config_writer(args, bucket, model_prefix)
+        writer.publish_manifest()
+
+
+def write_model_config_file(args):
+    sources = get_sources(args)
+    version_labels = get_version_labels(args)
+    model_versions = get_model_versions(args)
+
+    if len(sources) == 1 and not sources[0][0]:
+        _, bucket, model_prefix = sources[0]
+        writer = get_model_config_writer(args, bucket, model_prefix,
+                                         version_labels=version_labels,
+                                         model_versions=model_versions)
+    else:
+        writer = writers.MultiSourceConfigWriter(
+            sources=[get_model_config_writer(args, b, p)
+                     for _, b, p in sources],
+            namespaces=[n for n, _, _ in sources],
+            collision=args.collision,
+            version_labels=version_labels,
+            model_versions=model_versions)
+
+    if args.optimize != 'none':
+        optimize_models(args, writer)
+
+    targets = get_rollout_targets(args)
+    if not targets:
+        # Write the config file
+        writer.write(args.file_path)
+        return writer
+
+    # Stage the new versions against the running server
+    rollout = writers.CanaryRollout(
+        writer=writer,
+        status_client=writers.ModelStatusClient(
+            host=args.rest_api_host, port=args.rest_api_port),
+        canary_seconds=args.canary_seconds,
+        timeout=args.rollout_timeout)
+
+    labels = rollout.run(args.file_path, targets)
+
+    # Persist the promoted labels and pinned versions for the next write,
+    # so the old versions are not served again after a restart
+    if args.version_labels_file:
+        writer.version_labels.update(labels)
+        writers.save_version_labels(writer.version_labels,
+                                    args.version_labels_file)
+    if args.model_versions_file:
+        writers.save_model_versions(writer.model_versions,
+                                    args.model_versions_file)
+    return writer
+
+
+def write_model_sizes_file(args, sizes):
+    with open(args.model_sizes_file_path, 'w') as f:
+        json.dump(sizes, f, indent=2, sort_keys=True)
+
+
+def write_server_flags_file(args, sizes):
+    writer = writers.ServerFlagsWriter(
+        num_models=len(sizes),
+        model_bytes=sum(sizes.values()),
+        cpu_limit=args.cpu_limit,
+        memory_limit=args.memory_limit,
+        gpu_memory=args.gpu_memory)
+
+    writer.write(args.server_flags_file_path)
 
 
 def write_monitoring_config_file(args):
@@ -164,7 +436,23 @@ if __name__ == '__main__':
     # Get command line arguments
     ARGS = get_arg_parser().parse_args()
 
-    write_model_config_file(ARGS)
+    if ARGS.command == 'publish':
+        publish_manifests(ARGS)
+        sys.exit(0)
+
+    MODEL_WRITER = write_model_config_file(ARGS)
+
+    MODEL_SIZES = MODEL_WRITER.get_model_sizes()
+
+    if ARGS.model_sizes_file_path:
+        write_model_sizes_file(ARGS, MODEL_SIZES)
+
+    if ARGS.cpu_limit and ARGS.memory_limit:
+        write_server_flags_file(ARGS, MODEL_SIZES)
+    else:
+        logging.getLogger('write_config_file').warning(
+            'Not writing server flags file without `--cpu-limit` and '
+            '`--memory-limit` of the server.')
 
     write_monitoring_config_file(ARGS)
 
@@ -30,10 +30,23 @@ from __future__ import print_function
 
 from writers.writers import S3ConfigWriter
 from writers.writers import GCSConfigWriter
+from writers.writers import MultiSourceConfigWriter
 from writers.writers import MonitoringConfigWriter
 from writers.writers import BatchConfigWriter
+from writers.writers import ServerFlagsWriter
 from writers.writers import get_model_config_writer
 
+from writers.readers import read_model_config
+
+from writers.rollout import CanaryRollout
+from writers.rollout import load_model_versions
+from writers.rollout import load_version_labels
+from writers.rollout import parse_version_labels
+from writers.rollout import save_model_versions
+from writers.rollout import save_version_labels
+
+from writers.status import ModelStatusClient
+
 del absolute_import
 del division
 del print_function
@@ -0,0 +1,395 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Publish optimized versions of the SavedModels in a cloud bucket"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import logging
+import os
+
+try:
+    import numpy as np
+    import tensorflow as tf
+    from tensorflow.core.protobuf import config_pb2
+    from tensorflow.core.protobuf import rewriter_config_pb2
+    from tensorflow.python.framework import convert_to_constants
+    from tensorflow.python.grappler import tf_optimizer
+except ImportError:  # tensorflow is only required to optimize models
+    tf = None
+
+
+class ModelOptimizer(object):  # pylint: disable=useless-object-inheritance
+    """Optimizes the versions of a SavedModel into new sibling versions.
+
+    Each signature of the source version is frozen and rewritten by grappler
+    (constant folding, arithmetic and dependency optimization). Large weights
+    may then be stored with reduced precision:
+
+    - "constant_folding": only freeze and rewrite the graph.
+    - "float16": store weights as float16, cast to float32 in the graph.
+    - "int8": store weights as symmetric per-tensor int8 with a float32
+      scale, dequantized in the graph (dynamic range weight quantization).
+
+    The result is built in ``optimizations/staging/<version>``, which the
+    server ignores, and is moved to version ``max(versions) + 1`` only if
+    its accuracy delta on a sample set is small enough. A record of its
+    source version and accuracy delta is saved to
+    ``optimizations/<version>.json`` in the base path. The lossy "float16"
+    and "int8" methods require samples.
+    As the latest version, the optimized version is served to every request
+    that gives no version, whatever the version policy: TensorFlow Serving
+    always serves the highest loaded version by default.
+    Reduced precision weights are restored to float32 when the model is
+    loaded, so the gain is in the size of the model and the time to load it.
+
+    Args:
+        base_path: str, path of the model directory containing the numeric
+            versions, local or on GCS (gs://). TensorFlow cannot read s3://
+            paths without tensorflow-io.
+        method: str, one of "constant_folding", "float16" or "int8".
+        sample_path: str, an .npz file of inputs keyed by input name used to
+            measure the accuracy delta. Required by "float16" and "int8".
+        max_accuracy_delta: float, maximum mean absolute difference of the
+            outputs for the optimized version to be accepted.
+        min_weight_elements: int, smaller weights keep full precision.
+    """
+
+    methods = ('constant_folding', 'float16', 'int8')
+
+    lossy_methods = ('float16', 'int8')
+
+    record_dir = 'optimizations'
+
+    def __init__(self,
+                 base_path,
+                 method='float16',
+                 sample_path=None,
+                 max_accuracy_delta=1e-2,
+                 min_weight_elements=1024):
+        if tf is None:
+            raise ImportError('tensorflow is required to optimize models.')
+
+        if method not in self.methods:
+            raise ValueError('`method` must be one of {}. Got "{}".'.format(
+                self.methods, method))
+
+        if method in self.lossy_methods and not sample_path:
+            raise ValueError('`sample_path` is required to validate the '
+                             'accuracy of "{}" versions.'.format(method))
+
+        self.base_path = str(base_path).rstrip('/')
+        self.method = method
+        self.sample_path = sample_path
+        self.max_accuracy_delta = float(max_accuracy_delta)
+        self.min_weight_elements = int(min_weight_elements)
+        self.logger = logging.getLogger(str(self.__class__.__name__))
+
+    def get_versions(self):
+        """Get the numeric versions in the base path, in ascending order."""
+        versions = []
+        for d in tf.io.gfile.listdir(self.base_path):
+            d = d.rstrip('/')
+            if d.isdigit():
+                versions.append(int(d))
+        return sorted(versions)
+
+    def get_records(self):
+        """Get the optimization records keyed by the optimized version."""
+        path = os.path.join(self.base_path, self.record_dir)
+        if not tf.io.gfile.isdir(path):
+            return {}
+
+        records = {}
+        for name in tf.io.gfile.listdir(path):
+            if name.endswith('.json'):
+                with tf.io.gfile.GFile(os.path.join(path, name)) as f:
+                    records[int(name[:-len('.json')])] = json.load(f)
+        return records
+
+    def get_optimized_version(self):
+        """Get the latest accepted version optimized with this method."""
+        versions = [v for v, r in self.get_records().items()
+                    if r['accepted'] and r['method'] == self.method]
+        return max(versions) if versions else None
+
+    def _freeze(self, function):
+        """Freeze and rewrite a signature with grappler.
+
+        Returns:
+            tuple: the GraphDef and dicts of input and output tensor names.
+        """
+        frozen = convert_to_constants.convert_variables_to_constants_v2(
+            function)
+
+        # the placeholders are named after the signature inputs
+        placeholders = {t.op.name: t.name for t in frozen.inputs}
+        inputs = {k: placeholders[k]
+                  for k in function.structured_input_signature[1]}
+        outputs = {k: t.name for k, t in zip(
+            sorted(function.structured_outputs), frozen.outputs)}
+
+        graph = frozen.graph
+        meta_graph = tf.compat.v1.train.export_meta_graph(
+            graph_def=graph.as_graph_def(), graph=graph)
+        fetches = meta_graph.collection_def['train_op'].node_list.value
+        for name in outputs.values():
+            fetches.append(name.split(':')[0])
+
+        config = config_pb2.ConfigProto()
+        rewriter = config.graph_options.rewrite_options
+        rewriter.optimizers.extend(['constfold', 'arithmetic', 'dependency'])
+        rewriter.meta_optimizer_iterations = (
+            rewriter_config_pb2.RewriterConfig.ONE)
+        graph_def = tf_optimizer.OptimizeGraph(config, meta_graph)
+        return graph_def, inputs, outputs
+
+    def _quantize(self, graph_def):
+        """Store large float32 weights in reduced precision."""
+        if self.method == 'constant_folding':
+            return graph_def
+
+        nodes = []
+        for node in graph_def.node:
+            if node.op != 'Const' or \
+                    node.attr['dtype'].type != tf.float32.as_datatype_enum:
+                nodes.append(node)
+                continue
+
+            value = tf.make_ndarray(node.attr['value'].tensor)
+            if value.size < self.min_weight_elements:
+                nodes.append(node)
+                continue
+
+            stored = tf.compat.v1.NodeDef()
+            stored.CopyFrom(node)
+            stored.name = '{}/{}'.format(node.name, self.method)
+            if self.method == 'float16':
+                value = value.astype('float16')
+            else:
+                scale = max(float(np.abs(value).max()), 1e-12) / 127
+                value = np.round(value / scale).astype('int8')
+            stored.attr['dtype'].type = tf.as_dtype(
+                value.dtype).as_datatype_enum
+            stored.attr['value'].tensor.CopyFrom(tf.make_tensor_proto(value))
+            nodes.append(stored)
+
+            # the original name now restores the float32 weights
+            cast = tf.compat.v1.NodeDef(
+                name=node.name, op='Cast', input=[stored.name])
+            cast.attr['SrcT'].type = stored.attr['dtype'].type
+            cast.attr['DstT'].type = tf.float32.as_datatype_enum
+            cast.device = node.device
+            if self.method == 'float16':
+                nodes.append(cast)
+                continue
+
+            cast.name = '{}/dequantize'.format(node.name)
+            scale_node = tf.compat.v1.NodeDef(name='{}/scale'.format(
+                node.name), op='Const')
+            scale_node.attr['dtype'].type = tf.float32.as_datatype_enum
+            scale_node.attr['value'].tensor.CopyFrom(
+                tf.make_tensor_proto(scale, dtype=tf.float32))
+            mul = tf.compat.v1.NodeDef(
+                name=node.name, op='Mul', input=[cast.name, scale_node.name])
+            mul.attr['T'].type = tf.float32.as_datatype_enum
+            mul.device = node.device
+            nodes.extend([cast, scale_node, mul])
+
+        del graph_def.node[:]
+        graph_def.node.extend(nodes)
+        return graph_def
+
+    def _save(self, path, signatures):
+        """Save the optimized signatures as a SavedModel."""
+        graph = tf.Graph()
+        builder = tf.compat.v1.saved_model.Builder(path)
+        signature_defs = {}
+        with graph.as_default():
+            for key, (graph_def, inputs, outputs) in signatures.items():
+                scope = 'signature_{}'.format(len(signature_defs))
+                tf.import_graph_def(graph_def, name=scope)
+
+                def tensor_info(name, scope=scope):
+                    tensor = graph.get_tensor_by_name(
+                        '{}/{}'.format(scope, name))
+                    return tf.compat.v1.saved_model.build_tensor_info(tensor)
+
+                signature_defs[key] = \
+                    tf.compat.v1.saved_model.build_signature_def(
+                        inputs={k: tensor_info(v) for k, v in inputs.items()},
+                        outputs={k: tensor_info(v)
+                                 for k, v in outputs.items()},
+                        method_name='tensorflow/serving/predict')
+
+            with tf.compat.v1.Session(graph=graph) as sess:
+                builder.add_meta_graph_and_variables(
+                    sess, [tf.saved_model.SERVING],
+                    signature_def_map=signature_defs)
+        builder.save()
+
+    def _get_accuracy_delta(self, source, optimized):
+        """Compare the outputs of each signature on the sample set.
+
+        Returns:
+            dict: the mean and max absolute difference of all outputs.
+        """
+        if not self.sample_path:
+            return None
+
+        with tf.io.gfile.GFile(self.sample_path, 'rb') as f:
+            samples = dict(np.load(f))
+
+        mean_delta, max_delta = 0, 0
+        for key, function in source.signatures.items():
+            names = function.structured_input_signature[1]
+            inputs = {k: tf.constant(samples[k]) for k in names}
+            expected = function(**inputs)
+            actual = optimized.signatures[key](**inputs)
+            for name in expected:
+                delta = np.abs(expected[name].numpy().astype('float64') -
+                               actual[name].numpy().astype('float64'))
+                mean_delta = max(mean_delta, float(delta.mean()))
+                max_delta = max(max_delta, float(delta.max()))
+        return {'mean_absolute': mean_delta, 'max_absolute': max_delta}
+
+    def _publish(self, staging_path, path):
+        """Move a validated version from staging to its version directory.
+
+        Stores that cannot rename directories get a copy with the
+        saved_model.pb written last, so a partial version is not loadable.
+        """
+        try:
+            tf.io.gfile.rename(staging_path, path)
+            return
+        except tf.errors.OpError:
+            pass
+
+        files = []
+        for dirname, _, filenames in tf.io.gfile.walk(staging_path):
+            relative = os.path.relpath(dirname, staging_path)
+            files.extend(os.path.normpath(os.path.join(relative, f))
+                         for f in filenames)
+        files.sort(key=lambda f: f == 'saved_model.pb')
+
+        for name in files:
+            dst = os.path.join(path, name)
+            tf.io.gfile.makedirs(os.path.dirname(dst))
+            tf.io.gfile.copy(os.path.join(staging_path, name), dst,
+                             overwrite=True)
+        tf.io.gfile.rmtree(staging_path)
+
+    def optimize_version(self, version, new_version):
+        """Write an optimized copy of `version` as `new_version`.
+
+        Returns:
+            dict: the optimization record of the new version.
+        """
+        source_path = os.path.join(self.base_path, str(version))
+        path = os.path.join(self.base_path, str(new_version))
+        staging_path = os.path.join(self.base_path, self.record_dir,
+                                    'staging', str(new_version))
+        self.logger.info('Optimizing %s into %s with %s.',
+                         source_path, path, self.method)
+
+        if tf.io.gfile.exists(staging_path):
+            tf.io.gfile.rmtree(staging_path)
+
+        source = tf.saved_model.load(source_path)
+        signatures = {}
+        for key, function in source.signatures.items():
+            graph_def, inputs, outputs = self._freeze(function)
+            signatures[key] = (self._quantize(graph_def), inputs, outputs)
+        self._save(staging_path, signatures)
+
+        delta = self._get_accuracy_delta(
+            source, tf.saved_model.load(staging_path))
+        accepted = delta is None or \
+            delta['mean_absolute'] <= self.max_accuracy_delta
+
+        if accepted:
+            self._publish(staging_path, path)
+        else:
+            tf.io.gfile.rmtree(staging_path)
+
+        record = {
+            'source_version': int(version),
+            'method': self.method,
+            'accuracy_delta': delta,
+            'accepted': accepted,
+        }
+        record_dir = os.path.join(self.base_path, self.record_dir)
+        tf.io.gfile.makedirs(record_dir)
+        record_path = os.path.join(record_dir, '{}.json'.format(new_version))
+        with tf.io.gfile.GFile(record_path, 'w') as f:
+            json.dump(record, f, indent=2, sort_keys=True)
+
+        self.logger.info('Optimized %s: %s', path, record)
+        return record
+
+    def optimize(self, all_versions=False):
+        """Optimize the source versions that have no optimized sibling.
+
+        Only the latest source version is optimized unless `all_versions`,
+        so that the optimized version does not shadow a newer source version
+        as the latest version of the model.
+
+        Args:
+            all_versions: bool, whether to optimize every source version.
+
+        Returns:
+            dict: the accepted optimized versions of each source version.
+        """
+        versions = self.get_versions()
+        records = self.get_records()
+
+        done = set(r['source_version'] for r in records.values()
+                   if r['method'] == self.method)
+        sources = [v for v in versions if v not in records]
+        if not all_versions:
+            sources = sources[-1:]
+
+        optimized = {}
+        next_version = max(versions + list(records)) + 1 if versions else 1
+        for version in sources:
+            if version in done:
+                continue
+            record = self.optimize_version(version, next_version)
+            if record['accepted']:
+                optimized[version] = next_version
+                if self.method in self.lossy_methods:
+                    self.logger.warning('Version %s of %s is now served to '
+                                        'requests without a version, with '
+                                        '%s weights.', next_version,
+                                        self.base_path, self.method)
+            else:
+                self.logger.warning('Removed version %s of %s, the '
+                                    'accuracy delta %s is too large.',
+                                    next_version, self.base_path,
+                                    record['accuracy_delta'])
+            next_version += 1
+        return optimized
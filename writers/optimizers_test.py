@@ -0,0 +1,153 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for the model optimizer"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import pytest
+
+from writers import optimizers
+
+np = pytest.importorskip('numpy')
+tf = pytest.importorskip('tensorflow')
+
+
+class DummyModel(tf.Module):
+
+    def __init__(self):
+        super(DummyModel, self).__init__()
+        rng = np.random.RandomState(0)
+        self.kernel = tf.Variable(rng.randn(64, 32).astype('float32'))
+        self.bias = tf.Variable(np.ones(32, 'float32'))
+
+    @tf.function(input_signature=[
+        tf.TensorSpec([None, 64], tf.float32, name='image')])
+    def serve(self, image):
+        return {'output': tf.matmul(image, self.kernel) * 2. + self.bias}
+
+
+@pytest.fixture
+def model_path(tmpdir):
+    path = os.path.join(str(tmpdir), 'model')
+    model = DummyModel()
+    tf.saved_model.save(model, os.path.join(path, '1'),
+                        signatures={'serving_default': model.serve})
+    return path
+
+
+@pytest.fixture
+def sample_path(tmpdir):
+    path = os.path.join(str(tmpdir), 'samples.npz')
+    np.savez(path, image=np.random.random((4, 64)).astype('float32'))
+    return path
+
+
+class TestModelOptimizer(object):
+
+    def test_bad_inputs(self, model_path):
+        with pytest.raises(ValueError):
+            optimizers.ModelOptimizer(model_path, method='float8')
+
+    @pytest.mark.parametrize('method', ['constant_folding', 'float16', 'int8'])
+    def test_optimize(self, model_path, sample_path, method):
+        optimizer = optimizers.ModelOptimizer(
+            model_path, method=method, sample_path=sample_path,
+            max_accuracy_delta=1, min_weight_elements=64)
+
+        assert optimizer.get_optimized_version() is None
+        assert optimizer.optimize() == {1: 2}
+        assert optimizer.get_versions() == [1, 2]
+        assert optimizer.get_optimized_version() == 2
+
+        record = optimizer.get_records()[2]
+        assert record['source_version'] == 1
+        assert record['method'] == method
+        assert record['accepted']
+        assert record['accuracy_delta']['mean_absolute'] < 1
+
+        # the optimized version serves the same signature
+        source = tf.saved_model.load(os.path.join(model_path, '1'))
+        optimized = tf.saved_model.load(os.path.join(model_path, '2'))
+        image = tf.ones((1, 64))
+        expected = source.signatures['serving_default'](image=image)
+        actual = optimized.signatures['serving_default'](image=image)
+        np.testing.assert_allclose(expected['output'].numpy(),
+                                   actual['output'].numpy(),
+                                   atol=1, rtol=0.1)
+
+        # the weights are smaller on disk
+        def size(version):
+            path = os.path.join(model_path, str(version))
+            return sum(os.path.getsize(os.path.join(d, f))
+                       for d, _, files in os.walk(path) for f in files)
+
+        if method != 'constant_folding':
+            assert size(2) < size(1)
+
+        # sources with an optimized version are skipped
+        assert optimizer.optimize() == {}
+        assert optimizer.get_versions() == [1, 2]
+
+    def test_optimize_rejected(self, model_path, sample_path):
+        optimizer = optimizers.ModelOptimizer(
+            model_path, method='int8', sample_path=sample_path,
+            max_accuracy_delta=0, min_weight_elements=64)
+
+        assert optimizer.optimize() == {}
+        # the rejected version is never served, and not optimized again
+        assert optimizer.get_versions() == [1]
+        assert not optimizer.get_records()[2]['accepted']
+        assert optimizer.get_optimized_version() is None
+        assert optimizer.optimize() == {}
+
+    def test_lossy_methods_require_samples(self, model_path):
+        for method in ('float16', 'int8'):
+            with pytest.raises(ValueError):
+                optimizers.ModelOptimizer(model_path, method=method)
+
+        # lossless methods are accepted without samples
+        optimizer = optimizers.ModelOptimizer(model_path,
+                                              method='constant_folding')
+        assert optimizer.optimize() == {1: 2}
+
+    def test_publish_copy(self, model_path, sample_path, mocker):
+        optimizer = optimizers.ModelOptimizer(
+            model_path, method='float16', sample_path=sample_path,
+            max_accuracy_delta=1, min_weight_elements=64)
+
+        # stores without directory renames get a copy
+        def rename(*_):
+            raise tf.errors.UnimplementedError(None, None, 'no rename')
+
+        mocker.patch.object(tf.io.gfile, 'rename', rename)
+        assert optimizer.optimize() == {1: 2}
+        assert tf.saved_model.load(os.path.join(model_path, '2'))
+
+        staging = os.path.join(model_path, optimizer.record_dir, 'staging')
+        assert not os.listdir(staging)
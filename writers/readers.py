@@ -0,0 +1,89 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Read TensorFlow Serving config files"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import re
+
+
+_CONFIG_PATTERN = re.compile(r'config\s*:?\s*{')
+_FIELD_PATTERN = re.compile(r'(\w+)\s*:?\s*("[^"]*"|[\w.-]+)')
+
+
+def _get_blocks(text):
+    """Yield the contents of each top level "config { ... }" block."""
+    for match in _CONFIG_PATTERN.finditer(text):
+        depth, start = 1, match.end()
+        for i in range(start, len(text)):
+            if text[i] == '{':
+                depth += 1
+            elif text[i] == '}':
+                depth -= 1
+                if not depth:
+                    yield text[start:i]
+                    break
+
+
+def read_model_config(path):
+    """Read the models of a model config file written by ModelConfigWriter.
+
+    Args:
+        path: str, the filepath of the model config file.
+
+    Returns:
+        list: a dict for each model with its "name", "base_path",
+            "model_platform", the list of "versions" of a specific version
+            policy (None if all versions are served) and the
+            "version_labels" dict.
+    """
+    with open(path) as f:
+        text = f.read()
+
+    models = []
+    for block in _get_blocks(text):
+        model = {
+            'name': None,
+            'base_path': None,
+            'model_platform': None,
+            'versions': None,
+            'version_labels': {},
+        }
+        label = None
+        for key, value in _FIELD_PATTERN.findall(block):
+            value = value.strip('"')
+            if key in ('name', 'base_path', 'model_platform'):
+                model[key] = value
+            elif key == 'versions':
+                model['versions'] = (model['versions'] or []) + [int(value)]
+            elif key == 'key':
+                label = value
+            elif key == 'value' and label is not None:
+                model['version_labels'][label] = int(value)
+                label = None
+        models.append(model)
+    return models
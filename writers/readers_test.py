@@ -0,0 +1,75 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for the model config reader"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import writers
+
+
+def test_read_model_config(tmpdir, mocker):
+    writer = writers.writers.ModelConfigWriter(
+        'test-bucket', 'models', protocol='test',
+        version_labels={'a': {'stable': 1, 'canary': 2}},
+        model_versions={'a': [1, 2]})
+    mocker.patch.object(writer, '_get_models_from_bucket',
+                        lambda: ['a', 'b'])
+
+    path = os.path.join(str(tmpdir), 'models.conf')
+    writer.write(path)
+
+    models = writers.read_model_config(path)
+    assert models == [
+        {
+            'name': 'a',
+            'base_path': writer.get_model_url('a'),
+            'model_platform': 'tensorflow',
+            'versions': [1, 2],
+            'version_labels': {'stable': 1, 'canary': 2},
+        },
+        {
+            'name': 'b',
+            'base_path': writer.get_model_url('b'),
+            'model_platform': 'tensorflow',
+            'versions': None,
+            'version_labels': {},
+        },
+    ]
+
+    # compact text format without colons
+    with open(path, 'w') as f:
+        f.write('model_config_list { config { name: "c" '
+                'base_path: "/models/c" model_platform: "tensorflow" '
+                'model_version_policy { specific { versions: 3 } } } }')
+
+    models = writers.read_model_config(path)
+    assert len(models) == 1
+    assert models[0]['name'] == 'c'
+    assert models[0]['base_path'] == '/models/c'
+    assert models[0]['versions'] == [3]
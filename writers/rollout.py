@@ -0,0 +1,302 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Version labels and staged canary rollouts of model versions"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import logging
+import os
+import time
+
+
+def load_version_labels(path):
+    """Read version labels from a JSON sidecar file.
+
+    The file maps each model name to its labels,
+    e.g. ``{"model": {"stable": 1, "canary": 2}}``.
+
+    Args:
+        path: str, the filepath of the version labels file.
+
+    Returns:
+        dict: mapping of model name to a dict of label to version.
+    """
+    with open(path) as f:
+        labels = json.load(f)
+
+    return {str(model): {str(k): int(v) for k, v in model_labels.items()}
+            for model, model_labels in labels.items()}
+
+
+def save_version_labels(labels, path):
+    """Write version labels to a JSON sidecar file.
+
+    Args:
+        labels: dict, mapping of model name to a dict of label to version.
+        path: str, the filepath of the version labels file.
+    """
+    with open(path, 'w+') as f:
+        json.dump(labels, f, indent=2, sort_keys=True)
+
+
+def load_model_versions(path):
+    """Read the pinned versions of each model from a JSON sidecar file.
+
+    The file maps each model name to the versions served with a
+    "specific" policy, e.g. ``{"model": [2]}``.
+
+    Args:
+        path: str, the filepath of the model versions file.
+
+    Returns:
+        dict: mapping of model name to a list of versions.
+    """
+    with open(path) as f:
+        versions = json.load(f)
+
+    return {str(model): sorted(int(v) for v in model_versions)
+            for model, model_versions in versions.items()}
+
+
+def save_model_versions(versions, path):
+    """Write the pinned versions of each model to a JSON sidecar file.
+
+    Args:
+        versions: dict, mapping of model name to a list of versions.
+        path: str, the filepath of the model versions file.
+    """
+    with open(path, 'w+') as f:
+        json.dump({m: sorted(int(v) for v in vs)
+                   for m, vs in versions.items()},
+                  f, indent=2, sort_keys=True)
+
+
+def parse_version_labels(mappings):
+    """Parse version labels from "model:label=version" strings.
+
+    Multiple labels for a model may be comma separated,
+    e.g. ``"model:stable=1,canary=2"``.
+
+    Args:
+        mappings: list, the "model:label=version" strings.
+
+    Returns:
+        dict: mapping of model name to a dict of label to version.
+    """
+    labels = {}
+    for mapping in mappings:
+        try:
+            model, pairs = str(mapping).split(':', 1)
+            for pair in pairs.split(','):
+                label, version = pair.split('=', 1)
+                labels.setdefault(model.strip(), {})[label.strip()] = \
+                    int(version)
+        except ValueError:
+            raise ValueError('Invalid version label "{}". Expected '
+                             '"model:label=version".'.format(mapping))
+    return labels
+
+
+class CanaryRollout(object):  # pylint: disable=useless-object-inheritance
+    """Roll out new model versions without interrupting clients.
+
+    Each rollout writes the model config file in stages, relying on
+    TensorFlow Serving to reload it (--model_config_file_poll_wait_seconds):
+
+    1. Load the new version alongside the current stable version, or the
+       versions currently served if the model has no stable version.
+    2. Once the new version is AVAILABLE, label it as the canary.
+    3. Move the stable label to the new version.
+    4. Drop the old version from the "specific" version policy.
+
+    If the new version does not become AVAILABLE within `timeout`,
+    the version policy and labels of each model are restored to what
+    they were before the rollout.
+
+    Args:
+        writer: ModelConfigWriter, writes the model config file.
+        status_client: ModelStatusClient, checks the model version states.
+        stable_label: str, the label used by clients to pin a version.
+        canary_label: str, the label given to the new version.
+        canary_seconds: float, time to serve the canary before promotion.
+        poll_interval: float, seconds between model status checks.
+        timeout: float, seconds to wait for each stage to take effect.
+    """
+
+    def __init__(self,
+                 writer,
+                 status_client,
+                 stable_label='stable',
+                 canary_label='canary',
+                 canary_seconds=0,
+                 poll_interval=5,
+                 timeout=600):
+        self.writer = writer
+        self.status_client = status_client
+        self.stable_label = str(stable_label)
+        self.canary_label = str(canary_label)
+        self.canary_seconds = float(canary_seconds)
+        self.poll_interval = float(poll_interval)
+        self.timeout = float(timeout)
+        self.logger = logging.getLogger(str(self.__class__.__name__))
+
+    def _write(self, path, versions, labels):
+        """Atomically write the config so the server never reads a partial
+        file while polling."""
+        for model in versions:
+            self.writer.model_versions[model] = versions[model]
+            self.writer.version_labels[model] = labels[model]
+
+        tmp_path = '{}.tmp'.format(path)
+        self.writer.write(tmp_path)
+        os.rename(tmp_path, path)
+
+    def _revert(self, path, previous):
+        """Restore the version policy and labels of each model."""
+        for model, (versions, labels) in previous.items():
+            for mapping, value in ((self.writer.model_versions, versions),
+                                   (self.writer.version_labels, labels)):
+                if value is None:
+                    mapping.pop(model, None)
+                else:
+                    mapping[model] = value
+
+        tmp_path = '{}.tmp'.format(path)
+        self.writer.write(tmp_path)
+        os.rename(tmp_path, path)
+
+    def _wait_for(self, predicate, description):
+        start = time.time()
+        while not predicate():
+            if time.time() - start > self.timeout:
+                raise TimeoutError('Timed out after {}s waiting for {}.'
+                                   .format(self.timeout, description))
+            time.sleep(self.poll_interval)
+        self.logger.info('%s after %.1fs.', description, time.time() - start)
+
+    def _get_old_versions(self, model, version):
+        """Get the versions to keep serving while `version` loads.
+
+        The stable version if the model has one, otherwise its pinned
+        versions, or its AVAILABLE versions if it serves all versions.
+        """
+        stable = self.writer.version_labels.get(model, {}).get(
+            self.stable_label)
+        if stable is not None:
+            old = [stable]
+        elif self.writer.model_versions.get(model):
+            old = self.writer.model_versions[model]
+        else:
+            statuses = self.status_client.get_model_status(model)
+            old = [s['version'] for s in statuses
+                   if s['state'] == 'AVAILABLE']
+        return sorted(set(int(v) for v in old) - {version})
+
+    def _all_available(self, targets):
+        return all(self.status_client.is_available(m, version=v)
+                   for m, v in targets.items())
+
+    def _all_promoted(self, targets):
+        for model, version in targets.items():
+            statuses = self.status_client.get_model_status(
+                model, label=self.stable_label)
+            if not any(s['version'] == version and s['state'] == 'AVAILABLE'
+                       for s in statuses):
+                return False
+        return True
+
+    def run(self, path, targets):
+        """Roll out the target versions and write the config to `path`.
+
+        Args:
+            path: str, the filepath of the model config file.
+            targets: dict, mapping of model name to the new version.
+
+        Returns:
+            dict: the final version labels of the rolled out models.
+        """
+        targets = {m: int(v) for m, v in targets.items()}
+
+        # the exact policy and labels to restore if the rollout fails
+        previous = {m: (self.writer.model_versions.get(m),
+                        self.writer.version_labels.get(m))
+                    for m in targets}
+
+        old_versions = {m: self._get_old_versions(m, v)
+                        for m, v in targets.items()}
+
+        stable_versions = {}
+        for model, version in targets.items():
+            labels = self.writer.version_labels.get(model, {})
+            stable = labels.get(self.stable_label)
+            if stable is not None and int(stable) != version:
+                stable_versions[model] = int(stable)
+
+        def stage(new_labels):
+            versions = {m: old_versions[m] + [targets[m]] for m in targets}
+            labels = {m: new_labels(m) for m in targets}
+            self._write(path, versions, labels)
+
+        def old_labels(m):
+            if m not in stable_versions:
+                return {}
+            return {self.stable_label: stable_versions[m]}
+
+        # 1. load the new versions alongside the old ones
+        self.logger.info('Loading new versions: %s', targets)
+        stage(old_labels)
+        try:
+            self._wait_for(lambda: self._all_available(targets),
+                           'New versions are AVAILABLE')
+        except TimeoutError:
+            self.logger.error('New versions did not load, reverting.')
+            self._revert(path, previous)
+            raise
+
+        def canary_labels(m):
+            labels = old_labels(m)
+            labels[self.canary_label] = targets[m]
+            return labels
+
+        # 2. label the new versions as the canary
+        stage(canary_labels)
+        if self.canary_seconds:
+            self.logger.info('Serving canary versions for %ss.',
+                             self.canary_seconds)
+            time.sleep(self.canary_seconds)
+
+        # 3. move the stable label to the new versions
+        stage(lambda m: {self.stable_label: targets[m]})
+        self._wait_for(lambda: self._all_promoted(targets),
+                       'Stable label moved to new versions')
+
+        # 4. drop the old versions to reclaim memory
+        final_labels = {m: {self.stable_label: targets[m]} for m in targets}
+        self._write(path, {m: [targets[m]] for m in targets}, final_labels)
+        self.logger.info('Rolled out new versions: %s', targets)
+        return final_labels
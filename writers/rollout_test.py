@@ -0,0 +1,224 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for version labels and canary rollouts"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+import pytest
+
+import writers
+
+
+class DummyStatusClient(object):
+
+    def __init__(self, load=True):
+        self.load = load
+        self.statuses = {}
+        self.config = None
+        self.path = None
+
+    def _read(self):
+        with open(self.path) as f:
+            return f.read().replace(' ', '')
+
+    def is_available(self, model, version=None, label=None):
+        return self.load and 'versions:{}'.format(version) in self._read()
+
+    def get_model_status(self, model, version=None, label=None):
+        if version is None and label is None:
+            return self.statuses.get(model, [])
+        content = self._read().split('\n')
+        for i, line in enumerate(content):
+            if line == 'key:"{}"'.format(label):
+                version = int(content[i + 1].split(':')[1])
+                return [{'version': version, 'state': 'AVAILABLE'}]
+        return []
+
+
+def test_parse_version_labels():
+    labels = writers.parse_version_labels([
+        'a:stable=1,canary=2',
+        'b:stable=3',
+    ])
+    assert labels == {'a': {'stable': 1, 'canary': 2}, 'b': {'stable': 3}}
+
+    for bad in ('a', 'a:stable', 'a:stable=one'):
+        with pytest.raises(ValueError):
+            writers.parse_version_labels([bad])
+
+
+def test_load_save_version_labels(tmpdir):
+    path = os.path.join(str(tmpdir), 'labels.json')
+    with open(path, 'w') as f:
+        json.dump({'a': {'stable': '1'}}, f)
+
+    labels = writers.load_version_labels(path)
+    assert labels == {'a': {'stable': 1}}
+
+    labels['b'] = {'canary': 2}
+    writers.save_version_labels(labels, path)
+    assert writers.load_version_labels(path) == labels
+
+
+def test_load_save_model_versions(tmpdir):
+    path = os.path.join(str(tmpdir), 'versions.json')
+    with open(path, 'w') as f:
+        json.dump({'a': ['2', 1]}, f)
+
+    versions = writers.load_model_versions(path)
+    assert versions == {'a': [1, 2]}
+
+    versions['b'] = [3]
+    writers.save_model_versions(versions, path)
+    assert writers.load_model_versions(path) == versions
+
+
+class TestCanaryRollout(object):
+
+    def _get_rollout(self, mocker, load=True, version_labels=None):
+        if version_labels is None:
+            version_labels = {'a': {'stable': 1}}
+        writer = writers.writers.ModelConfigWriter(
+            'test-bucket', 'models', protocol='test',
+            version_labels=version_labels)
+        mocker.patch.object(writer, '_get_models_from_bucket',
+                            lambda: ['a', 'b'])
+
+        client = DummyStatusClient(load=load)
+        rollout = writers.CanaryRollout(writer, client,
+                                        poll_interval=0, timeout=0.1)
+        return rollout, client
+
+    def test_run(self, tmpdir, mocker):
+        rollout, client = self._get_rollout(mocker)
+        path = os.path.join(str(tmpdir), 'models.conf')
+        client.path = path
+
+        written = []
+        write = rollout.writer.write
+
+        def spy(p):
+            write(p)
+            with open(p) as f:
+                written.append(f.read().replace(' ', ''))
+
+        mocker.patch.object(rollout.writer, 'write', spy)
+
+        labels = rollout.run(path, {'a': 2})
+        assert labels == {'a': {'stable': 2}}
+        assert len(written) == 4
+
+        # 1. both versions are loaded, stable is unchanged
+        assert 'versions:1\nversions:2' in written[0]
+        assert 'key:"stable"\nvalue:1' in written[0]
+        assert 'canary' not in written[0]
+
+        # 2. the new version is labeled as the canary
+        assert 'key:"canary"\nvalue:2' in written[1]
+        assert 'key:"stable"\nvalue:1' in written[1]
+
+        # 3. the stable label is moved
+        assert 'versions:1\nversions:2' in written[2]
+        assert 'key:"stable"\nvalue:2' in written[2]
+
+        # 4. the old version is dropped
+        assert 'versions:1' not in written[3]
+        assert 'key:"stable"\nvalue:2' in written[3]
+        with open(path) as f:
+            assert f.read().replace(' ', '') == written[3]
+
+        # models without a rollout serve all versions
+        assert 'name:"b"' in written[3]
+        assert 'all:{}' in written[3]
+
+    def test_run_timeout(self, tmpdir, mocker):
+        rollout, client = self._get_rollout(mocker, load=False)
+        path = os.path.join(str(tmpdir), 'models.conf')
+        client.path = path
+
+        with pytest.raises(TimeoutError):
+            rollout.run(path, {'a': 2})
+
+        # the policy and labels before the rollout are restored
+        models = writers.read_model_config(path)
+        assert models[0]['name'] == 'a'
+        assert models[0]['versions'] is None
+        assert models[0]['version_labels'] == {'stable': 1}
+
+    def test_run_without_stable(self, tmpdir, mocker):
+        rollout, client = self._get_rollout(mocker, version_labels={})
+        path = os.path.join(str(tmpdir), 'models.conf')
+        client.path = path
+        client.statuses['a'] = [{'version': 1, 'state': 'AVAILABLE'},
+                                {'version': 3, 'state': 'AVAILABLE'},
+                                {'version': 4, 'state': 'END'}]
+
+        written = []
+        write = rollout.writer.write
+
+        def spy(p):
+            write(p)
+            written.append(writers.read_model_config(p)[0])
+
+        mocker.patch.object(rollout.writer, 'write', spy)
+
+        labels = rollout.run(path, {'a': 2})
+        assert labels == {'a': {'stable': 2}}
+
+        # 1. the new version loads alongside the served versions
+        assert written[0]['versions'] == [1, 2, 3]
+        assert written[0]['version_labels'] == {}
+
+        # 4. only the new version is served
+        assert written[-1]['versions'] == [2]
+
+        # the pinned versions are kept while a pinned model rolls out
+        rollout.writer.version_labels = {}
+        rollout.writer.model_versions = {'a': [2]}
+        del written[:]
+        rollout.run(path, {'a': 5})
+        assert written[0]['versions'] == [2, 5]
+
+    def test_run_timeout_without_stable(self, tmpdir, mocker):
+        rollout, client = self._get_rollout(mocker, load=False,
+                                            version_labels={})
+        path = os.path.join(str(tmpdir), 'models.conf')
+        client.path = path
+
+        with pytest.raises(TimeoutError):
+            rollout.run(path, {'a': 2})
+
+        # the model serves all versions without labels as before
+        assert 'a' not in rollout.writer.model_versions
+        assert 'a' not in rollout.writer.version_labels
+        models = writers.read_model_config(path)
+        assert models[0]['name'] == 'a'
+        assert models[0]['versions'] is None
+        assert models[0]['version_labels'] == {}
@@ -0,0 +1,129 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Client for the TensorFlow Serving model status API"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import http.client as httplib
+import json
+import logging
+import threading
+
+
+class ModelStatusClient(object):  # pylint: disable=useless-object-inheritance
+    """Query the REST status endpoint of TensorFlow Serving.
+
+    A single keep-alive connection is reused between requests and is
+    re-opened if the server closes it.
+
+    Args:
+        host: str, hostname of the TensorFlow Serving REST API
+        port: int, port of the TensorFlow Serving REST API
+        timeout: float, timeout in seconds for each request
+    """
+
+    def __init__(self, host='localhost', port=8501, timeout=10):
+        self.host = str(host)
+        self.port = int(port)
+        self.timeout = float(timeout)
+        self._connection = None
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(str(self.__class__.__name__))
+
+    def _get_connection(self):
+        if self._connection is None:
+            self._connection = httplib.HTTPConnection(
+                self.host, self.port, timeout=self.timeout)
+        return self._connection
+
+    def close(self):
+        """Close the underlying connection."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _get(self, path):
+        """Send a GET request, retrying once on a stale connection.
+
+        Returns:
+            tuple: the HTTP status code and the decoded JSON body.
+        """
+        with self._lock:
+            for attempt in range(2):
+                connection = self._get_connection()
+                try:
+                    connection.request('GET', path)
+                    response = connection.getresponse()
+                    body = response.read()
+                    break
+                except (httplib.HTTPException, OSError):
+                    connection.close()
+                    self._connection = None
+                    if attempt:
+                        raise
+        try:
+            return response.status, json.loads(body.decode('utf-8'))
+        except ValueError:
+            return response.status, {}
+
+    def get_model_status(self, model, version=None, label=None):
+        """Get the status of all loaded versions of a model.
+
+        Args:
+            model: str, name of the model.
+            version: int, only get the status of this version.
+            label: str, only get the status of the version with this label.
+
+        Returns:
+            list: dicts with the integer "version" and string "state"
+                of each version. Empty if the model is not found.
+        """
+        path = '/v1/models/{}'.format(model)
+        if version is not None:
+            path = '{}/versions/{}'.format(path, int(version))
+        elif label is not None:
+            path = '{}/labels/{}'.format(path, label)
+
+        status, body = self._get(path)
+        if status == 404:
+            return []
+        if status != 200:
+            raise RuntimeError('Failed to get status of model "{}": {} {}'
+                               .format(model, status, body.get('error')))
+
+        return [{'version': int(s['version']), 'state': str(s['state'])}
+                for s in body.get('model_version_status', [])]
+
+    def is_available(self, model, version=None, label=None):
+        """Whether the model version is AVAILABLE.
+
+        If neither `version` nor `label` is given, any available
+        version of the model counts.
+        """
+        statuses = self.get_model_status(model, version=version, label=label)
+        return any(s['state'] == 'AVAILABLE' for s in statuses)
@@ -0,0 +1,124 @@
+# Copyright 2016-2022 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-tf-serving/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for the model status client"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+
+import pytest
+
+import writers
+
+
+class DummyStatusHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    statuses = {
+        '/v1/models/a': [
+            {'version': '1', 'state': 'AVAILABLE'},
+            {'version': '2', 'state': 'LOADING'},
+        ],
+        '/v1/models/a/versions/1': [{'version': '1', 'state': 'AVAILABLE'}],
+        '/v1/models/a/versions/2': [{'version': '2', 'state': 'LOADING'}],
+        '/v1/models/a/labels/stable': [
+            {'version': '1', 'state': 'AVAILABLE'}],
+    }
+
+    def log_message(self, *_):
+        pass
+
+    def do_GET(self):
+        if self.path == '/v1/models/error':
+            code, body = 500, {'error': 'internal'}
+        elif self.path in self.statuses:
+            code = 200
+            body = {'model_version_status': self.statuses[self.path]}
+        else:
+            code, body = 404, {'error': 'not found'}
+
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def status_server():
+    server = HTTPServer(('localhost', 0), DummyStatusHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestModelStatusClient(object):
+
+    def test_get_model_status(self, status_server):
+        client = writers.ModelStatusClient(
+            'localhost', status_server.server_address[1])
+
+        statuses = client.get_model_status('a')
+        assert statuses == [{'version': 1, 'state': 'AVAILABLE'},
+                            {'version': 2, 'state': 'LOADING'}]
+
+        statuses = client.get_model_status('a', version=2)
+        assert statuses == [{'version': 2, 'state': 'LOADING'}]
+
+        statuses = client.get_model_status('a', label='stable')
+        assert statuses == [{'version': 1, 'state': 'AVAILABLE'}]
+
+        # unknown models have no status
+        assert client.get_model_status('b') == []
+
+        with pytest.raises(RuntimeError):
+            client.get_model_status('error')
+
+        client.close()
+
+    def test_is_available(self, status_server):
+        client = writers.ModelStatusClient(
+            'localhost', status_server.server_address[1])
+
+        assert client.is_available('a')
+        assert client.is_available('a', version=1)
+        assert not client.is_available('a', version=2)
+        assert client.is_available('a', label='stable')
+        assert not client.is_available('b')
+
+        # the connection is re-opened after being closed
+        client.close()
+        assert client.is_available('a', version=1)
@@ -28,10 +28,18 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import hashlib
+import json
 import logging
+import math
 import multiprocessing
+import os
+import time
+
+from concurrent import futures
 
 import boto3
+from botocore.exceptions import ClientError
 from google.cloud import storage
 
 
@@ -135,16 +143,143 @@ class BatchConfigWriter(ConfigWriter):
             config_file.write('}\n')
 
 
+class ServerFlagsWriter(ConfigWriter):
+    """Writes an environment file of tensorflow_model_server flags.
+
+    The flags are sized from the resources of the serving container and
+    the number and size of the served models. The limits of the serving
+    container are required, as the writer runs in a different container
+    (e.g. pass them with the Kubernetes Downward API).
+
+    Args:
+        num_models: int, number of models to serve
+        model_bytes: int, total size in bytes of all served models
+        cpu_limit: float, CPUs of the server
+        memory_limit: int, memory in bytes of the server
+        gpu_memory: int, memory in bytes of the GPU, if any
+        min_poll_wait_seconds: int, minimum seconds between polls of the
+            model base paths for new versions
+        gpu_memory_overhead: float, ratio of GPU memory needed to the size
+            of the models, accounting for activations and workspace
+    """
+
+    def __init__(self,
+                 num_models,
+                 model_bytes,
+                 cpu_limit,
+                 memory_limit,
+                 gpu_memory=None,
+                 min_poll_wait_seconds=30,
+                 gpu_memory_overhead=4):
+        self.num_models = int(num_models)
+        self.model_bytes = int(model_bytes)
+        self.cpu_limit = float(cpu_limit or 0)
+        self.memory_limit = int(memory_limit or 0)
+        self.gpu_memory = int(gpu_memory or 0)
+        self.min_poll_wait_seconds = int(min_poll_wait_seconds)
+        self.gpu_memory_overhead = float(gpu_memory_overhead)
+
+        if self.num_models < 0 or self.model_bytes < 0:
+            raise ValueError('`num_models` and `model_bytes` must be '
+                             'non-negative integers. Got {} and {}.'.format(
+                                 self.num_models, self.model_bytes))
+
+        if self.cpu_limit <= 0 or self.memory_limit <= 0:
+            raise ValueError('`cpu_limit` and `memory_limit` must be '
+                             'positive. Got {} and {}.'.format(
+                                 self.cpu_limit, self.memory_limit))
+
+        super(ServerFlagsWriter, self).__init__()
+
+    def get_flags(self):
+        """Compute the server flags.
+
+        Returns:
+            dict: environment variable names and values read by serve.sh.
+        """
+        cpus = max(1, int(math.floor(self.cpu_limit)))
+
+        # Load models in parallel, but only as many as fit in memory at once
+        mean_model_bytes = self.model_bytes / max(1, self.num_models)
+        max_loads = int(self.memory_limit // max(1, 2 * mean_model_bytes))
+        num_load_threads = max(1, min(cpus, self.num_models, max_loads))
+
+        # Each poll lists every model base path in the bucket
+        poll_wait_seconds = max(self.min_poll_wait_seconds, self.num_models)
+
+        flags = {
+            'NUM_LOAD_THREADS': num_load_threads,
+            'NUM_UNLOAD_THREADS': max(1, num_load_threads // 2),
+            'TF_INTRA_OP_PARALLELISM': cpus,
+            'TF_INTER_OP_PARALLELISM': max(1, cpus // 2),
+            'FILE_SYSTEM_POLL_WAIT_SECONDS': poll_wait_seconds,
+        }
+
+        if self.gpu_memory:
+            required = self.model_bytes * self.gpu_memory_overhead
+            if required > self.gpu_memory:
+                self.logger.warning('Models may need %s bytes but the GPU '
+                                    'has %s bytes.', required, self.gpu_memory)
+            fraction = min(0.95, max(0.5, required / self.gpu_memory))
+            flags['PER_PROCESS_GPU_MEMORY_FRACTION'] = round(fraction, 2)
+
+        return flags
+
+    def write(self, path):
+        """Create server flags environment file and save to `path`.
+
+        Args:
+            path: str, the filepath of the environment file to write.
+        """
+        self.logger.debug('Writing server flags file to %s', path)
+        with open(path, 'w+') as config_file:
+            for name, value in sorted(self.get_flags().items()):
+                config_file.write('{}={}\n'.format(name, value))
+
+
 class ModelConfigWriter(ConfigWriter):
     """Abstract Class for ModelConfigWriter
     Reads all servable models from a cloud bucket
     and writes them in a config file for TensorFlow Serving.
+
+    Args:
+        bucket: str, name of the cloud storage bucket
+        model_prefix: str, prefix of the model directory in the bucket
+        protocol: str, storage protocol used in the model URLs
+        version_labels: dict, mapping of model name to a dict of
+            version labels, e.g. {"model": {"stable": 1, "canary": 2}}
+        model_versions: dict, mapping of model name to a list of versions
+            to serve with a "specific" policy. Models not in this mapping
+            serve all versions.
+        use_manifest: bool, whether to read the models from the manifest
+            published at the model_prefix instead of listing the bucket.
+            The bucket is listed if the manifest is missing or stale.
+        max_manifest_age: float, seconds after which a manifest is stale.
+            Manifests never go stale if 0.
+        manifest_cache_dir: str, directory to keep the last manifest in,
+            so it is only downloaded again if it changed.
+
+    The bucket is listed once and the listing is reused for the config
+    and the model sizes, until `clear_catalog` is called.
     """
 
-    def __init__(self, bucket, model_prefix, protocol=None):
+    manifest_name = 'manifest.json'
+    manifest_version = 1
+
+    def __init__(self, bucket, model_prefix, protocol=None,
+                 version_labels=None, model_versions=None,
+                 use_manifest=False, max_manifest_age=0,
+                 manifest_cache_dir=None):
         self._storage_protocol = protocol
         self.bucket = bucket
         self.model_prefix = model_prefix
+        self.version_labels = dict(version_labels or {})
+        self.model_versions = dict(model_versions or {})
+        self.use_manifest = bool(use_manifest)
+        self.max_manifest_age = float(max_manifest_age or 0)
+        self.manifest_cache_dir = manifest_cache_dir
+        self._manifest = None  # (etag, manifest) of the last read
+        self._catalog = None  # the last listing of the bucket
 
         # Normalize model prefix
         if not self.model_prefix.endswith('/'):
@@ -199,16 +334,9 @@ class ModelConfigWriter(ConfigWriter):
             config_file.write('model_config_list: {\n')
 
             i = 0
-            for model in self._get_models_from_bucket():
+            for model in self._get_models():
                 url = self.get_model_url(model)
-                config_file.write('    config: {\n')
-                config_file.write('        name: "{}"\n'.format(model))
-                config_file.write('        base_path: "{}"\n'.format(url))
-                config_file.write('        model_platform: "tensorflow"\n')
-                config_file.write('        model_version_policy: {\n')
-                config_file.write('            all: {}\n')
-                config_file.write('        }\n')
-                config_file.write('    }\n')
+                self._write_model(config_file, model, url)
                 i += 1
 
             if not i:
@@ -219,12 +347,253 @@ class ModelConfigWriter(ConfigWriter):
 
         self.logger.info('Successfully wrote %s', path)
 
+    def label_version(self, model, label, version):
+        """Label a version of a model.
+
+        TensorFlow Serving only labels versions it serves, so the version
+        is added to the "specific" policy of a model with pinned versions.
+
+        Args:
+            model: str, name of the model.
+            label: str, the version label.
+            version: int, the labeled version.
+        """
+        version = int(version)
+        versions = self.model_versions.get(model)
+        if versions and version not in set(int(v) for v in versions):
+            self.model_versions[model] = sorted(
+                set(int(v) for v in versions) | {version})
+        self.version_labels.setdefault(model, {})[label] = version
+
+    def _write_model(self, config_file, model, url):
+        """Write a single model entry to the open config file.
+
+        Args:
+            config_file: file, the open model config file.
+            model: str, name of the model.
+            url: str, base path of the model.
+        """
+        config_file.write('    config: {\n')
+        config_file.write('        name: "{}"\n'.format(model))
+        config_file.write('        base_path: "{}"\n'.format(url))
+        config_file.write('        model_platform: "tensorflow"\n')
+        config_file.write('        model_version_policy: {\n')
+
+        versions = self.model_versions.get(model)
+        if versions:
+            config_file.write('            specific: {\n')
+            for version in sorted(set(int(v) for v in versions)):
+                config_file.write(
+                    '                versions: {}\n'.format(version))
+            config_file.write('            }\n')
+        else:
+            config_file.write('            all: {}\n')
+        config_file.write('        }\n')
+
+        labels = self.version_labels.get(model, {})
+        for label, version in sorted(labels.items()):
+            config_file.write('        version_labels: {\n')
+            config_file.write('            key: "{}"\n'.format(label))
+            config_file.write('            value: {}\n'.format(int(version)))
+            config_file.write('        }\n')
+
+        config_file.write('    }\n')
+
+    def get_model_sizes(self):
+        """Get the total size of each servable model in the bucket
+        # Returns:
+            sizes: dict of model name to the size in bytes of all versions
+        """
+        manifest = self.read_manifest() if self.use_manifest else None
+        if manifest is not None:
+            return {name: model['size']
+                    for name, model in manifest['models'].items()}
+
+        return {name: model['size']
+                for name, model in self._get_catalog().items()}
+
+    def clear_catalog(self):
+        """Forget the listing of the bucket, e.g. after adding versions."""
+        self._catalog = None
+
+    def _get_catalog(self):
+        """List the bucket once and describe each servable model
+        # Returns:
+            models: dict of model name to its total "size" and the "size",
+                number of "objects" and "etag" of each of its "versions".
+                The etag of a version is a digest of its objects' ETags.
+        """
+        if self._catalog is None:
+            self._catalog = self._list_catalog()
+        return self._catalog
+
+    def _list_catalog(self):
+        objects = list(self._list_objects())
+        models = set(self._filter_models(key for key, _, _ in objects))
+
+        catalog = {model: {'size': 0, 'versions': {}} for model in models}
+        digests = {}
+        for key, size, etag in sorted(objects):
+            if not key.startswith(self.model_prefix):
+                continue
+            parts = key[len(self.model_prefix):].split('/')
+            if parts[0] not in catalog:
+                continue
+
+            model = catalog[parts[0]]
+            model['size'] += size
+            if len(parts) > 2 and parts[1].isdigit():
+                version = model['versions'].setdefault(
+                    str(int(parts[1])), {'size': 0, 'objects': 0})
+                version['size'] += size
+                version['objects'] += 1
+                digest = digests.setdefault((parts[0], parts[1]),
+                                            hashlib.sha256())
+                digest.update('{}:{}\n'.format(
+                    '/'.join(parts[2:]), etag).encode('utf-8'))
+
+        for (model, version), digest in digests.items():
+            catalog[model]['versions'][str(int(version))]['etag'] = \
+                digest.hexdigest()
+        return catalog
+
+    def get_manifest(self):
+        """List the bucket and describe its models in a manifest
+        # Returns:
+            manifest: dict of the models, checksummed with
+                `get_manifest_checksum`
+        """
+        self.clear_catalog()
+        models = self._get_catalog()
+        return {
+            'manifest_version': self.manifest_version,
+            'bucket': self.bucket,
+            'prefix': self.model_prefix,
+            'created': time.time(),
+            'models': models,
+            'checksum': get_manifest_checksum(models),
+        }
+
+    def get_manifest_key(self):
+        return '{}{}'.format(self.model_prefix, self.manifest_name)
+
+    def publish_manifest(self):
+        """Write the manifest of the bucket to the model_prefix
+        # Returns:
+            manifest: dict, the published manifest
+        """
+        manifest = self.get_manifest()
+        body = json.dumps(manifest, indent=2, sort_keys=True)
+        self._put_object(self.get_manifest_key(), body.encode('utf-8'))
+        self.logger.info('Published manifest of %s models to %s.',
+                         len(manifest['models']),
+                         self.get_model_url(self.manifest_name))
+        return manifest
+
+    def _get_manifest_cache_path(self):
+        url = self.get_model_url(self.manifest_name)
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.manifest_cache_dir, '{}.json'.format(name))
+
+    def _load_cached_manifest(self):
+        """Get the ETag and manifest of the last read, if any."""
+        if self._manifest is not None or not self.manifest_cache_dir:
+            return self._manifest
+        try:
+            with open(self._get_manifest_cache_path()) as f:
+                cached = json.load(f)
+            self._manifest = (cached['etag'], cached['manifest'])
+        except (OSError, ValueError, KeyError):
+            pass
+        return self._manifest
+
+    def _save_cached_manifest(self, etag, manifest):
+        self._manifest = (etag, manifest)
+        if not self.manifest_cache_dir:
+            return
+        if not os.path.isdir(self.manifest_cache_dir):
+            os.makedirs(self.manifest_cache_dir)
+        with open(self._get_manifest_cache_path(), 'w') as f:
+            json.dump({'etag': etag, 'manifest': manifest}, f)
+
+    def read_manifest(self):
+        """Read the published manifest with a single conditional request
+        # Returns:
+            manifest: dict, the manifest, or None if it is missing,
+                invalid or older than max_manifest_age.
+        """
+        url = self.get_model_url(self.manifest_name)
+        cached = self._load_cached_manifest()
+        try:
+            body, etag = self._get_object(self.get_manifest_key(),
+                                          etag=cached[0] if cached else None)
+        except KeyError:
+            self.logger.info('No manifest found at %s.', url)
+            return None
+
+        if body is None:
+            manifest = cached[1]
+        else:
+            try:
+                manifest = json.loads(body.decode('utf-8'))
+                validate_manifest(manifest)
+            except ValueError as err:
+                self.logger.warning('Invalid manifest at %s: %s', url, err)
+                return None
+            self._save_cached_manifest(etag, manifest)
+
+        age = time.time() - manifest['created']
+        if self.max_manifest_age and age > self.max_manifest_age:
+            self.logger.warning('Manifest at %s is stale (%.0fs old).',
+                                url, age)
+            return None
+        return manifest
+
+    def _get_models(self):
+        """Get the servable models from the manifest or the bucket
+        # Returns:
+            models: list of all servable models
+        """
+        manifest = self.read_manifest() if self.use_manifest else None
+        if manifest is None:
+            return self._get_models_from_bucket()
+        return iter(sorted(manifest['models']))
+
+    def _list_objects(self):
+        """List all objects in the cloud storage bucket
+        # Returns:
+            objects: tuples of the key, size in bytes and ETag (or
+                generation) of each object
+        """
+        raise NotImplementedError
+
+    def _get_object(self, key, etag=None):
+        """Download an object from the cloud storage bucket
+        # Arguments:
+            key: key of the object
+            etag: ETag (or generation) of the copy already downloaded
+        # Returns:
+            tuple: the body and ETag of the object. The body is None if
+                the object still matches `etag`.
+        # Raises:
+            KeyError: the object does not exist
+        """
+        raise NotImplementedError
+
+    def _put_object(self, key, body):
+        """Upload an object to the cloud storage bucket
+        # Arguments:
+            key: key of the object
+            body: bytes of the object
+        """
+        raise NotImplementedError
+
     def _get_models_from_bucket(self):
         """Query the cloud storage bucket for tensorflow servables
         # Returns:
             models: list of all servable models in the bucket and model_prefix
         """
-        raise NotImplementedError
+        return iter(sorted(self._get_catalog()))
 
 
 class S3ConfigWriter(ModelConfigWriter):
@@ -233,41 +602,246 @@ class S3ConfigWriter(ModelConfigWriter):
                  bucket,
                  model_prefix,
                  aws_access_key_id,
-                 aws_secret_access_key):
+                 aws_secret_access_key,
+                 endpoint_url=None,
+                 **kwargs):
+        # endpoint_url allows S3-compatible stores
         self.client = boto3.client(
             's3',
             aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key)
-        super(S3ConfigWriter, self).__init__(bucket, model_prefix, 's3')
+            aws_secret_access_key=aws_secret_access_key,
+            endpoint_url=endpoint_url or None)
+        super(S3ConfigWriter, self).__init__(
+            bucket, model_prefix, 's3', **kwargs)
 
-    def _get_models_from_bucket(self):
-        """Query the cloud storage bucket for tensorflow servables
+    def _list_objects(self):
+        """List all objects in the bucket with the model_prefix
         # Returns:
-            models: list of paths to folder containg servable model versions
+            objects: tuples of the key, size in bytes and ETag of each object
         """
-        directories_verbose = self.client.list_objects_v2(
-            Bucket=self.bucket, StartAfter=self.model_prefix)
-
-        directories = (d['Key'] for d in directories_verbose['Contents'])
-        for model in self._filter_models(directories):
-            yield model
+        kwargs = {'Bucket': self.bucket, 'Prefix': self.model_prefix}
+        while True:
+            directories_verbose = self.client.list_objects_v2(**kwargs)
+
+            for d in directories_verbose.get('Contents', []):
+                yield (d['Key'], int(d.get('Size', 0)),
+                       d.get('ETag', '').strip('"'))
+
+            if not directories_verbose.get('IsTruncated'):
+                break
+            kwargs['ContinuationToken'] = \
+                directories_verbose['NextContinuationToken']
+
+    def _get_object(self, key, etag=None):
+        kwargs = {'Bucket': self.bucket, 'Key': key}
+        if etag:
+            kwargs['IfNoneMatch'] = '"{}"'.format(etag)
+        try:
+            response = self.client.get_object(**kwargs)
+        except ClientError as err:
+            code = err.response.get('Error', {}).get('Code')
+            if code in ('304', 'NotModified'):
+                return None, etag
+            if code in ('404', 'NoSuchKey'):
+                raise KeyError(key)
+            raise
+        return response['Body'].read(), response['ETag'].strip('"')
+
+    def _put_object(self, key, body):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=body,
+                               ContentType='application/json')
 
 
 class GCSConfigWriter(ModelConfigWriter):
 
-    def __init__(self, bucket, model_prefix):
+    def __init__(self, bucket, model_prefix, **kwargs):
         self.client = storage.Client()
-        super(GCSConfigWriter, self).__init__(bucket, model_prefix, 'gs')
+        super(GCSConfigWriter, self).__init__(
+            bucket, model_prefix, 'gs', **kwargs)
 
-    def _get_models_from_bucket(self):
-        """Query the cloud storage bucket for tensorflow servables
+    def _list_objects(self):
+        """List all objects in the bucket with the model_prefix
         # Returns:
-            models: list of all servable models in the bucket and model_prefix
+            objects: tuples of the name, size in bytes and generation
+                of each blob
         """
         bucket = self.client.get_bucket(self.bucket)
-        blobs = (b.name for b in bucket.list_blobs(prefix=self.model_prefix))
-        for model in self._filter_models(blobs):
-            yield model
+        for b in bucket.list_blobs(prefix=self.model_prefix):
+            yield (b.name, int(getattr(b, 'size', None) or 0),
+                   str(getattr(b, 'generation', None) or ''))
+
+    def _get_object(self, key, etag=None):
+        # generations identify each write of a blob, the metadata request
+        # avoids downloading an unchanged blob
+        blob = self.client.bucket(self.bucket).get_blob(key)
+        if blob is None:
+            raise KeyError(key)
+        generation = str(blob.generation)
+        if etag and etag == generation:
+            return None, etag
+        return blob.download_as_string(), generation
+
+    def _put_object(self, key, body):
+        blob = self.client.bucket(self.bucket).blob(key)
+        blob.upload_from_string(body, content_type='application/json')
+
+
+class MultiSourceConfigWriter(ModelConfigWriter):
+    """Merges the models of several buckets and prefixes into one config.
+
+    The sources are listed concurrently. Models of a source with a namespace
+    are named "<namespace>.<model>". When several sources serve a model with
+    the same name, the `collision` policy decides the outcome:
+
+    - "precedence": the model of the earliest source is served.
+    - "namespace": the model of the earliest source keeps its name, the
+      others are named "<namespace>.<model>" with the bucket as namespace
+      if the source has none.
+    - "error": a ValueError is raised.
+
+    Args:
+        sources: list, ModelConfigWriters of each source in order of
+            precedence
+        namespaces: list, namespace of each source, or None
+        collision: str, one of "precedence", "namespace" or "error"
+    """
+
+    collisions = ('precedence', 'namespace', 'error')
+
+    def __init__(self, sources, namespaces=None, collision='precedence',
+                 **kwargs):
+        self.sources = list(sources)
+        self.namespaces = list(namespaces or [None] * len(self.sources))
+        self.collision = str(collision)
+
+        if not self.sources:
+            raise ValueError('At least one source is required.')
+
+        if len(self.namespaces) != len(self.sources):
+            raise ValueError('Got {} namespaces for {} sources.'.format(
+                len(self.namespaces), len(self.sources)))
+
+        if self.collision not in self.collisions:
+            raise ValueError('`collision` must be one of {}. Got "{}".'.format(
+                self.collisions, self.collision))
+
+        # name: (source index, model)
+        self._models = None
+        super(MultiSourceConfigWriter, self).__init__('', '', **kwargs)
+
+    def _list_sources(self, function):
+        """Call `function` with each source concurrently.
+
+        Returns:
+            list: the result of each source, in order.
+        """
+        with futures.ThreadPoolExecutor(len(self.sources)) as executor:
+            return list(executor.map(function, self.sources))
+
+    def _merge_models(self):
+        source_models = self._list_sources(lambda w: list(w._get_models()))
+
+        models = {}
+        for i, names in enumerate(source_models):
+            namespace = self.namespaces[i]
+            for model in names:
+                name = model
+                if namespace:
+                    name = '{}.{}'.format(namespace, model)
+
+                if name in models:
+                    if self.collision == 'error':
+                        raise ValueError('Model "{}" is served from {} and {}'
+                                         .format(name,
+                                                 self.sources[models[name][0]]
+                                                 .get_model_url(model),
+                                                 self.sources[i]
+                                                 .get_model_url(model)))
+
+                    if self.collision == 'precedence':
+                        self.logger.warning(
+                            'Model "%s" of %s is shadowed by %s.', name,
+                            self.sources[i].get_model_url(model),
+                            self.sources[models[name][0]].get_model_url(
+                                models[name][1]))
+                        continue
+
+                    name = '{}.{}'.format(
+                        namespace or self.sources[i].bucket, model)
+                    if name in models:
+                        raise ValueError('Model "{}" is served from {} '
+                                         'twice.'.format(name, namespace))
+
+                models[name] = (i, model)
+        self._models = models
+        return models
+
+    def _get_merged_models(self):
+        if self._models is None:
+            self._merge_models()
+        return self._models
+
+    def clear_catalog(self):
+        self._models = None
+        for source in self.sources:
+            source.clear_catalog()
+
+    def get_model_url(self, model):
+        """Get the URL of a merged model in its source bucket."""
+        i, source_model = self._get_merged_models()[model]
+        return self.sources[i].get_model_url(source_model)
+
+    def get_model_sizes(self):
+        """Get the total size of each merged model."""
+        models = self._get_merged_models()
+        sizes = self._list_sources(lambda w: w.get_model_sizes())
+        return {name: sizes[i].get(model, 0)
+                for name, (i, model) in models.items()}
+
+    def _get_models_from_bucket(self):
+        """List all sources concurrently and merge their models
+        # Returns:
+            models: list of the merged names of all servable models
+        """
+        for name in sorted(self._get_merged_models()):
+            yield name
+
+
+def get_manifest_checksum(models):
+    """Get the SHA-256 checksum of the models of a manifest.
+
+    Args:
+        models (dict): the models of the manifest.
+
+    Returns:
+        str: the checksum, e.g. "sha256:<hex digest>".
+    """
+    body = json.dumps(models, sort_keys=True, separators=(',', ':'))
+    return 'sha256:{}'.format(hashlib.sha256(body.encode('utf-8')).hexdigest())
+
+
+def validate_manifest(manifest):
+    """Check the version and checksum of a manifest.
+
+    Args:
+        manifest (dict): the manifest written by `publish_manifest`.
+
+    Raises:
+        ValueError: the manifest is of another version or is corrupted.
+    """
+    if not isinstance(manifest, dict):
+        raise ValueError('Manifest is not an object.')
+
+    version = manifest.get('manifest_version')
+    if version != ModelConfigWriter.manifest_version:
+        raise ValueError('Unsupported manifest version {}.'.format(version))
+
+    for key in ('created', 'models', 'checksum'):
+        if key not in manifest:
+            raise ValueError('Manifest has no "{}".'.format(key))
+
+    if get_manifest_checksum(manifest['models']) != manifest['checksum']:
+        raise ValueError('Manifest checksum does not match its models.')
 
 
 def get_model_config_writer(bucket):
@@ -29,6 +29,7 @@ from __future__ import division
 from __future__ import print_function
 
 import contextlib
+import json
 import os
 import shutil
 import tempfile
@@ -36,6 +37,8 @@ import six
 
 import pytest
 
+from botocore.exceptions import ClientError
+
 import writers
 
 
@@ -167,6 +170,89 @@ class TestBatchConfigWriter(object):
                 assert x in content
 
 
+class TestServerFlagsWriter(object):
+
+    def test_bad_inputs(self):
+        with pytest.raises(ValueError):
+            writers.ServerFlagsWriter(num_models=-1, model_bytes=0,
+                                      cpu_limit=1, memory_limit=1)
+
+        with pytest.raises(ValueError):
+            writers.ServerFlagsWriter(num_models=1, model_bytes=-1,
+                                      cpu_limit=1, memory_limit=1)
+
+        with pytest.raises(ValueError):
+            writers.ServerFlagsWriter(num_models=1, model_bytes=1,
+                                      cpu_limit=-1, memory_limit=1)
+
+        # the limits of the server are required
+        with pytest.raises(ValueError):
+            writers.ServerFlagsWriter(num_models=1, model_bytes=1,
+                                      cpu_limit='', memory_limit=1)
+
+        with pytest.raises(ValueError):
+            writers.ServerFlagsWriter(num_models=1, model_bytes=1,
+                                      cpu_limit=1, memory_limit='')
+
+    def test_get_flags(self):
+        gb = 1024 ** 3
+
+        writer = writers.ServerFlagsWriter(
+            num_models=10, model_bytes=10 * gb,
+            cpu_limit='4.5', memory_limit=16 * gb)
+        flags = writer.get_flags()
+        assert flags['NUM_LOAD_THREADS'] == 4
+        assert flags['NUM_UNLOAD_THREADS'] == 2
+        assert flags['TF_INTRA_OP_PARALLELISM'] == 4
+        assert flags['TF_INTER_OP_PARALLELISM'] == 2
+        assert flags['FILE_SYSTEM_POLL_WAIT_SECONDS'] == 30
+        assert 'GRPC_MAX_MESSAGE_BYTES' not in flags
+        assert 'PER_PROCESS_GPU_MEMORY_FRACTION' not in flags
+
+        # fewer models than CPUs
+        writer = writers.ServerFlagsWriter(
+            num_models=2, model_bytes=gb, cpu_limit=8, memory_limit=4 * gb)
+        assert writer.get_flags()['NUM_LOAD_THREADS'] == 2
+
+        # parallel loads are limited by memory
+        writer = writers.ServerFlagsWriter(
+            num_models=8, model_bytes=8 * gb, cpu_limit=8, memory_limit=gb)
+        flags = writer.get_flags()
+        assert flags['NUM_LOAD_THREADS'] == 1
+        assert flags['NUM_UNLOAD_THREADS'] == 1
+
+        # poll less often with many models
+        writer = writers.ServerFlagsWriter(
+            num_models=100, model_bytes=gb, cpu_limit=1, memory_limit=gb)
+        assert writer.get_flags()['FILE_SYSTEM_POLL_WAIT_SECONDS'] == 100
+
+        # GPU memory fraction
+        writer = writers.ServerFlagsWriter(
+            num_models=1, model_bytes=gb, cpu_limit=1, memory_limit=gb,
+            gpu_memory=16 * gb)
+        fraction = writer.get_flags()['PER_PROCESS_GPU_MEMORY_FRACTION']
+        assert fraction == 0.5
+
+        writer.gpu_memory = 4 * gb
+        fraction = writer.get_flags()['PER_PROCESS_GPU_MEMORY_FRACTION']
+        assert fraction == 0.95
+
+    def test_write(self, tmpdir):
+        writer = writers.ServerFlagsWriter(
+            num_models=2, model_bytes=1024, cpu_limit=2, memory_limit=2048)
+
+        path = os.path.join(str(tmpdir), 'server_flags.env')
+        writer.write(path)
+
+        with open(path) as f:
+            content = f.readlines()
+
+        flags = writer.get_flags()
+        assert len(content) == len(flags)
+        for name, value in flags.items():
+            assert '{}={}\n'.format(name, value) in content
+
+
 class TestModelConfigWriter(object):
 
     def _get_writer(self):
@@ -249,10 +335,234 @@ class TestModelConfigWriter(object):
         with pytest.raises(Exception):
             writer.write(path)
 
+    def test_write_versions_and_labels(self, tmpdir, mocker):
+        writer = self._get_writer()
+        writer.model_versions = {'a': [2, 1]}
+        writer.version_labels = {'a': {'stable': 1, 'canary': 2}}
+        mocker.patch.object(writer, '_get_models_from_bucket',
+                            lambda: ['a', 'b'])
+
+        path = os.path.join(str(tmpdir), 'model.conf')
+        writer.write(path)
+
+        clean = lambda x: x.replace(' ', '').replace('\n', '')
+        with open(path) as f:
+            content = [clean(c) for c in f.readlines()]
+
+        # model "a" is served with a specific policy and labels
+        a = content[:content.index('name:"b"')]
+        assert a.count('specific:{') == 1
+        assert a.index('versions:1') < a.index('versions:2')
+        assert 'all:{}' not in a
+        assert a.count('version_labels:{') == 2
+        assert a[a.index('key:"canary"') + 1] == 'value:2'
+        assert a[a.index('key:"stable"') + 1] == 'value:1'
+
+        # model "b" is unchanged
+        b = content[content.index('name:"b"'):]
+        assert 'all:{}' in b
+        assert 'version_labels:{' not in b
+
+    def test_label_version(self, tmpdir, mocker):
+        writer = self._get_writer()
+        writer.model_versions = {'a': [2]}
+        mocker.patch.object(writer, '_get_models_from_bucket',
+                            lambda: ['a', 'b'])
+
+        # labeled versions of pinned models are served
+        writer.label_version('a', 'optimized', 3)
+        writer.label_version('b', 'optimized', 2)
+        assert writer.model_versions == {'a': [2, 3]}
+        assert writer.version_labels == {
+            'a': {'optimized': 3}, 'b': {'optimized': 2}}
+
+        writer.label_version('a', 'stable', 2)
+        assert writer.model_versions == {'a': [2, 3]}
+
+        path = os.path.join(str(tmpdir), 'model.conf')
+        writer.write(path)
+        models = writers.read_model_config(path)
+        assert models[0]['versions'] == [2, 3]
+        assert models[0]['version_labels'] == {'optimized': 3, 'stable': 2}
+        assert models[1]['versions'] is None
+
+    def test_get_model_sizes(self, tmpdir, mocker):
+        writer = self._get_writer()
+        pre = writer.model_prefix
+        objects = [
+            ('{}a/1/saved_model.pb'.format(pre), 10, 'e1'),
+            ('{}a/1/variables/variables.data'.format(pre), 100, 'e2'),
+            ('{}a/2/saved_model.pb'.format(pre), 20, 'e3'),
+            ('{}b/1/saved_model.pb'.format(pre), 5, 'e4'),
+            ('{}c/not_a_model'.format(pre), 1000, 'e5'),
+            ('other/d/1/saved_model.pb', 1000, 'e6'),
+        ]
+        listings = []
+
+        def list_objects():
+            listings.append(1)
+            return iter(objects)
+
+        mocker.patch.object(writer, '_list_objects', list_objects)
+        assert writer.get_model_sizes() == {'a': 130, 'b': 5}
+
+        # the listing is reused to write the config
+        writer.write(os.path.join(str(tmpdir), 'models.conf'))
+        assert len(listings) == 1
+
+        writer.clear_catalog()
+        assert writer.get_model_sizes() == {'a': 130, 'b': 5}
+        assert len(listings) == 2
+
+        with pytest.raises(NotImplementedError):
+            list(self._get_writer()._list_objects())
+
+    def _get_manifest_writer(self, mocker, objects, store, **kwargs):
+        writer = writers.writers.ModelConfigWriter(
+            'test-bucket', 'models', protocol='test', **kwargs)
+        requests = []
+
+        def get_object(key, etag=None):
+            requests.append((key, etag))
+            if key not in store:
+                raise KeyError(key)
+            body, current = store[key]
+            return (None, etag) if etag == current else (body, current)
+
+        def put_object(key, body):
+            store[key] = (body, str(len(store) + 1))
+
+        mocker.patch.object(writer, '_list_objects', lambda: iter(objects))
+        mocker.patch.object(writer, '_get_models_from_bucket',
+                            lambda: writer._filter_models(
+                                key for key, _, _ in objects))
+        mocker.patch.object(writer, '_get_object', get_object)
+        mocker.patch.object(writer, '_put_object', put_object)
+        return writer, requests
+
+    def test_get_manifest(self, mocker):
+        objects = [
+            ('models/a/1/saved_model.pb', 10, 'e1'),
+            ('models/a/1/variables/variables.data', 100, 'e2'),
+            ('models/a/2/saved_model.pb', 20, 'e3'),
+            ('models/a/optimizations/2.json', 1, 'e4'),
+            ('models/b/1/saved_model.pb', 5, 'e5'),
+            ('models/c/not_a_model', 1000, 'e6'),
+        ]
+        writer, _ = self._get_manifest_writer(mocker, objects, {})
+
+        manifest = writer.get_manifest()
+        writers.writers.validate_manifest(manifest)
+        assert manifest['bucket'] == 'test-bucket'
+        assert manifest['prefix'] == 'models/'
+
+        models = manifest['models']
+        assert sorted(models) == ['a', 'b']
+        assert models['a']['size'] == 131
+        assert sorted(models['a']['versions']) == ['1', '2']
+        assert models['a']['versions']['1']['size'] == 110
+        assert models['a']['versions']['1']['objects'] == 2
+
+        # the etag of a version changes with its objects
+        objects[1] = ('models/a/1/variables/variables.data', 100, 'new')
+        versions = writer.get_manifest()['models']['a']['versions']
+        assert versions['1']['etag'] != models['a']['versions']['1']['etag']
+        assert versions['2']['etag'] == models['a']['versions']['2']['etag']
+
+    def test_read_manifest(self, tmpdir, mocker):
+        objects = [
+            ('models/a/1/saved_model.pb', 10, 'e1'),
+            ('models/b/1/saved_model.pb', 5, 'e2'),
+        ]
+        store = {}
+        cache_dir = os.path.join(str(tmpdir), 'manifests')
+        writer, requests = self._get_manifest_writer(
+            mocker, objects, store, use_manifest=True,
+            manifest_cache_dir=cache_dir)
+
+        # the bucket is listed without a manifest
+        assert writer.read_manifest() is None
+        assert list(writer._get_models()) == ['a', 'b']
+
+        published = writer.publish_manifest()
+        assert 'models/manifest.json' in store
+
+        # the manifest is used instead of the listing
+        del objects[:]
+        assert writer.read_manifest() == published
+        assert list(writer._get_models()) == ['a', 'b']
+        assert writer.get_model_sizes() == {'a': 10, 'b': 5}
+
+        # unchanged manifests are not downloaded again, even by new writers
+        writer, requests = self._get_manifest_writer(
+            mocker, objects, store, use_manifest=True,
+            manifest_cache_dir=cache_dir)
+        assert writer.read_manifest() == published
+        assert requests == [('models/manifest.json', '1')]
+
+        path = os.path.join(str(tmpdir), 'models.conf')
+        writer.write(path)
+        models = writers.read_model_config(path)
+        assert [m['name'] for m in models] == ['a', 'b']
+
+    def test_read_manifest_fallback(self, mocker):
+        objects = [('models/a/1/saved_model.pb', 10, 'e1')]
+        store = {}
+        writer, _ = self._get_manifest_writer(
+            mocker, objects, store, use_manifest=True, max_manifest_age=60)
+        writer.publish_manifest()
+        assert writer.read_manifest() is not None
+
+        # stale manifests are not used
+        body = json.loads(store['models/manifest.json'][0].decode('utf-8'))
+        body['created'] -= 120
+        store['models/manifest.json'] = (json.dumps(body).encode(), 'old')
+        assert writer.read_manifest() is None
+
+        # neither are corrupted manifests
+        body['created'] += 120
+        body['models']['b'] = body['models']['a']
+        store['models/manifest.json'] = (json.dumps(body).encode(), 'bad')
+        assert writer.read_manifest() is None
+
+        store['models/manifest.json'] = (b'not json', 'text')
+        assert writer.read_manifest() is None
+
+        # the listing is used instead
+        objects.append(('models/c/1/saved_model.pb', 10, 'e2'))
+        assert list(writer._get_models()) == ['a', 'c']
+
     def test_get_models_from_bucket(self):
         with pytest.raises(NotImplementedError):
             self._get_writer()._get_models_from_bucket()
 
+        with pytest.raises(NotImplementedError):
+            self._get_writer()._get_object('key')
+
+        with pytest.raises(NotImplementedError):
+            self._get_writer()._put_object('key', b'')
+
+
+def test_validate_manifest():
+    models = {'a': {'size': 1, 'versions': {}}}
+    manifest = {
+        'manifest_version': 1,
+        'created': 0,
+        'models': models,
+        'checksum': writers.writers.get_manifest_checksum(models),
+    }
+    writers.writers.validate_manifest(manifest)
+
+    bad_manifests = [
+        [],
+        dict(manifest, manifest_version=2),
+        {k: v for k, v in manifest.items() if k != 'created'},
+        dict(manifest, checksum='sha256:0'),
+    ]
+    for bad in bad_manifests:
+        with pytest.raises(ValueError):
+            writers.writers.validate_manifest(bad)
+
 
 class TestS3ConfigWriter(object):
 
@@ -268,9 +578,17 @@ class TestS3ConfigWriter(object):
                 for i in range(self.num):
                     yield {'Key': '{}/{}/model.pb'.format(pre, i)}
 
-            def list_objects_v2(self, Bucket, StartAfter):
+            def list_objects_v2(self, Bucket, Prefix,
+                                ContinuationToken=None):
+                # only the objects under the model prefix are listed
+                assert Prefix == '{}/'.format(self.prefix)
+                # return the objects over two pages
                 contents = [x for x in self._iter()]
-                return {'Contents': contents}
+                if ContinuationToken is None:
+                    return {'Contents': contents[:1],
+                            'IsTruncated': True,
+                            'NextContinuationToken': 'token'}
+                return {'Contents': contents[1:]}
 
         N = 3
         bucket = 'test-bucket'
@@ -310,6 +628,60 @@ class TestS3ConfigWriter(object):
         with pytest.raises(Exception):
             writer.write(path)
 
+    def test_manifest(self, mocker):
+
+        class DummyBody(object):
+            def __init__(self, body):
+                self.body = body
+
+            def read(self):
+                return self.body
+
+        class DummyClient(object):
+            def __init__(self):
+                self.objects = {}
+
+            def list_objects_v2(self, Bucket, Prefix):
+                assert Prefix == 'models/'
+                return {'Contents': [
+                    {'Key': 'models/a/1/saved_model.pb', 'Size': 3,
+                     'ETag': '"e1"'}]}
+
+            def put_object(self, Bucket, Key, Body, ContentType):
+                self.objects[Key] = (Body, '"{}"'.format(len(Body)))
+
+            def get_object(self, Bucket, Key, IfNoneMatch=None):
+                if Key not in self.objects:
+                    error = {'Error': {'Code': 'NoSuchKey'}}
+                    raise ClientError(error, 'GetObject')
+                body, etag = self.objects[Key]
+                if IfNoneMatch == etag:
+                    error = {'Error': {'Code': '304'}}
+                    raise ClientError(error, 'GetObject')
+                if IfNoneMatch == '"denied"':
+                    error = {'Error': {'Code': 'AccessDenied'}}
+                    raise ClientError(error, 'GetObject')
+                return {'Body': DummyBody(body), 'ETag': etag}
+
+        client = DummyClient()
+        mocker.patch('writers.writers.boto3.client', lambda *x, **_: client)
+
+        writer = writers.S3ConfigWriter('test-bucket', 'models', 'id', 'key',
+                                        use_manifest=True)
+        with pytest.raises(KeyError):
+            writer._get_object('models/manifest.json')
+
+        manifest = writer.publish_manifest()
+        assert manifest['models']['a']['size'] == 3
+
+        body, etag = writer._get_object('models/manifest.json')
+        assert json.loads(body.decode('utf-8')) == manifest
+        assert writer._get_object('models/manifest.json', etag) == (
+            None, etag)
+
+        with pytest.raises(ClientError):
+            writer._get_object('models/manifest.json', 'denied')
+
 
 class TestGSCConfigWriter(object):
 
@@ -369,3 +741,159 @@ class TestGSCConfigWriter(object):
         path = os.path.join(str(tmpdir), 'model.conf')
         with pytest.raises(Exception):
             writer.write(path)
+
+
+class TestMultiSourceConfigWriter(object):
+
+    def _get_source(self, mocker, bucket, models, protocol='test'):
+        writer = writers.writers.ModelConfigWriter(
+            bucket, 'models', protocol=protocol)
+        mocker.patch.object(writer, '_get_models_from_bucket',
+                            lambda: iter(models))
+        mocker.patch.object(writer, 'get_model_sizes',
+                            lambda: {m: len(m) for m in models})
+        return writer
+
+    def test_bad_inputs(self, mocker):
+        source = self._get_source(mocker, 'a', ['m'])
+
+        with pytest.raises(ValueError):
+            writers.MultiSourceConfigWriter([])
+
+        with pytest.raises(ValueError):
+            writers.MultiSourceConfigWriter([source], namespaces=['a', 'b'])
+
+        with pytest.raises(ValueError):
+            writers.MultiSourceConfigWriter([source], collision='other')
+
+    def test_precedence(self, tmpdir, mocker):
+        prod = self._get_source(mocker, 'prod', ['a', 'b'], 'gs')
+        exp = self._get_source(mocker, 'exp', ['b', 'c'], 's3')
+
+        writer = writers.MultiSourceConfigWriter(
+            [prod, exp], version_labels={'c': {'stable': 1}})
+        assert list(writer._get_models_from_bucket()) == ['a', 'b', 'c']
+        assert writer.get_model_url('b') == prod.get_model_url('b')
+        assert writer.get_model_url('c') == exp.get_model_url('c')
+        assert writer.get_model_sizes() == {'a': 1, 'b': 1, 'c': 1}
+
+        path = os.path.join(str(tmpdir), 'models.conf')
+        writer.write(path)
+        models = writers.read_model_config(path)
+        assert [m['name'] for m in models] == ['a', 'b', 'c']
+        assert models[1]['base_path'] == 'gs://prod/models/b'
+        assert models[2]['base_path'] == 's3://exp/models/c'
+        assert models[2]['version_labels'] == {'stable': 1}
+
+    def test_list_once(self, tmpdir, mocker):
+        listings = []
+
+        def get_source(bucket, models):
+            writer = writers.writers.ModelConfigWriter(
+                bucket, 'models', protocol='test')
+            objects = [('models/{}/1/saved_model.pb'.format(m), 1, 'e')
+                       for m in models]
+
+            def list_objects():
+                listings.append(bucket)
+                return iter(objects)
+
+            mocker.patch.object(writer, '_list_objects', list_objects)
+            return writer
+
+        writer = writers.MultiSourceConfigWriter(
+            [get_source('prod', ['a', 'b']), get_source('exp', ['b', 'c'])])
+        writer.write(os.path.join(str(tmpdir), 'models.conf'))
+        assert writer.get_model_sizes() == {'a': 1, 'b': 1, 'c': 1}
+        assert sorted(listings) == ['exp', 'prod']
+
+    def test_namespace(self, mocker):
+        prod = self._get_source(mocker, 'prod', ['a', 'b'])
+        exp = self._get_source(mocker, 'exp', ['b', 'c'])
+        other = self._get_source(mocker, 'other', ['a'])
+
+        # only colliding models are namespaced
+        writer = writers.MultiSourceConfigWriter(
+            [prod, exp], collision='namespace')
+        assert list(writer._get_models_from_bucket()) == [
+            'a', 'b', 'c', 'exp.b']
+        assert writer.get_model_url('exp.b') == exp.get_model_url('b')
+
+        # explicit namespaces apply to all models of the source
+        writer = writers.MultiSourceConfigWriter(
+            [prod, exp, other], namespaces=[None, 'dev', None],
+            collision='namespace')
+        assert list(writer._get_models_from_bucket()) == [
+            'a', 'b', 'dev.b', 'dev.c', 'other.a']
+        assert writer.get_model_sizes()['dev.c'] == 1
+
+    def test_error(self, mocker):
+        prod = self._get_source(mocker, 'prod', ['a', 'b'])
+        exp = self._get_source(mocker, 'exp', ['b', 'c'])
+
+        writer = writers.MultiSourceConfigWriter(
+            [prod, exp], collision='error')
+        with pytest.raises(ValueError):
+            list(writer._get_models_from_bucket())
+
+        writer = writers.MultiSourceConfigWriter(
+            [prod, exp], namespaces=[None, 'exp'], collision='error')
+        assert list(writer._get_models_from_bucket()) == [
+            'a', 'b', 'exp.b', 'exp.c']
+
+    def test_manifest(self, mocker):
+
+        class DummyBlob(object):
+            def __init__(self, bucket, name):
+                self.bucket = bucket
+                self.name = name
+                self.size = 3
+                self.generation = None
+
+            def upload_from_string(self, body, content_type):
+                self.generation = len(self.bucket.blobs) + 1
+                self.bucket.blobs[self.name] = (body, self.generation)
+
+            def download_as_string(self):
+                return self.bucket.blobs[self.name][0]
+
+        class DummyBucket(object):
+            def __init__(self):
+                self.blobs = {}
+
+            def blob(self, name):
+                return DummyBlob(self, name)
+
+            def get_blob(self, name):
+                if name not in self.blobs:
+                    return None
+                blob = DummyBlob(self, name)
+                blob.generation = self.blobs[name][1]
+                return blob
+
+            def list_blobs(self, prefix):
+                yield DummyBlob(self, 'models/a/1/saved_model.pb')
+
+        class DummyClient(object):
+            def __init__(self):
+                self.dummy_bucket = DummyBucket()
+
+            def bucket(self, name):
+                return self.dummy_bucket
+
+            def get_bucket(self, name):
+                return self.dummy_bucket
+
+        mocker.patch('writers.writers.storage.Client', DummyClient)
+
+        writer = writers.GCSConfigWriter('test-bucket', 'models')
+        with pytest.raises(KeyError):
+            writer._get_object('models/manifest.json')
+
+        manifest = writer.publish_manifest()
+        assert manifest['models']['a']['size'] == 3
+
+        body, generation = writer._get_object('models/manifest.json')
+        assert json.loads(body.decode('utf-8')) == manifest
+        assert writer._get_object('models/manifest.json', generation) == (
+            None, generation)